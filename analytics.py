@@ -0,0 +1,217 @@
+"""
+Sales rollups.
+
+Revenue, units and order counts are kept pre-aggregated in
+``sales_rollups``, per hour and per day, overall and per category and
+product, so reports read a few hundred rows instead of scanning orders and
+order_items:
+
+    grain   dimension   dimension_id
+    hour    all         0
+    day     category    category id (0 = uncategorised)
+            product     product id (0 = deleted product)
+
+An order counts once it is approved (COUNTED_STATUSES) and is bucketed by
+when it was placed. Revenue is the sum of item subtotals, without shipping
+and tax. Category rows use each product's current category.
+
+record_status_change() adds an order to its buckets when it enters the
+counted statuses and takes it out again when it leaves them (cancelled
+after approval). Call it in the same transaction as the status change.
+Each bucket row is a single ``INSERT ... ON CONFLICT DO UPDATE SET
+revenue = revenue + excluded.revenue``, so concurrent transitions add up.
+
+``flask sales-backfill`` rebuilds a date range (or everything) from the
+orders table in bulk, with one INSERT ... SELECT ... GROUP BY per grain and
+dimension. Use it after loading orders directly (generate_data.py) or when
+a report looks off. Days whose orders were archived (archive.py) are left
+as they are, since the orders table no longer has them.
+"""
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, literal, select
+
+from archive import archive_horizon
+from models import db, upsert_insert
+from models.analytics import SalesRollup
+from models.order import Order, OrderItem
+from models.product import Product
+
+GRAINS = ('hour', 'day')
+DIMENSIONS = ('all', 'category', 'product')
+COUNTED_STATUSES = ('approved', 'processing', 'shipped', 'delivered')
+
+rollups = SalesRollup.__table__
+orders = Order.__table__
+order_items = OrderItem.__table__
+products = Product.__table__
+
+# strftime() formats matching how the sqlite dialect stores DateTime, so
+# backfilled buckets compare equal to ones written from Python
+_SQLITE_BUCKET = {'hour': '%Y-%m-%d %H:00:00.000000', 'day': '%Y-%m-%d 00:00:00.000000'}
+
+
+def bucket_start(when, grain):
+    """Start of the hour or day ``when`` falls in"""
+    if grain == 'hour':
+        return when.replace(minute=0, second=0, microsecond=0)
+    if grain == 'day':
+        return when.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f'Unknown rollup grain {grain!r}')
+
+
+def _bucket_expr(column, grain, dialect):
+    if dialect == 'postgresql':
+        return func.date_trunc(grain, column)
+    if dialect == 'sqlite':
+        return func.strftime(_SQLITE_BUCKET[grain], column)
+    raise NotImplementedError(f'Sales rollups are not implemented for {dialect}')
+
+
+def _dialect():
+    return db.engine.dialect.name
+
+
+def _order_rows(order, sign):
+    """Rollup rows for one order, with every measure multiplied by ``sign``"""
+    lines = db.session.execute(
+        select(func.coalesce(order_items.c.product_id, 0), func.coalesce(products.c.category_id, 0),
+               func.sum(order_items.c.quantity), func.sum(order_items.c.subtotal))
+        .select_from(order_items.outerjoin(products, products.c.id == order_items.c.product_id))
+        .where(order_items.c.order_id == order.id)
+        .group_by(order_items.c.product_id, products.c.category_id)
+    ).all()
+
+    totals = {}  # (dimension, id) -> [units, revenue]; the order counts once per key
+    for product_id, category_id, units, revenue in lines:
+        for key in (('all', 0), ('category', category_id), ('product', product_id)):
+            total = totals.setdefault(key, [0, 0])
+            total[0] += units
+            total[1] += revenue
+
+    rows = []
+    for grain in GRAINS:
+        bucket = bucket_start(order.created_at, grain)
+        for (dimension, dimension_id), (units, revenue) in sorted(totals.items()):
+            rows.append({'grain': grain, 'bucket': bucket, 'dimension': dimension, 'dimension_id': dimension_id,
+                         'orders': sign, 'units': sign * units, 'revenue': sign * revenue})
+    return rows
+
+
+def _upsert(rows):
+    statement = upsert_insert(rollups).values(rows)
+    statement = statement.on_conflict_do_update(
+        index_elements=['grain', 'dimension', 'dimension_id', 'bucket'],
+        set_={name: rollups.c[name] + statement.excluded[name] for name in ('orders', 'units', 'revenue')},
+    )
+    db.session.execute(statement)
+
+
+def record_status_change(order, previous_status):
+    """Add or remove an order's sales when it enters or leaves the counted statuses
+
+    Nothing is committed; call it in the transaction that changes the status,
+    and only once Order.change_status() has succeeded, so two concurrent
+    changes can't both count the order.
+    """
+    sign = (order.status in COUNTED_STATUSES) - (previous_status in COUNTED_STATUSES)
+    if sign == 0:
+        return
+    rows = _order_rows(order, sign)
+    if rows:
+        _upsert(rows)
+
+
+def backfill(start=None, end=None):
+    """Rebuild every rollup row for orders placed in [start, end); returns rows written
+
+    The range is widened to whole days. Without a range everything is
+    rebuilt, back to the archive horizon.
+    """
+    dialect = _dialect()
+    if start is not None:
+        start = bucket_start(start, 'day')
+    if end is not None:
+        end = bucket_start(end - timedelta(microseconds=1), 'day') + timedelta(days=1)
+    horizon = archive_horizon()
+    if horizon is not None and (start is None or start < horizon):
+        start = horizon
+    if start is not None and end is not None and end <= start:
+        return 0
+
+    clear = delete(rollups)
+    window = [orders.c.status.in_(COUNTED_STATUSES)]
+    if start is not None:
+        clear = clear.where(rollups.c.bucket >= start)
+        window.append(orders.c.created_at >= start)
+    if end is not None:
+        clear = clear.where(rollups.c.bucket < end)
+        window.append(orders.c.created_at < end)
+    db.session.execute(clear)
+
+    keys = {
+        'all': literal(0),
+        'category': func.coalesce(products.c.category_id, 0),
+        'product': func.coalesce(order_items.c.product_id, 0),
+    }
+    written = 0
+    for grain in GRAINS:
+        bucket = _bucket_expr(orders.c.created_at, grain, dialect)
+        for dimension in DIMENSIONS:
+            key = keys[dimension]
+            # 'all' has one row per bucket; a constant in GROUP BY would read as a column position
+            grouping = [bucket] if dimension == 'all' else [bucket, key]
+            result = db.session.execute(
+                insert(rollups).from_select(
+                    ['grain', 'bucket', 'dimension', 'dimension_id', 'orders', 'units', 'revenue'],
+                    select(literal(grain), bucket, literal(dimension), key,
+                           func.count(func.distinct(orders.c.id)), func.sum(order_items.c.quantity),
+                           func.sum(order_items.c.subtotal))
+                    .select_from(orders.join(order_items, order_items.c.order_id == orders.c.id)
+                                 .outerjoin(products, products.c.id == order_items.c.product_id))
+                    .where(*window)
+                    .group_by(*grouping)
+                )
+            )
+            written += result.rowcount
+    db.session.commit()
+    return written
+
+
+def sales_series(grain='day', start=None, end=None, dimension='all', dimension_id=0):
+    """Rollup rows for one series, oldest first, within [start, end)"""
+    query = SalesRollup.query.filter_by(grain=grain, dimension=dimension, dimension_id=dimension_id)
+    if start is not None:
+        query = query.filter(SalesRollup.bucket >= start)
+    if end is not None:
+        query = query.filter(SalesRollup.bucket < end)
+    return query.order_by(SalesRollup.bucket).all()
+
+
+def sales_totals(dimension='all', start=None, end=None, grain='day', limit=None):
+    """[(dimension_id, orders, units, revenue)] summed over [start, end), best sellers first"""
+    revenue = func.sum(rollups.c.revenue)
+    query = (select(rollups.c.dimension_id, func.sum(rollups.c.orders), func.sum(rollups.c.units), revenue)
+             .where(rollups.c.grain == grain, rollups.c.dimension == dimension)
+             .group_by(rollups.c.dimension_id)
+             .order_by(revenue.desc(), rollups.c.dimension_id))
+    if start is not None:
+        query = query.where(rollups.c.bucket >= start)
+    if end is not None:
+        query = query.where(rollups.c.bucket < end)
+    if limit:
+        query = query.limit(limit)
+    return [tuple(row) for row in db.session.execute(query).all()]
+
+
+def daily_series(days=30, now=None):
+    """The last ``days`` days as [(day, orders, units, revenue)], including days without sales"""
+    today = bucket_start(now or datetime.utcnow(), 'day')
+    start = today - timedelta(days=days - 1)
+    by_day = {row.bucket: row for row in sales_series('day', start, today + timedelta(days=1))}
+    series = []
+    for offset in range(days):
+        day = start + timedelta(days=offset)
+        row = by_day.get(day)
+        series.append((day, row.orders if row else 0, row.units if row else 0, float(row.revenue) if row else 0.0))
+    return series
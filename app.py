@@ -1,61 +1,226 @@
-import requests
-from flask import Flask, render_template, jsonify, request, redirect, url_for, session, flash
-from functools import wraps
-
-from werkzeug.security import generate_password_hash, check_password_hash
-from flask_jwt_extended import create_access_token
-from flask_jwt_extended import get_jwt_identity
-from flask_jwt_extended import jwt_required
-from flask_jwt_extended import JWTManager
-
-from models import db, init_db
-from models.user import User
-from models.category import Category
-from models.product import Product
-
-from flask_mail import Mail, Message
-import json
 import os
-import paypalrestsdk
+import time
+
+from flask import Flask
 
-from payments import BakongPayment
-from telegram import sendMessage
-from tabulate import tabulate
-import payments
 from config import config
 
-# Import admin blueprint
-from routes.admin import admin_bp
 
-app = Flask(__name__)
-app.config["JWT_SECRET_KEY"] = "fkdkasjfljdsfjas;klfjs"  # Change this!
-jwt = JWTManager(app)
-app.secret_key = "dsfijsdlfkasjdfjsadlkfj"
+def create_app(config_name=None):
+    """Application factory
+
+    Building the app never touches the database; create the schema with
+    ``flask --app app init-db`` (or ``python app.py`` in development).
+    Heavy optional libraries (tabulate, the PayPal/Bakong clients) are
+    imported where they are used, not here.
+    """
+    from flask_jwt_extended import JWTManager
+
+    from categories import init_categories
+    from connection_budget import configure_engine_options, init_connection_budget
+    from facets import init_facets
+    from models import db, init_db
+    from monitoring import (init_logging, init_memory_diagnostics, init_metrics, init_profiling,
+                            init_sql_instrumentation, init_tracing, init_traffic_capture)
+    from notifications import init_notifications
+    from payment_events import init_payment_events
+    from replicas import init_replicas
+    from routes.admin import admin_bp
+    from routes.payments import payments_bp
+    from routes.shop import shop_bp
+
+    app = Flask(__name__)
+    app.config["JWT_SECRET_KEY"] = "fkdkasjfljdsfjas;klfjs"  # Change this!
+    JWTManager(app)
+    app.secret_key = "dsfijsdlfkasjdfjsadlkfj"
+
+    # Load configuration
+    config_name = config_name or os.environ.get('FLASK_ENV', 'development')
+    app.config.from_object(config[config_name])
+
+    # JSON logs through a background queue, with a request id per request
+    init_logging(app)
+
+    # Ensure upload directories exist
+    os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'products'), exist_ok=True)
+
+    # Initialize database; pool sizing comes from the connection budget
+    configure_engine_options(app)
+    init_db(app)
+    with app.app_context():
+        init_connection_budget(app, db.engine)
+        replica_router = init_replicas(app, db)
+        engines = {'primary': db.engine}
+        engines.update((f'replica{i}', r.engine) for i, r in enumerate(replica_router.replicas))
+        init_sql_instrumentation(app, list(engines.values()))
+
+    # Initialize background notifiers
+    init_notifications(app)
+
+    # Stored payment webhooks, applied by a background worker
+    init_payment_events(app)
+
+    # Per-endpoint latency and subsystem gauges on /metrics
+    init_metrics(app, engines)
+
+    # Admin-triggered or sampled CPU + SQL profiles, listed at /admin/profiles
+    init_profiling(app)
+
+    # RSS growth and identity-map size per request, tracemalloc on demand
+    init_memory_diagnostics(app, db)
+
+    # Request, SQL, outbound and notification spans in one trace per checkout
+    init_tracing(app, engines, db)
+
+    # Scrubbed request log for replaying production traffic in load tests
+    init_traffic_capture(app)
+
+    # Category paths and product counts, maintained as categories and products change
+    init_categories(app)
+
+    # Per-process bitmap index for the storefront's facet counts
+    init_facets(app)
+
+    # Register blueprints
+    app.register_blueprint(shop_bp)
+    app.register_blueprint(payments_bp)
+    app.register_blueprint(admin_bp)
+
+    register_commands(app)
 
-# Load configuration
-config_name = os.environ.get('FLASK_ENV', 'development')
-app.config.from_object(config[config_name])
+    return app
 
-# Ensure upload directories exist
-os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'products'), exist_ok=True)
 
-# Initialize database
-init_db(app)
+def register_commands(app):
+    """Flask CLI commands for schema management, stock and sales"""
+    import click
 
-# Register admin blueprint
-app.register_blueprint(admin_bp)
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create tables if they don't exist and seed products"""
+        from models import db
+        db.create_all()
+        seed_products()
 
+    @app.cli.command('stock-snapshot')
+    def stock_snapshot_command():
+        """Record every product's on-hand stock (run periodically, e.g. nightly from cron)"""
+        from inventory import take_snapshot
+        count = take_snapshot()
+        print(f"✓ Recorded stock for {count} products")
+
+    @app.cli.command('stock-check')
+    def stock_check_command():
+        """Compare stock_quantity with the last snapshot plus the stock ledger since"""
+        import sys
+        from inventory import check_projection
+        drift = check_projection()
+        for product_id, stock_quantity, expected in drift:
+            print(f"✗ Product {product_id}: stock_quantity {stock_quantity}, ledger says {expected}")
+        if drift:
+            sys.exit(1)
+        print("✓ Stock matches the ledger")
+
+    @app.cli.command('ratings-check')
+    @click.option('--fix', is_flag=True, help='recompute drifted products from their reviews')
+    def ratings_check_command(fix):
+        """Compare products' rating aggregates with their reviews"""
+        import sys
+        from reviews import check_ratings
+        drift = check_ratings(fix=fix)
+        for product_id, (count, total), (real_count, real_total) in drift:
+            print(f"{'✓ Fixed' if fix else '✗'} Product {product_id}: {count} ratings totalling {total}, "
+                  f"reviews say {real_count} totalling {real_total}")
+        if drift and not fix:
+            sys.exit(1)
+        if not drift:
+            print("✓ Ratings match the reviews")
+
+    @app.cli.command('categories-check')
+    @click.option('--fix', is_flag=True, help='rewrite drifted paths and counts')
+    def categories_check_command(fix):
+        """Compare category paths and product counts with the tree"""
+        import sys
+        from categories import check_tree
+        drift = check_tree(fix=fix)
+        for category_id, (path, depth, count, total), (real_path, real_depth, real_count, real_total) in drift:
+            print(f"{'✓ Fixed' if fix else '✗'} Category {category_id}: path {path} ({count}/{total} products), "
+                  f"tree says {real_path} ({real_count}/{real_total} products)")
+        if drift and not fix:
+            sys.exit(1)
+        if not drift:
+            print("✓ Category paths and counts match the tree")
+
+    @app.cli.command('orders-archive')
+    @click.option('--days', type=int, help='closed orders older than this many days (default: ORDER_ARCHIVE_AFTER_DAYS)')
+    @click.option('--batch-size', type=int, default=500, show_default=True, help='orders per transaction')
+    def orders_archive_command(days, batch_size):
+        """Move old closed orders out of the live tables into archived_orders"""
+        import time
+        from archive import archive_orders
+        days = app.config['ORDER_ARCHIVE_AFTER_DAYS'] if days is None else days
+        start = time.perf_counter()
+        count = archive_orders(older_than_days=days, batch_size=batch_size)
+        print(f"✓ Archived {count} orders older than {days} days in {time.perf_counter() - start:.1f}s")
+
+    @app.cli.command('payments-process')
+    def payments_process_command():
+        """Apply stored payment webhook events (the app's worker does this too)"""
+        from payment_events import pending_count, process_pending
+        count = process_pending()
+        left = pending_count()
+        print(f"✓ Applied {count} payment events" + (f", {left} left to retry" if left else ""))
+
+    @app.cli.command('sales-backfill')
+    @click.option('--start', type=click.DateTime(), help='first day to rebuild (default: all)')
+    @click.option('--end', type=click.DateTime(), help='rebuild up to this day, exclusive')
+    def sales_backfill_command(start, end):
+        """Rebuild the sales rollups from the orders table"""
+        from analytics import backfill
+        count = backfill(start, end)
+        print(f"✓ Wrote {count} sales rollup rows")
+
+    @app.cli.command('recommendations-build')
+    @click.option('--full', is_flag=True, help='rebuild from every order instead of the ones since the last run')
+    @click.option('--k', default=10, show_default=True, help='neighbours kept per product')
+    @click.option('--metric', type=click.Choice(['cosine', 'lift']), default='cosine', show_default=True)
+    @click.option('--min-support', default=2, show_default=True, help='ignore pairs bought together less often')
+    def recommendations_build_command(full, k, metric, min_support):
+        """Build "frequently bought together" from order items (incremental unless --full)"""
+        from recommendations import build
+        start = time.perf_counter()
+        run = build(full=full, k=k, metric=metric, min_support=min_support)
+        print(f"✓ {run.kind.title()} build: {run.new_orders} new orders, {run.products_scored} products scored "
+              f"in {time.perf_counter() - start:.1f}s")
+
+    @app.cli.command('sales-report')
+    @click.option('--days', default=30, show_default=True, help='report on the last N days')
+    @click.option('--by', 'dimension', type=click.Choice(['day', 'product', 'category']), default='day',
+                  show_default=True)
+    @click.option('--limit', default=20, show_default=True, help='rows for --by product/category')
+    def sales_report_command(days, dimension, limit):
+        """Revenue, units and orders from the sales rollups"""
+        from tabulate import tabulate
+        from analytics import daily_series, sales_totals
+        from models import db
+        from models.category import Category
+        from models.product import Product
+
+        series = daily_series(days)
+        if dimension == 'day':
+            rows = [(day.date(), orders, units, f"{revenue:.2f}") for day, orders, units, revenue in series]
+            headers = ['Day', 'Orders', 'Units', 'Revenue']
+        else:
+            model = Product if dimension == 'product' else Category
+            totals = sales_totals(dimension, start=series[0][0], limit=limit)
+            names = dict(db.session.query(model.id, model.name)
+                         .filter(model.id.in_([row[0] for row in totals])).all())
+            rows = [(names.get(key, '-'), orders, units, f"{revenue:.2f}") for key, orders, units, revenue in totals]
+            headers = [dimension.title(), 'Orders', 'Units', 'Revenue']
+        print(tabulate(rows, headers=headers))
+        print(f"\nTotal revenue, last {days} days: ${sum(day[3] for day in series):.2f}")
 
-# Login required decorator - DEFINED AT MODULE LEVEL
-def login_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'user_id' not in session:
-            flash('Please log in to access this page.', 'warning')
-            return redirect(url_for('login'))
-        return f(*args, **kwargs)
 
-    return decorated_function
 
 PRODUCTS = [
     {
@@ -160,6 +325,9 @@ PRODUCTS = [
 # Add this function here
 def seed_products():
     """Seed database with initial products"""
+    from flask import current_app
+    from inventory import move_stock
+    from models import db
     from models.product import Product
     import re
 
@@ -172,10 +340,11 @@ def seed_products():
     # Check if products already exist
     existing_count = Product.query.count()
     if existing_count > 0:
-        print(f"Database already has {existing_count} products. Skipping seed.")
+        current_app.logger.info('Database already has products, skipping seed', extra={'products': existing_count})
         return
 
-    print("Seeding products into database...")
+    current_app.logger.info('Seeding products', extra={'products': len(PRODUCTS)})
+    started = time.perf_counter()
 
     for product_data in PRODUCTS:
         product = Product(
@@ -186,569 +355,34 @@ def seed_products():
             price=product_data['price'],
             compare_price=product_data.get('compare_price'),
             image_url=product_data['image'],
-            stock_quantity=product_data['stock_quantity'],
+            stock_quantity=0,
             weight=product_data.get('weight', 0),
+            brand=product_data.get('brand'),
             is_active=product_data.get('in_stock', True),
             is_featured=False,
             low_stock_threshold=10
         )
         db.session.add(product)
-
-    try:
-        db.session.commit()
-        print(f"✓ Successfully seeded {len(PRODUCTS)} products into database")
-    except Exception as e:
-        db.session.rollback()
-        print(f"✗ Error seeding products: {e}")
-
-paypalrestsdk.configure({
-    "mode": "sandbox",
-    "client_id": os.environ.get('PAYPAL_CLIENT_ID'),
-    "client_secret": os.environ.get('PAYPAL_CLIENT_SECRET')
-})
-
-client_id = os.environ.get('PAYPAL_CLIENT_ID')
-secret = os.environ.get('PAYPAL_CLIENT_SECRET')
-
-
-@app.route('/create-order', methods=['POST'])
-def create_order():
-    """Create orders using PayPal Orders API"""
-    import requests
-
-    # Get access token
-    auth_response = requests.post(
-        'https://api.sandbox.paypal.com/v1/oauth2/token',
-        headers={'Accept': 'application/json'},
-        auth=(client_id, secret),
-        data={'grant_type': 'client_credentials'}
-    )
-
-    access_token = auth_response.json()['access_token']
-
-    # Create orders
-    order_response = requests.post(
-        'https://api.sandbox.paypal.com/v2/checkout/orders',
-        headers={
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {access_token}'
-        },
-        json={
-            'intent': 'CAPTURE',
-            'purchase_units': [{
-                'amount': {
-                    'currency_code': 'USD',
-                    'value': '10.00'
-                }
-            }]
-        }
-    )
-
-    return jsonify(order_response.json())
-
-
-@app.route('/')
-def index():
-    if 'user_id' in session:
-        return redirect(url_for('catalog'))
-    return redirect(url_for('login'))
-
-
-@app.route('/login')
-def login():
-    if 'user_id' in session:
-        return redirect(url_for('catalog'))
-    return render_template('auth/login.html')
-
-
-@app.post('/login')
-def login_user():
-    email = request.form.get('email', '').strip()
-    password = request.form.get('password', '')
-
-    # Validate input
-    if not email or not password:
-        flash('Email and password are required.', 'error')
-        return redirect(url_for('login'))
-
-    # Query user from database
-    user = User.query.filter_by(email=email).first()
-
-    if user and user.check_password(password):
-        session['user_id'] = user.id
-        session['username'] = user.username
-        session.permanent = True
-        flash(f'Welcome back, {user.username}!', 'success')
-
-        # Redirect to next page if specified, otherwise catalog
-        next_page = request.args.get('next')
-        return redirect(next_page if next_page else url_for('catalog'))
-    else:
-        flash('Invalid email or password.', 'error')
-        return redirect(url_for('login'))
-
-
-@app.route('/register')
-def register():
-    if 'user_id' in session:
-        return redirect(url_for('catalog'))
-    return render_template('auth/register.html')
-
-
-@app.post('/register')
-def register_user():
-    username = request.form.get('username', '').strip()
-    email = request.form.get('email', '').strip().lower()
-    password = request.form.get('password', '')
-    password_confirm = request.form.get('password_confirm', '')
-
-    # Validate input
-    if not all([username, email, password, password_confirm]):
-        flash('All fields are required.', 'error')
-        return redirect(url_for('register'))
-
-    if password != password_confirm:
-        flash('Passwords do not match.', 'error')
-        return redirect(url_for('register'))
-
-    if len(password) < 8:
-        flash('Password must be at least 8 characters long.', 'error')
-        return redirect(url_for('register'))
-
-    if len(username) < 3:
-        flash('Username must be at least 3 characters long.', 'error')
-        return redirect(url_for('register'))
-
-    # Check if user already exists
-    if User.query.filter_by(email=email).first():
-        flash('Email already registered.', 'error')
-        return redirect(url_for('register'))
-
-    if User.query.filter_by(username=username).first():
-        flash('Username already taken.', 'error')
-        return redirect(url_for('register'))
-
-    # Create new user
-    try:
-        new_user = User(
-            username=username,
-            email=email
-        )
-        new_user.set_password(password)
-
-        db.session.add(new_user)
-        db.session.commit()
-
-        flash('Registration successful! Please log in.', 'success')
-        return redirect(url_for('login'))
-    except Exception as e:
-        db.session.rollback()
-        app.logger.error(f'Registration error: {str(e)}')
-        flash('An error occurred during registration. Please try again.', 'error')
-        return redirect(url_for('register'))
-
-
-@app.route('/logout')
-@login_required
-def logout():
-    username = session.get('username', 'User')
-    session.clear()
-    flash(f'Goodbye, {username}!', 'info')
-    return redirect(url_for('login'))
-
-
-@app.route('/catalog')
-@login_required
-def catalog():
-    # Get active products from database
-    products = Product.query.filter_by(is_active=True).all()
-
-    # Convert to dict format for template compatibility
-    products_list = [{
-        'id': p.id,
-        'name': p.name,
-        'sku': p.sku,
-        'price': float(p.price),
-        'compare_price': float(p.compare_price) if p.compare_price else None,
-        'image': p.image_url,  # Map image_url to 'image' for template
-        'description': p.description,
-        'category': p.category.name if p.category else 'Uncategorized',
-        'rating': 4.5,  # Default rating since your model doesn't have it
-        'in_stock': p.in_stock,
-        'stock_quantity': p.stock_quantity,
-        'weight': float(p.weight) if p.weight else 0,
-        'brand': 'Generic',  # Default brand since your model doesn't have it
-    } for p in products]
-
-    return render_template('catalog.html', products=products_list)
-
-
-@app.route('/product/<int:product_id>')
-def product_detail(product_id):
-    # Get product from database
-    product = Product.query.get_or_404(product_id)
-
-    product_dict = {
-        'id': product.id,
-        'name': product.name,
-        'sku': product.sku,
-        'price': float(product.price),
-        'compare_price': float(product.compare_price) if product.compare_price else None,
-        'image': product.image_url,
-        'description': product.description,
-        'category': product.category.name if product.category else 'Uncategorized',
-        'rating': 4.5,
-        'in_stock': product.in_stock,
-        'stock_quantity': product.stock_quantity,
-        'weight': float(product.weight) if product.weight else 0,
-        'brand': 'Generic',
-    }
-    return render_template('product_detail.html', product=product_dict)
-
-
-@app.route('/api/product/<int:product_id>')
-def api_product(product_id):
-    # Get product from database
-    product = Product.query.get(product_id)
-    if not product:
-        return jsonify({'error': 'Product not found'}), 404
-
-    return jsonify({
-        'id': product.id,
-        'name': product.name,
-        'sku': product.sku,
-        'price': float(product.price),
-        'compare_price': float(product.compare_price) if product.compare_price else None,
-        'image': product.image_url,  # Frontend expects 'image'
-        'description': product.description,
-        'category': product.category.name if product.category else 'Uncategorized',
-        'rating': 4.5,
-        'in_stock': product.in_stock,
-        'stock_quantity': product.stock_quantity,
-        'weight': float(product.weight) if product.weight else 0,
-        'brand': 'Generic',
-    })
-@app.route('/cart')
-def cart():
-    return render_template('cart.html')
-
-
-
-@app.get('/checkout')
-def checkout():
-    return render_template('checkout.html', client_id=client_id)
-
-
-@app.post('/api/place-order')
-def place_order():
-    from models.order import Order, OrderItem
-    from models.product import Product
-    import uuid
-    import traceback
-    import threading
-
-    def send_notifications_async(order_number, name, email, phone, address, city, state, zip_code, country, items,
-                                 totals, bill_info, notes):
-        """Send email and telegram notifications in background"""
-        with app.app_context():
-            # Telegram
-            try:
-                table_data = []
-                for item in items:
-                    subtotal = item['price'] * item['quantity']
-                    table_data.append([item['name'], item['price'], item['quantity'], subtotal])
-
-                table_data.append(['SHIPPING', '', '', totals['shipping']])
-                table_data.append(['───────────────', '────────', '────────', '──────────'])
-                table_data.append(['TOTAL', '', '', totals['total']])
-
-                items_table = tabulate(table_data, headers=['Name', 'Price', 'Quantity', 'Subtotal'])
-
-                message_content = f"""<strong>🛒 NEW ORDER: {order_number}</strong>
-<strong>Customer Name: {name}</strong>
-<strong>Email: {email}</strong>
-<strong>Phone: {phone}</strong>
-<strong>Address: {address}, {city}, {state} {zip_code}, {country}</strong>
-<pre>{items_table}</pre>
-<strong>Status: PENDING APPROVAL</strong>
-"""
-                sendMessage('784362028', message_content)
-                print("✓ Telegram notification sent")
-            except Exception as e:
-                print(f"⚠ Telegram failed: {e}")
-
-            # Email
-            try:
-                from flask_mail import Mail, Message
-                import socket
-                socket.setdefaulttimeout(15)
-
-                app.config['MAIL_SERVER'] = 'smtp.gmail.com'
-                app.config['MAIL_PORT'] = 587
-                app.config['MAIL_USE_TLS'] = True
-                app.config['MAIL_USERNAME'] = 'kuaspvp1a@gmail.com'
-                app.config['MAIL_PASSWORD'] = 'ozeu mnmw tkfk bcny'
-                app.config['MAIL_DEFAULT_SENDER'] = 'kuaspvp1a@gmail.com'
-                mail = Mail(app)
-
-                msg = Message(f'Order Confirmation - {order_number}', recipients=[email])
-                msg.body = f'Thank you for your order! Order number: {order_number}'
-                message_html = render_template('mail/invoice.html',
-                                               name=name,
-                                               email=email,
-                                               phone=phone,
-                                               order_number=order_number,
-                                               address=f"{address}, {city}, {state} {zip_code}, {country}".strip(', '),
-                                               full_address=bill_info,
-                                               items=items,
-                                               totals=totals,
-                                               notes=notes)
-                msg.html = message_html
-                mail.send(msg)
-                print("✓ Email sent")
-            except Exception as e:
-                print(f"⚠ Email failed: {e}")
-
-    order_data = request.get_json()
-
-    items = order_data.get('items', [])
-    totals = order_data.get('totals', {})
-    bill_info = order_data.get('billing', {})
-
-    if not items or not bill_info:
-        return jsonify({'success': False, 'message': 'Invalid order data'}), 400
-
-    name = bill_info.get('fullName', '')
-    email = bill_info.get('email', '')
-    phone = bill_info.get('phone', '')
-    address = bill_info.get('address', '')
-    city = bill_info.get('city', '')
-    state = bill_info.get('state', '')
-    zip_code = bill_info.get('zipCode', '')
-    country = bill_info.get('country', '')
-    notes = bill_info.get('notes', '')
-
-    try:
-        order_number = f"ORD-{uuid.uuid4().hex[:8].upper()}"
-
-        order = Order(
-            order_number=order_number,
-            user_id=session.get('user_id'),
-            customer_name=name,
-            customer_email=email,
-            customer_phone=phone,
-            shipping_address=address,
-            shipping_city=city,
-            shipping_state=state,
-            shipping_zip=zip_code,
-            shipping_country=country,
-            subtotal=totals.get('subtotal', 0),
-            shipping_cost=totals.get('shipping', 0),
-            tax=totals.get('tax', 0),
-            total=totals.get('total', 0),
-            status='pending',
-            payment_status='pending',
-            customer_notes=notes
-        )
-
-        db.session.add(order)
         db.session.flush()
+        move_stock(product, product_data['stock_quantity'], 'restock', note='Opening stock')
 
-        for item in items:
-            product = Product.query.get(item.get('id'))
-
-            if not product:
-                raise Exception(f"Product ID {item.get('id')} not found")
-
-            if not product.is_active:
-                raise Exception(f"Product '{product.name}' is no longer available")
-
-            if product.stock_quantity < item.get('quantity'):
-                raise Exception(f"Insufficient stock for '{product.name}'")
-
-            order_item = OrderItem(
-                order_id=order.id,
-                product_id=product.id,
-                product_name=product.name,
-                product_sku=product.sku,
-                product_image=product.image_url or item.get('image'),
-                price=float(item.get('price')),
-                quantity=item.get('quantity'),
-                subtotal=float(item.get('price')) * item.get('quantity')
-            )
-            db.session.add(order_item)
-            product.stock_quantity -= item.get('quantity')
-
+    try:
         db.session.commit()
-        print(f"✓ Order {order_number} created!")
-
-        # Send notifications in background thread
-        thread = threading.Thread(
-            target=send_notifications_async,
-            args=(
-            order_number, name, email, phone, address, city, state, zip_code, country, items, totals, bill_info, notes)
-        )
-        thread.daemon = True
-        thread.start()
-
-        return jsonify({
-            'success': True,
-            'message': 'Order placed successfully',
-            'order_number': order_number,
-            'order_id': order.id
-        }), 201
-
-    except Exception as e:
+        current_app.logger.info('Seeded products', extra={
+            'products': len(PRODUCTS), 'duration_ms': round((time.perf_counter() - started) * 1000, 3)})
+    except Exception:
         db.session.rollback()
-        print(f"❌ ERROR: {str(e)}")
-        return jsonify({
-            'success': False,
-            'message': f'Error placing order: {str(e)}'
-        }), 500
-
-
-# BAKONG PAYMENT API
-payments_db = {}
-
+        current_app.logger.exception('Error seeding products')
 
-@app.route('/bakong/form')
-def getform_bakong():
-    return render_template('bakong-testing.html')
 
-
-@app.route('/payment/bakong/initiate', methods=['POST'])
-def initiate_bakong_payment():
-    """Initiate Bakong payment"""
-    try:
-        # Get form data
-        amount = float(request.form.get('amount'))
-        description = request.form.get('description', 'Payment')
-        customer_name = request.form.get('customer_name', '')
-        customer_email = request.form.get('customer_email', '')
-
-        # Create Bakong payment
-        bakong = BakongPayment()
-        result = bakong.create_payment(
-            amount=amount,
-            currency='USD',
-            description=description
-        )
-
-        if result['success']:
-            payment_id = result['data'].get('payment_id')
-
-            # Store payment info
-            payments_db[payment_id] = {
-                'payment_id': payment_id,
-                'amount': amount,
-                'description': description,
-                'customer_name': customer_name,
-                'customer_email': customer_email,
-                'status': 'pending',
-                'gateway': 'bakong'
-            }
-
-            # Generate QR code
-            qr_result = bakong.generate_qr_code(payment_id)
-
-            if qr_result['success']:
-                return render_template('bakong_qr.html',
-                                       payment_id=payment_id,
-                                       qr_code=qr_result.get('qr_code'),
-                                       amount=amount,
-                                       description=description)
-            else:
-                return render_template('error.html',
-                                       error='Failed to generate QR code')
-        else:
-            return render_template('error.html',
-                                   error=result.get('error', 'Payment failed'))
-
-    except Exception as e:
-        return render_template('error.html', error=str(e))
-
-
-@app.route('/payment/bakong/status/<payment_id>')
-def check_bakong_status(payment_id):
-    """Check Bakong payment status (AJAX endpoint)"""
-    bakong = BakongPayment()
-    result = bakong.check_payment_status(payment_id)
-
-    if result['success']:
-        status = result['data'].get('status')
-
-        # Update local database
-        if payment_id in payments_db:
-            payments_db[payment_id]['status'] = status
-
-        return jsonify({
-            'success': True,
-            'status': status,
-            'data': result['data']
-        })
-    else:
-        return jsonify({
-            'success': False,
-            'error': result.get('error')
-        })
-
-
-@app.route('/payment/callback/bakong', methods=['POST'])
-def bakong_callback():
-    """Handle Bakong webhook callback"""
-    data = request.get_json()
-    signature = request.headers.get('X-Signature')
-
-    bakong = BakongPayment()
-
-    # Verify signature
-    if not bakong.verify_callback(data, signature):
-        app.logger.error('Invalid Bakong callback signature')
-        return jsonify({'error': 'Invalid signature'}), 400
-
-    payment_id = data.get('payment_id')
-    status = data.get('status')
-
-    # Update payment status in database
-    if payment_id in payments_db:
-        payments_db[payment_id]['status'] = status
-        app.logger.info(f'Payment {payment_id} updated to {status}')
-
-    return jsonify({'message': 'Callback received'}), 200
-
-
-@app.route('/payment/success/<payment_id>')
-def payment_success(payment_id):
-    """Payment success page"""
-    payment = payments_db.get(payment_id)
-
-    if payment:
-        return render_template('success.html', payment=payment)
-    else:
-        return render_template('error.html', error='Payment not found')
-
-
-@app.route('/payment/failed')
-def payment_failed():
-    """Payment failed page"""
-    return render_template('error.html', error='Payment failed or cancelled')
-
-#
-# # Error handlers
-# @app.errorhandler(404)
-# def not_found(error):
-#     return render_template('errors/404.html'), 404
-#
-#
-# @app.errorhandler(500)
-# def internal_error(error):
-#     db.session.rollback()
-#     return render_template('errors/500.html'), 500
 if __name__ == '__main__':
+    from models import db
+
+    app = create_app()
     with app.app_context():
         # Create tables if they don't exist
         db.create_all()
         # Seed products into database
         seed_products()
 
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=True)
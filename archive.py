@@ -0,0 +1,179 @@
+"""
+Order archive.
+
+Staff work open and recent orders, but orders and order_items keep every
+order ever placed, so each admin list, count and search pays for the
+whole history. ``flask orders-archive`` moves closed orders (delivered,
+cancelled, rejected) older than ORDER_ARCHIVE_AFTER_DAYS into
+``archived_orders``: one row per order, with the order and its items as
+zlib-compressed JSON and a few columns to look them up by. The live tables
+then stay the size of the working set.
+
+On PostgreSQL archived_orders is partitioned by month of created_at. The
+job creates partitions as it needs them (archived_orders_2024_01, ...),
+and queries bounded by created_at (month_range()) only touch the partitions
+they cover. SQLite has no partitioning, so there it is one table with the
+same created_at index.
+
+Each batch is copied and deleted in one transaction, so a crash leaves
+every order in exactly one place. Stock movements and payments keep their
+history but lose their order_id link, as the foreign keys' ON DELETE SET
+NULL says.
+Rollups for archived days are frozen: analytics.backfill() stops at
+archive_horizon(). Full recommendation builds only see live orders.
+"""
+import json
+import zlib
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import DateTime, Numeric, delete, func, insert, select, text, update
+
+from models import db
+from models.inventory import StockMovement
+from models.order import ArchivedOrder, Order, OrderItem
+from models.payment import Payment
+
+CLOSED_STATUSES = ('delivered', 'cancelled', 'rejected')
+
+orders = Order.__table__
+order_items = OrderItem.__table__
+archived = ArchivedOrder.__table__
+stock_movements = StockMovement.__table__
+payments = Payment.__table__
+
+
+def _encode(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f'Cannot archive {type(value).__name__}')
+
+
+def _decode(table, row):
+    """A payload row back to Python values, by column type"""
+    values = {}
+    for column in table.columns:
+        value = row.get(column.name)
+        if value is not None and isinstance(column.type, DateTime):
+            value = datetime.fromisoformat(value)
+        elif value is not None and isinstance(column.type, Numeric):
+            value = Decimal(value)
+        values[column.name] = value
+    return values
+
+
+def compress(order_row, item_rows):
+    payload = {'order': dict(order_row), 'items': [dict(item) for item in item_rows]}
+    return zlib.compress(json.dumps(payload, default=_encode, separators=(',', ':')).encode(), 6)
+
+
+def restore(archived_order):
+    """The archived order as a transient Order with its items, for display only
+
+    Never add it to a session; the order no longer exists in ``orders``.
+    """
+    payload = json.loads(zlib.decompress(archived_order.payload))
+    order = Order(**_decode(orders, payload['order']))
+    for item in payload['items']:
+        order.items.append(OrderItem(**_decode(order_items, item)))
+    return order
+
+
+def month_start(when):
+    return datetime(when.year, when.month, 1)
+
+
+def next_month(when):
+    return datetime(when.year + when.month // 12, when.month % 12 + 1, 1)
+
+
+def month_range(month):
+    """[start, end) of a 'YYYY-MM' month; bounding a query by it prunes to one partition"""
+    start = datetime.strptime(month, '%Y-%m')
+    return start, next_month(start)
+
+
+def _ensure_partitions(months):
+    """Create the monthly partitions of archived_orders for ``months`` (PostgreSQL only)"""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    for start in sorted(months):
+        end = next_month(start)
+        db.session.execute(text(
+            f'CREATE TABLE IF NOT EXISTS {archived.name}_{start:%Y_%m} PARTITION OF {archived.name} '
+            f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+        ))
+
+
+def archive_orders(older_than_days=90, batch_size=500, now=None):
+    """Move closed orders placed more than ``older_than_days`` ago; returns how many moved"""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=older_than_days)
+    moved = 0
+    while True:
+        ids = db.session.execute(
+            select(orders.c.id)
+            .where(orders.c.status.in_(CLOSED_STATUSES), orders.c.created_at < cutoff)
+            .order_by(orders.c.created_at, orders.c.id)
+            .limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+
+        items = {}
+        for item in db.session.execute(select(order_items).where(order_items.c.order_id.in_(ids))).mappings():
+            items.setdefault(item['order_id'], []).append(item)
+        rows = []
+        for order in db.session.execute(select(orders).where(orders.c.id.in_(ids))).mappings():
+            lines = items.get(order['id'], [])
+            rows.append({
+                'id': order['id'], 'created_at': order['created_at'], 'order_number': order['order_number'],
+                'user_id': order['user_id'], 'customer_name': order['customer_name'],
+                'customer_email': order['customer_email'], 'status': order['status'], 'total': order['total'],
+                'item_count': len(lines), 'payload': compress(order, lines), 'archived_at': datetime.utcnow(),
+            })
+
+        _ensure_partitions({month_start(row['created_at']) for row in rows})
+        db.session.execute(insert(archived), rows)
+        db.session.execute(update(stock_movements).where(stock_movements.c.order_id.in_(ids)).values(order_id=None))
+        db.session.execute(update(payments).where(payments.c.order_id.in_(ids)).values(order_id=None))
+        db.session.execute(delete(order_items).where(order_items.c.order_id.in_(ids)))
+        db.session.execute(delete(orders).where(orders.c.id.in_(ids)))
+        db.session.commit()
+        moved += len(rows)
+    return moved
+
+
+def archive_horizon():
+    """Start of the first day with no archived orders, or None if nothing is archived
+
+    Days before it are (partly) archived, so they can't be rebuilt from orders.
+    """
+    newest = db.session.execute(select(func.max(archived.c.created_at))).scalar()
+    if newest is None:
+        return None
+    return newest.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+
+def archived_months():
+    """'YYYY-MM' of every month from the oldest archived order to the newest, newest first"""
+    oldest, newest = db.session.execute(select(func.min(archived.c.created_at), func.max(archived.c.created_at))).one()
+    if oldest is None:
+        return []
+    months, current = [], month_start(newest)
+    while current >= month_start(oldest):
+        months.append(f'{current:%Y-%m}')
+        current = month_start(current - timedelta(days=1))
+    return months
+
+
+def find_order(order_id):
+    """(order, archived) for an order id, looking in the live table first"""
+    order = db.session.get(Order, order_id)
+    if order is not None:
+        return order, False
+    archived_order = ArchivedOrder.query.filter_by(id=order_id).first()
+    if archived_order is not None:
+        return restore(archived_order), True
+    return None, False
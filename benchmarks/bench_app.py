@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the hot paths of the shop
+
+    product_to_dict   Product.to_dict() over the whole catalog
+    order_to_dict     Order.to_dict() (with items) for 50 recent orders
+    catalog_query     the active-products query behind /catalog
+    catalog_page      GET /catalog, query plus template rendering
+    place_order       POST /api/place-order with 1-4 random items
+    dashboard         GET /admin/dashboard as an admin
+
+Runs in-process on seeded synthetic data, with Telegram/SMTP/Bakong/PayPal
+served by the local stubs, and compares against
+benchmarks/baselines/bench_app.json when there
+is one (see harness.py).
+
+Usage:
+  python benchmarks/bench_app.py [--iterations N] [--save-baseline]
+                                 [--threshold 0.2] [--database-url URL]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.harness import ADMIN_EMAIL, PASSWORD, create_bench_app, report, seed, start_stubs, stop_stubs, summarize
+
+
+def timed(fn, iterations):
+    """Run fn ``iterations`` times; return (latencies, elapsed, errors)"""
+    latencies, errors = [], 0
+    start = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        try:
+            ok = fn()
+        except Exception:
+            ok = False
+        latencies.append(time.perf_counter() - t0)
+        if ok is False:
+            errors += 1
+    return latencies, time.perf_counter() - start, errors
+
+
+def order_payload(rng, products):
+    picked = rng.sample(products, rng.randint(1, 4))
+    items = [{'id': p.id, 'price': float(p.price), 'quantity': rng.randint(1, 3)} for p in picked]
+    subtotal = sum(i['price'] * i['quantity'] for i in items)
+    return {
+        'items': items,
+        'totals': {'subtotal': subtotal, 'shipping': 5, 'tax': 0, 'total': subtotal + 5},
+        'billing': {'fullName': 'Bench Customer', 'email': 'bench@bench.local', 'phone': '012345678',
+                    'address': '1 Bench Street', 'city': 'Phnom Penh', 'country': 'Cambodia'},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float,
+                        help='allowed regression (default 0.2); fails if there is no baseline')
+    parser.add_argument('--database-url')
+    args = parser.parse_args()
+
+    stubs = start_stubs()
+    app = create_bench_app(args.database_url)
+    seed(app)
+
+    from models import db
+    from models.order import Order
+    from models.product import Product
+
+    rng = random.Random(7)
+    n = args.iterations
+    results = {}
+
+    with app.app_context():
+        products = Product.query.all()
+        orders = Order.query.order_by(Order.created_at.desc()).limit(50).all()
+
+        results['product_to_dict'] = summarize(*timed(lambda: [p.to_dict() for p in products], n))
+        results['order_to_dict'] = summarize(*timed(lambda: [o.to_dict() for o in orders], n))
+
+        def catalog_query():
+            db.session.expire_all()
+            Product.query.filter_by(is_active=True).all()
+
+        results['catalog_query'] = summarize(*timed(catalog_query, n))
+
+    customer = app.test_client()
+    customer.post('/login', data={'email': 'user1@bench.local', 'password': PASSWORD})
+    admin = app.test_client()
+    admin.post('/login', data={'email': ADMIN_EMAIL, 'password': PASSWORD})
+
+    results['catalog_page'] = summarize(*timed(lambda: customer.get('/catalog').status_code == 200, n))
+
+    def place_order():
+        response = customer.post('/api/place-order', json=order_payload(rng, products),
+                                 headers={'Idempotency-Key': uuid.uuid4().hex})
+        return response.status_code == 201
+
+    results['place_order'] = summarize(*timed(place_order, n))
+    results['dashboard'] = summarize(*timed(lambda: admin.get('/admin/dashboard').status_code == 200, n))
+
+    for notifier in ('telegram_notifier', 'mailer'):
+        app.extensions[notifier].flush(timeout=60)
+    stop_stubs(stubs)
+
+    print(f"{n} iterations each")
+    report('bench_app', results, save=args.save_baseline, threshold=args.threshold)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Benchmark email throughput: pooled mailer vs one SMTP session per message
+
+Both variants render mail/invoice.html and deliver to the local SMTP sink
+in stubs/smtp_sink.py, so the numbers measure connection handling and
+rendering, not a real mail provider.
+
+Usage:
+  python benchmarks/bench_mail.py [messages]
+"""
+import os
+import smtplib
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from jinja2 import Environment, FileSystemLoader
+
+from notifications.mailer import Mailer, SMTPConnectionPool, build_message
+from stubs import smtp_sink
+
+ITEMS = [
+    {'name': 'Wireless Headphones', 'price': 99.99, 'quantity': 1},
+    {'name': 'Yoga Mat', 'price': 34.99, 'quantity': 2},
+]
+TOTALS = {'subtotal': 169.97, 'shipping': 5.0, 'tax': 0, 'total': 174.97}
+BILLING = {'city': 'Phnom Penh', 'country': 'Cambodia'}
+
+
+def order_context(i):
+    return {
+        'name': 'Bench Customer',
+        'email': f'customer{i}@example.com',
+        'phone': '012345678',
+        'order_number': f'ORD-BENCH{i:06d}',
+        'address': 'Street 1, Phnom Penh',
+        'full_address': BILLING,
+        'items': ITEMS,
+        'totals': TOTALS,
+        'notes': '',
+    }
+
+
+def per_message(env, port, count):
+    """The old scheme: load the template and open a fresh session for every email"""
+    for i in range(count):
+        context = order_context(i)
+        html = env.get_template('mail/invoice.html').render(**context)
+        message = build_message('shop@example.com', f"Order Confirmation - {context['order_number']}",
+                                [context['email']], html=html)
+        with smtplib.SMTP('127.0.0.1', port, timeout=15) as connection:
+            connection.send_message(message)
+
+
+def pooled(env, port, count, pool_size):
+    pool = SMTPConnectionPool('127.0.0.1', port, use_tls=False, size=pool_size)
+    mailer = Mailer(pool, 'shop@example.com', env, workers=pool_size)
+    for i in range(count):
+        context = order_context(i)
+        mailer.send_order_confirmation(
+            order_number=context['order_number'], name=context['name'], email=context['email'],
+            phone=context['phone'], address=context['address'], billing=BILLING,
+            items=ITEMS, totals=TOTALS, notes='')
+    mailer.flush(timeout=600)
+    mailer.close()
+    return pool.connections_opened
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    env = Environment(loader=FileSystemLoader(os.path.join(ROOT, 'templates')), auto_reload=True)
+
+    print(f"Sending {count} invoice emails to a local SMTP sink")
+    print(f"\n{'Scheme':<25} {'Msgs/sec':>10} {'Connections':>12}")
+    print("=" * 49)
+
+    sink = smtp_sink.start()
+    port = sink.server_address[1]
+
+    start = time.perf_counter()
+    per_message(env, port, count)
+    elapsed = time.perf_counter() - start
+    print(f"{'connection per message':<25} {count / elapsed:>10,.0f} {sink.connection_count:>12}")
+
+    for pool_size in (1, 2, 4):
+        start = time.perf_counter()
+        opened = pooled(env, port, count, pool_size)
+        elapsed = time.perf_counter() - start
+        print(f"{f'pooled (size={pool_size})':<25} {count / elapsed:>10,.0f} {opened:>12}")
+
+    sink.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark order number schemes: insert throughput into a unique-indexed column
+
+Compares the old random uuid4 prefixes against the time-ordered ids from
+order_ids.py. Random keys land all over the B-tree, time-ordered keys append
+to its right edge.
+
+Usage:
+  python benchmarks/bench_order_ids.py [rows] [batch_size]
+
+Runs against BENCH_DATABASE_URL if set, otherwise a temporary SQLite file.
+"""
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, MetaData, Table, Column, Integer, String, insert
+
+from order_ids import OrderIdGenerator
+
+
+def uuid8():
+    return f"ORD-{uuid.uuid4().hex[:8].upper()}"
+
+
+def uuid12():
+    return f"BKG-{uuid.uuid4().hex[:12].upper()}"
+
+
+def build_schemes():
+    generator = OrderIdGenerator(worker_id=1)
+    return {
+        'uuid4[:8]': uuid8,
+        'uuid4[:12]': uuid12,
+        'snowflake': generator.next_code,
+    }
+
+
+def run_scheme(engine, name, make_id, rows, batch_size):
+    """Insert rows in batches and return (rows/sec, duplicate count)"""
+    metadata = MetaData()
+    table = Table(
+        'bench_order_ids', metadata,
+        Column('id', Integer, primary_key=True),
+        Column('order_number', String(50), unique=True, nullable=False),
+    )
+    metadata.drop_all(engine)
+    metadata.create_all(engine)
+
+    ids = [make_id() for _ in range(rows)]
+    duplicates = rows - len(set(ids))
+    ids = list(dict.fromkeys(ids))
+
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        for offset in range(0, len(ids), batch_size):
+            batch = ids[offset:offset + batch_size]
+            conn.execute(insert(table), [{'order_number': value} for value in batch])
+    elapsed = time.perf_counter() - start
+
+    metadata.drop_all(engine)
+    return len(ids) / elapsed, duplicates
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    url = os.environ.get('BENCH_DATABASE_URL')
+    tmpdir = None
+    if not url:
+        tmpdir = tempfile.TemporaryDirectory()
+        url = f"sqlite:///{os.path.join(tmpdir.name, 'bench.db')}"
+
+    engine = create_engine(url)
+
+    print(f"Inserting {rows} rows in batches of {batch_size} into {engine.url.get_backend_name()}")
+    print(f"\n{'Scheme':<15} {'Rows/sec':>12} {'Duplicates':>12}")
+    print("=" * 41)
+
+    for name, make_id in build_schemes().items():
+        rate, duplicates = run_scheme(engine, name, make_id, rows, batch_size)
+        print(f"{name:<15} {rate:>12,.0f} {duplicates:>12}")
+
+    engine.dispose()
+    if tmpdir:
+        tmpdir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Benchmark worker/CLI startup: time to import wsgi.py (and so build the app)
+in a fresh interpreter
+
+Each run starts a new Python process, so nothing is cached between runs
+except the OS page cache. Also prints the slowest modules from
+``python -X importtime`` for the last run.
+
+Usage:
+  python benchmarks/bench_startup.py [runs] [module]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_once(module):
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{result.stderr[-2000:]}")
+    return elapsed, result.stderr
+
+
+def slowest_modules(importtime_output, depth=1, limit=15):
+    """Parse -X importtime output into (cumulative_us, module) pairs
+
+    Nesting is shown by indentation; depth 1 is what the benchmarked module
+    (and the code it runs at import, such as create_app) pulls in directly.
+    """
+    rows = []
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line.split('|', 2)
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        if level != depth:
+            continue
+        rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    module = sys.argv[2] if len(sys.argv) > 2 else 'wsgi'
+
+    timings = []
+    output = ''
+    for _ in range(runs):
+        elapsed, output = import_once(module)
+        timings.append(elapsed)
+
+    print(f"import {module}: {runs} runs")
+    print(f"  min    {min(timings) * 1000:8.1f} ms")
+    print(f"  median {statistics.median(timings) * 1000:8.1f} ms")
+    print(f"  max    {max(timings) * 1000:8.1f} ms")
+
+    print(f"\n{'Cumulative (ms)':>16}  Module")
+    print("=" * 50)
+    for cumulative_us, name in slowest_modules(output):
+        print(f"{cumulative_us / 1000:>16.1f}  {name}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+"""
+Shared plumbing for bench_app.py and loadtest.py
+
+- starts the local stand-ins (stubs/) for Telegram, SMTP, Bakong and PayPal
+  and points the app at them through the environment
+- builds the app on a throwaway SQLite database (or DATABASE_URL when
+  --database-url is given) and fills it with seeded synthetic data
+- turns latency samples into throughput and p50/p95/p99
+- stores results as a baseline and flags regressions against it
+
+Baselines depend on the machine, so none are committed: record one with
+--save-baseline on the machine that runs the comparisons. With --threshold,
+a missing baseline is an error rather than a skipped comparison.
+"""
+import json
+import os
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(ROOT, 'benchmarks', 'baselines')
+
+DEFAULT_THRESHOLD = 0.2
+
+ADMIN_EMAIL = 'admin@bench.local'
+PASSWORD = 'bench-password'
+
+
+def start_stubs(payment_latency=0.0):
+    """Start every external-service stand-in and export their addresses"""
+    from stubs import payment_stub, smtp_sink, telegram_stub
+
+    telegram = telegram_stub.start(chat_rate=10000)
+    smtp = smtp_sink.start(keep_messages=False)
+    payments = payment_stub.start(latency=payment_latency)
+
+    os.environ.update({
+        'TELEGRAM_API_URL': telegram.url,
+        'MAIL_SERVER': '127.0.0.1',
+        'MAIL_PORT': str(smtp.server_address[1]),
+        'MAIL_USE_TLS': 'false',
+        'MAIL_USE_SSL': 'false',
+        'MAIL_USERNAME': '',
+        'MAIL_DEFAULT_SENDER': 'shop@bench.local',
+        'TELEGRAM_BOT_TOKEN': 'bench-token',
+        'TELEGRAM_CHAT_ID': '1000',
+        'BAKONG_API_URL': payments.url,
+        'BAKONG_MERCHANT_ID': 'bench-merchant',
+        'BAKONG_API_KEY': 'bench-key',
+        'BAKONG_SECRET_KEY': 'bench-secret',
+        'PAYPAL_API_URL': payments.url,
+        'PAYPAL_CLIENT_ID': 'bench-client',
+        'PAYPAL_CLIENT_SECRET': 'bench-secret',
+    })
+    return {'telegram': telegram, 'smtp': smtp, 'payments': payments}
+
+
+def stop_stubs(stubs):
+    for server in stubs.values():
+        server.shutdown()
+
+
+def create_bench_app(database_url=None):
+    """Build the app with production settings on a scratch database
+
+    Must run after start_stubs(), because config.py reads the environment
+    when it is first imported.
+    """
+    workdir = tempfile.mkdtemp(prefix='flaskmart-bench-')
+    os.environ['DATABASE_URL'] = database_url or 'sqlite:///' + os.path.join(workdir, 'bench.db')
+    os.environ.setdefault('METRICS_DIR', os.path.join(workdir, 'metrics'))
+    os.environ.setdefault('PROFILE_DIR', os.path.join(workdir, 'profiles'))
+
+    from app import create_app
+    from models import db
+
+    app = create_app('production')
+    # Plain HTTP against the local server
+    app.config['SESSION_COOKIE_SECURE'] = False
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+def seed(app, products=200, categories=12, users=50, orders=500, seed_value=42):
+    """Fill the database with deterministic synthetic data (see generate_data.py)
+
+    Users are user1@bench.local ... userN@bench.local plus ADMIN_EMAIL, all
+    with PASSWORD. Stock is effectively unlimited so orders never fail on it.
+    """
+    from analytics import backfill
+    from categories import check_tree
+    from generate_data import generate
+    from models import db
+    from models.user import User
+
+    with app.app_context():
+        generate(db.engine, categories=categories, products=products, users=users, orders=orders,
+                 seed=seed_value, password=PASSWORD, email_domain='bench.local',
+                 stock=(1_000_000, 1_000_000), inactive_rate=0, log=lambda message: None)
+        admin = User(username='bench-admin', email=ADMIN_EMAIL, is_admin=True)
+        admin.set_password(PASSWORD)
+        db.session.add(admin)
+        db.session.commit()
+        check_tree(fix=True)
+        backfill()
+
+
+def percentile(sorted_values, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies, elapsed, errors=0):
+    """Throughput and latency percentiles (ms) for a list of durations in seconds"""
+    values = sorted(latencies)
+    count = len(values)
+    return {
+        'count': count,
+        'errors': errors,
+        'rps': round(count / elapsed, 1) if elapsed else 0.0,
+        'mean_ms': round(sum(values) / count * 1000, 3) if count else 0.0,
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+    }
+
+
+def print_results(results):
+    print(f"\n{'Benchmark':<32} {'Count':>7} {'Err':>5} {'Req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    print("=" * 84)
+    for name, r in results.items():
+        print(f"{name:<32} {r['count']:>7} {r['errors']:>5} {r['rps']:>9,.1f} "
+              f"{r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f}")
+
+
+def baseline_path(name):
+    return os.path.join(BASELINE_DIR, f'{name}.json')
+
+
+def save_baseline(name, results):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    with open(baseline_path(name), 'w') as f:
+        json.dump({'saved_at': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}, f, indent=2, sort_keys=True)
+    print(f"\n✓ Saved baseline {os.path.relpath(baseline_path(name), ROOT)}")
+
+
+def load_baseline(name):
+    try:
+        with open(baseline_path(name)) as f:
+            return json.load(f)['results']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def compare(results, baseline, threshold=0.2):
+    """Print p50/p95/p99 and throughput against the baseline; return regressions
+
+    A latency percentile regresses when it is more than ``threshold`` (20%)
+    above the baseline, throughput when it is more than ``threshold`` below.
+    """
+    regressions = []
+    print(f"\n{'Benchmark':<32} {'Metric':<8} {'Baseline':>10} {'Now':>10} {'Change':>8}")
+    print("=" * 72)
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f"{name:<32} (new, no baseline)")
+            continue
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'rps'):
+            before, now = previous.get(metric), current.get(metric)
+            if not before:
+                continue
+            change = (now - before) / before
+            worse = change < -threshold if metric == 'rps' else change > threshold
+            mark = '✗' if worse else ' '
+            print(f"{name:<32} {metric:<8} {before:>10.2f} {now:>10.2f} {change:>+7.0%} {mark}")
+            if worse:
+                regressions.append((name, metric, before, now))
+    return regressions
+
+
+def report(name, results, save=False, threshold=None):
+    """Print results, compare with or save the baseline; exit 1 on regressions
+
+    ``threshold`` None compares only if a baseline exists; an explicit
+    threshold also exits 1 when there is no baseline to compare against.
+    """
+    print_results(results)
+    if save:
+        save_baseline(name, results)
+        return
+    baseline = load_baseline(name)
+    if baseline is None:
+        message = f"No baseline at {os.path.relpath(baseline_path(name), ROOT)}; run with --save-baseline to record one"
+        if threshold is not None:
+            print(f"\n✗ {message}")
+            raise SystemExit(1)
+        print(f"\n{message}")
+        return
+    threshold = DEFAULT_THRESHOLD if threshold is None else threshold
+    regressions = compare(results, baseline, threshold)
+    if regressions:
+        print(f"\n✗ {len(regressions)} regression(s) beyond {threshold:.0%}")
+        raise SystemExit(1)
+    print(f"\n✓ No regressions beyond {threshold:.0%}")
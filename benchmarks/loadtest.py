@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+HTTP load test: shoppers and an admin working the store at the same time
+
+Each shopper logs in and loops through a session:
+
+    browse      GET /catalog, two product pages (popular products more often)
+    add to cart GET /api/product/<id>, GET /cart
+    checkout    GET /checkout, POST /api/place-order
+    pay         POST /payment/bakong/initiate or POST /create-order (PayPal)
+
+One admin keeps approving the orders the shoppers place and reloads the
+dashboard and order list. Telegram, SMTP, Bakong and PayPal are the local
+stubs in stubs/, so only this app is measured.
+
+By default the app is served in-process by werkzeug's threaded server,
+which shares the GIL with the load generator. For production-like numbers
+run gunicorn against the stubs, seed it with
+``generate_data.py --email-domain bench.local --password bench-password``
+plus an admin@bench.local admin, and pass --url.
+
+Reports throughput and p50/p95/p99 per endpoint and compares against
+benchmarks/baselines/loadtest.json when there
+is one (see harness.py).
+
+Usage:
+  python benchmarks/loadtest.py [--users 8] [--duration 30] [--think-ms 0]
+                                [--url http://127.0.0.1:8000]
+                                [--save-baseline] [--threshold 0.2]
+"""
+import argparse
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.harness import ADMIN_EMAIL, PASSWORD, create_bench_app, report, seed, start_stubs, stop_stubs, summarize
+
+
+class Recorder:
+    """Latencies and errors per endpoint label, shared by all virtual users"""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def call(self, http, label, method, url, expect=(200,), **kwargs):
+        start = time.perf_counter()
+        try:
+            response = http.request(method, url, timeout=30, allow_redirects=False, **kwargs)
+            ok = response.status_code in expect
+        except requests.RequestException:
+            response, ok = None, False
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self.latencies[label].append(elapsed)
+            if not ok:
+                self.errors[label] += 1
+        return response if ok else None
+
+    def results(self, elapsed):
+        return {label: summarize(values, elapsed, self.errors[label])
+                for label, values in sorted(self.latencies.items())}
+
+
+def zipf_choice(rng, items, s=1.1):
+    """Pick from items with popularity falling off like a Zipf distribution"""
+    weights = [1 / (rank ** s) for rank in range(1, len(items) + 1)]
+    return rng.choices(items, weights=weights)[0]
+
+
+def login(http, recorder, base, email):
+    return recorder.call(http, 'POST /login', 'POST', f'{base}/login',
+                         expect=(302,), data={'email': email, 'password': PASSWORD})
+
+
+def shopper(base, user_index, product_ids, recorder, orders, stop, think, seed_value):
+    rng = random.Random(seed_value + user_index)
+    http = requests.Session()
+    login(http, recorder, base, f'user{user_index + 1}@bench.local')
+
+    while not stop.is_set():
+        recorder.call(http, 'GET /catalog', 'GET', f'{base}/catalog')
+        picked = [zipf_choice(rng, product_ids) for _ in range(rng.randint(1, 3))]
+        for product_id in picked[:2]:
+            recorder.call(http, 'GET /product/<id>', 'GET', f'{base}/product/{product_id}')
+        time.sleep(think)
+
+        items = []
+        for product_id in picked:
+            response = recorder.call(http, 'GET /api/product/<id>', 'GET', f'{base}/api/product/{product_id}')
+            if response is not None:
+                product = response.json()
+                items.append({'id': product['id'], 'name': product['name'], 'price': product['price'],
+                              'quantity': rng.randint(1, 2)})
+        recorder.call(http, 'GET /cart', 'GET', f'{base}/cart')
+        time.sleep(think)
+
+        recorder.call(http, 'GET /checkout', 'GET', f'{base}/checkout')
+        if not items:
+            continue
+        subtotal = round(sum(i['price'] * i['quantity'] for i in items), 2)
+        response = recorder.call(
+            http, 'POST /api/place-order', 'POST', f'{base}/api/place-order', expect=(201,),
+            headers={'Idempotency-Key': uuid.uuid4().hex},
+            json={'items': items,
+                  'totals': {'subtotal': subtotal, 'shipping': 5, 'tax': 0, 'total': subtotal + 5},
+                  'billing': {'fullName': f'Load User {user_index}', 'email': f'user{user_index + 1}@bench.local',
+                              'phone': '012345678', 'address': '1 Load Street', 'city': 'Phnom Penh',
+                              'country': 'Cambodia'}})
+        if response is not None:
+            orders.put(response.json()['order_id'])
+        time.sleep(think)
+
+        if rng.random() < 0.5:
+            recorder.call(http, 'POST /payment/bakong/initiate', 'POST', f'{base}/payment/bakong/initiate',
+                          data={'idempotency_key': uuid.uuid4().hex, 'amount': subtotal + 5,
+                                'description': 'Load test', 'customer_name': f'Load User {user_index}'})
+        else:
+            recorder.call(http, 'POST /create-order', 'POST', f'{base}/create-order',
+                          headers={'Idempotency-Key': uuid.uuid4().hex})
+
+
+def admin(base, recorder, orders, stop, think):
+    http = requests.Session()
+    login(http, recorder, base, ADMIN_EMAIL)
+    while not stop.is_set():
+        recorder.call(http, 'GET /admin/dashboard', 'GET', f'{base}/admin/dashboard')
+        recorder.call(http, 'GET /admin/orders', 'GET', f'{base}/admin/orders')
+        try:
+            order_id = orders.get(timeout=0.5)
+        except queue.Empty:
+            continue
+        recorder.call(http, 'POST /admin/orders/<id>/approve', 'POST',
+                      f'{base}/admin/orders/{order_id}/approve', expect=(302,))
+        time.sleep(think)
+
+
+def serve(app):
+    """Serve the app from a background thread; return (base_url, server)"""
+    from werkzeug.serving import make_server
+
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}', server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=8, help='concurrent shoppers (plus one admin)')
+    parser.add_argument('--duration', type=float, default=30, help='seconds to run')
+    parser.add_argument('--think-ms', type=float, default=0, help='pause between steps of a session')
+    parser.add_argument('--products', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--url', help='target an already running, already seeded server')
+    parser.add_argument('--database-url')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float,
+                        help='allowed regression (default 0.2); fails if there is no baseline')
+    args = parser.parse_args()
+
+    stubs, server = None, None
+    if args.url:
+        base = args.url.rstrip('/')
+    else:
+        stubs = start_stubs()
+        app = create_bench_app(args.database_url)
+        seed(app, products=args.products, users=max(50, args.users), seed_value=args.seed)
+        base, server = serve(app)
+
+    product_ids = list(range(1, args.products + 1))
+    recorder = Recorder()
+    orders = queue.Queue()
+    stop = threading.Event()
+    think = args.think_ms / 1000
+
+    threads = [threading.Thread(target=shopper, args=(base, i, product_ids, recorder, orders, stop, think, args.seed))
+               for i in range(args.users)]
+    threads.append(threading.Thread(target=admin, args=(base, recorder, orders, stop, think)))
+
+    print(f"Load testing {base} with {args.users} shoppers + 1 admin for {args.duration:.0f}s")
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    if server is not None:
+        server.shutdown()
+        for notifier in ('telegram_notifier', 'mailer'):
+            app.extensions[notifier].flush(timeout=60)
+    if stubs is not None:
+        print(f"Stubs received {len(stubs['telegram'].messages)} Telegram messages, "
+              f"{stubs['smtp'].message_count} emails, {stubs['payments'].calls} payment API calls")
+        stop_stubs(stubs)
+
+    results = recorder.results(elapsed)
+    total = sum(r['count'] for r in results.values())
+    results['ALL'] = summarize([v for values in recorder.latencies.values() for v in values], elapsed,
+                               sum(recorder.errors.values()))
+    print(f"{total} requests in {elapsed:.1f}s")
+    report('loadtest', results, save=args.save_baseline, threshold=args.threshold)
+
+
+if __name__ == '__main__':
+    main()
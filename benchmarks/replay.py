@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Replay captured production traffic (monitoring/capture.py) against a test
+instance
+
+Requests keep their original spacing, divided by --speed, and each captured
+client becomes one virtual user replaying its own requests in order, so the
+concurrency of the original traffic is preserved. Captured credentials are
+scrubbed, so every virtual user first logs in as a synthetic user
+(user<n>@<domain>, see generate_data.py); clients that used /admin log in
+as --admin-email. Idempotency keys are remapped to fresh ones, keeping
+duplicates within the capture as duplicates.
+
+Reports throughput and p50/p95/p99 per endpoint (ids folded into <id>),
+how far behind schedule the replayer fell, and compares against
+benchmarks/baselines/replay.json when there
+is one (see harness.py).
+
+Usage:
+  python benchmarks/replay.py URL CAPTURE_FILE... [--speed 1] [--limit N]
+                              [--domain bench.local] [--password bench-password]
+                              [--admin-email admin@bench.local]
+                              [--save-baseline] [--threshold 0.2]
+"""
+import argparse
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from urllib.parse import parse_qsl, urlencode
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.harness import ADMIN_EMAIL, PASSWORD, percentile, report, summarize
+from monitoring.capture import read_captures
+
+_ID = re.compile(r'/\d+(?=/|$)')
+
+
+def endpoint_label(method, path):
+    return f"{method} {_ID.sub('/<id>', path)}"
+
+
+class Replayer:
+    def __init__(self, base, speed, domain, password, admin_email):
+        self.base = base.rstrip('/')
+        self.speed = speed
+        self.domain = domain
+        self.password = password
+        self.admin_email = admin_email
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.lag = []
+        self._idempotency_keys = {}
+        self._lock = threading.Lock()
+
+    def _key(self, original):
+        with self._lock:
+            if original not in self._idempotency_keys:
+                self._idempotency_keys[original] = uuid.uuid4().hex
+            return self._idempotency_keys[original]
+
+    def _login(self, http, email):
+        http.post(f'{self.base}/login', data={'email': email, 'password': self.password},
+                  allow_redirects=False, timeout=30)
+
+    def _send(self, http, record, email):
+        kwargs = {'allow_redirects': False, 'timeout': 30, 'headers': {}}
+        if record.get('headers', {}).get('X-Requested-With'):
+            kwargs['headers']['X-Requested-With'] = record['headers']['X-Requested-With']
+        if record.get('headers', {}).get('Idempotency-Key'):
+            kwargs['headers']['Idempotency-Key'] = self._key(record['headers']['Idempotency-Key'])
+
+        path = record['path']
+        if path == '/login' and record['method'] == 'POST':
+            kwargs['data'] = {'email': email, 'password': self.password}
+        elif record['body_kind'] == 'json':
+            kwargs['json'] = record['body']
+        elif record['body_kind'] == 'form':
+            pairs = [(key, self._key(value) if key == 'idempotency_key' else value)
+                     for key, value in parse_qsl(record['body'], keep_blank_values=True)]
+            kwargs['data'] = urlencode(pairs)
+            kwargs['headers']['Content-Type'] = 'application/x-www-form-urlencoded'
+        url = f"{self.base}{path}" + (f"?{record['query']}" if record.get('query') else '')
+        return http.request(record['method'], url, **kwargs)
+
+    def run_client(self, records, email, started, t0):
+        http = requests.Session()
+        self._login(http, email)
+        for record in records:
+            due = started + (record['ts'] - t0) / self.speed
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            label = endpoint_label(record['method'], record['path'])
+            start = time.perf_counter()
+            try:
+                response = self._send(http, record, email)
+                # Same class of status as in production counts as success
+                ok = record.get('status') is None or response.status_code // 100 == record['status'] // 100
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.latencies[label].append(elapsed)
+                self.lag.append(max(0.0, start - due))
+                if not ok:
+                    self.errors[label] += 1
+
+    def run(self, records):
+        """Replay records (sorted by ts); return the elapsed time"""
+        clients = defaultdict(list)
+        for record in records:
+            clients[record['client']].append(record)
+
+        emails = {}
+        for n, (client, client_records) in enumerate(clients.items(), 1):
+            admin = any(r['path'].startswith('/admin') for r in client_records)
+            emails[client] = self.admin_email if admin else f'user{n}@{self.domain}'
+
+        t0 = records[0]['ts']
+        span = records[-1]['ts'] - t0
+        print(f"Replaying {len(records)} requests from {len(clients)} clients "
+              f"({span:.0f}s captured, {span / self.speed:.0f}s at {self.speed:g}x)")
+
+        # Give every client time to log in before the schedule starts
+        started = time.perf_counter() + 1.0
+        threads = [threading.Thread(target=self.run_client, args=(client_records, emails[client], started, t0))
+                   for client, client_records in clients.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay captured traffic against a test instance')
+    parser.add_argument('url')
+    parser.add_argument('captures', nargs='+')
+    parser.add_argument('--speed', type=float, default=1.0, help='2 replays twice as fast')
+    parser.add_argument('--limit', type=int, help='only the first N requests')
+    parser.add_argument('--domain', default='bench.local')
+    parser.add_argument('--password', default=PASSWORD)
+    parser.add_argument('--admin-email', default=ADMIN_EMAIL)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--threshold', type=float,
+                        help='allowed regression (default 0.2); fails if there is no baseline')
+    args = parser.parse_args()
+
+    records = list(read_captures(sorted(args.captures)))
+    records.sort(key=lambda r: r['ts'])
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        raise SystemExit("No requests in the capture files")
+
+    replayer = Replayer(args.url, args.speed, args.domain, args.password, args.admin_email)
+    elapsed = replayer.run(records)
+
+    lag = sorted(replayer.lag)
+    print(f"Schedule lag p50 {percentile(lag, 50) * 1000:.1f} ms, p99 {percentile(lag, 99) * 1000:.1f} ms"
+          " (high lag means the replayer or the server could not keep up)")
+
+    results = {label: summarize(values, elapsed, replayer.errors[label])
+               for label, values in sorted(replayer.latencies.items())}
+    results['ALL'] = summarize([v for values in replayer.latencies.values() for v in values], elapsed,
+                               sum(replayer.errors.values()))
+    report('replay', results, save=args.save_baseline, threshold=args.threshold)
+
+
+if __name__ == '__main__':
+    main()
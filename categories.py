@@ -0,0 +1,249 @@
+"""
+Category tree.
+
+Categories nest through ``parent_id`` and carry a materialized path of ids
+from the root, ``/3/17/42/``, plus their depth. With it:
+
+    subtree     path >= '/3/17/' AND path < '/3/170'   one range on the path index
+    ancestors   the ids in the path                    one primary-key lookup
+    products    category_id IN (subtree ids)           one indexed query
+
+The upper bound works because '0' follows '/' and every path ends in '/'.
+
+A new category's path is filled in right after its INSERT, once it has an
+id. Moving a category (move_category) rewrites the paths of its whole
+subtree with one UPDATE.
+
+Category.product_count and subtree_product_count count the products
+(active and inactive) in a category and in its subtree. After every flush
+that adds, removes or re-categorises products, the categories on the
+path get one relative UPDATE, so concurrent writers add up. Bulk loads
+that bypass the ORM (generate_data.py) are followed by
+``flask categories-check --fix``, which recomputes paths and counts, and
+by facets.invalidate() so running workers rebuild their facet index.
+"""
+from collections import defaultdict
+
+from sqlalchemy import and_, case, event, func, inspect, or_, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import db
+from models.category import Category
+from models.product import Product
+
+# Levels below a root; keeps paths well inside their 255 characters
+MAX_DEPTH = 8
+
+categories = Category.__table__
+products = Product.__table__
+
+
+def path_ids(path):
+    """Category ids in a materialized path, root first"""
+    return [int(part) for part in path.strip('/').split('/') if part]
+
+
+def subtree_clause(path, column=None):
+    """Categories at or below ``path``, as a range on the path column"""
+    column = categories.c.path if column is None else column
+    return and_(column >= path, column < path[:-1] + '0')
+
+
+def subtree_ids(*paths):
+    """SELECT of the ids of every category in the given subtrees"""
+    return select(categories.c.id).where(or_(*(subtree_clause(path) for path in paths)))
+
+
+def subtree_products(category):
+    """Products in ``category`` or any category below it"""
+    return Product.query.filter(Product.category_id.in_(subtree_ids(category.path)))
+
+
+def breadcrumbs(category):
+    """The category and its ancestors, root first, from one query"""
+    if category is None:
+        return []
+    return Category.query.filter(Category.id.in_(path_ids(category.path))).order_by(Category.depth).all()
+
+
+def category_tree():
+    """Every category in tree order (each parent followed by its subtree)"""
+    return Category.query.order_by(Category.path).all()
+
+
+def check_parent(category, parent):
+    """Raise ValueError if ``category`` can't be placed under ``parent``
+
+    ``category`` may be new (no id yet); ``parent`` may be None for a root.
+    """
+    if parent is None:
+        return
+    if category.id is not None and category.path and parent.path.startswith(category.path):
+        raise ValueError('A category cannot be moved under itself or one of its subcategories.')
+
+    height = 0
+    if category.id is not None and category.path:
+        height = (db.session.execute(
+            select(func.max(categories.c.depth)).where(subtree_clause(category.path))
+        ).scalar() or category.depth) - category.depth
+    if parent.depth + 1 + height > MAX_DEPTH:
+        raise ValueError(f'Categories can be nested at most {MAX_DEPTH} levels deep.')
+
+
+def move_category(category, parent):
+    """Put ``category`` and its subtree under ``parent`` (None for a root)
+
+    Rewrites the subtree's paths and moves its products between the old and
+    new ancestors' counts. Nothing is committed.
+    """
+    check_parent(category, parent)
+    new_parent_id = parent.id if parent is not None else None
+    if new_parent_id == category.parent_id:
+        return
+
+    old_path, old_ancestors = category.path, category.ancestor_ids
+    new_path = f'{parent.path if parent is not None else "/"}{category.id}/'
+    depth_change = (parent.depth + 1 if parent is not None else 0) - category.depth
+    count = category.subtree_product_count
+
+    db.session.execute(
+        update(categories)
+        .where(subtree_clause(old_path))
+        .values(path=new_path + func.substr(categories.c.path, len(old_path) + 1),
+                depth=categories.c.depth + depth_change)
+    )
+    new_ancestors = path_ids(new_path)[:-1]
+    for ancestors, change in ((old_ancestors, -count), (new_ancestors, count)):
+        if ancestors and change:
+            db.session.execute(
+                update(categories)
+                .where(categories.c.id.in_(ancestors))
+                .values(subtree_product_count=categories.c.subtree_product_count + change))
+
+    # Rewritten behind the ORM's back; reload whatever is in the session
+    for obj in list(db.session.identity_map.values()):
+        if isinstance(obj, Category) and obj is not category:
+            if obj.path.startswith(old_path):
+                db.session.expire(obj, ['path', 'depth'])
+            elif obj.id in old_ancestors or obj.id in new_ancestors:
+                db.session.expire(obj, ['subtree_product_count'])
+    set_committed_value(category, 'path', new_path)
+    set_committed_value(category, 'depth', category.depth + depth_change)
+    category.parent_id = new_parent_id
+
+
+def _adjust_counts(connection, category_id, change):
+    """Add ``change`` products to a category and its ancestors"""
+    path = connection.execute(select(categories.c.path).where(categories.c.id == category_id)).scalar()
+    if not path:
+        return
+    connection.execute(
+        update(categories)
+        .where(categories.c.id.in_(path_ids(path)))
+        .values(subtree_product_count=categories.c.subtree_product_count + change,
+                product_count=categories.c.product_count + case((categories.c.id == category_id, change), else_=0))
+    )
+
+
+def _set_path(mapper, connection, target):
+    """Fill in a new category's path and depth once it has an id"""
+    parent_path, depth = '/', 0
+    if target.parent_id is not None:
+        parent_path, parent_depth = connection.execute(
+            select(categories.c.path, categories.c.depth).where(categories.c.id == target.parent_id)).one()
+        depth = parent_depth + 1
+    path = f'{parent_path}{target.id}/'
+    connection.execute(update(categories).where(categories.c.id == target.id).values(path=path, depth=depth))
+    set_committed_value(target, 'path', path)
+    set_committed_value(target, 'depth', depth)
+
+
+def _count_product_changes(session, flush_context):
+    # After the flush, so new categories have ids and category_id is in sync
+    # with the relationship; the history still describes what was flushed
+    changes = defaultdict(int)
+    for obj in session.new:
+        if isinstance(obj, Product) and obj.category_id is not None:
+            changes[obj.category_id] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            history = inspect(obj).attrs.category_id.history
+            old = (history.deleted or history.unchanged or history.added or [None])[0]
+            if old is not None:
+                changes[old] -= 1
+    for obj in session.dirty:
+        if isinstance(obj, Product) and obj not in session.deleted:
+            history = inspect(obj).attrs.category_id.history
+            if history.has_changes():
+                if history.deleted and history.deleted[0] is not None:
+                    changes[history.deleted[0]] -= 1
+                if history.added and history.added[0] is not None:
+                    changes[history.added[0]] += 1
+
+    changes = {category_id: change for category_id, change in changes.items() if change}
+    if changes:
+        connection = session.connection(bind_arguments={'bind': db.engine})
+        for category_id, change in sorted(changes.items()):
+            _adjust_counts(connection, category_id, change)
+
+
+def check_tree(fix=False):
+    """Categories whose path, depth or counts disagree with the tree: [(category_id, stored, actual)]
+
+    Each side is (path, depth, product_count, subtree_product_count). With
+    ``fix`` the drifted categories are rewritten and committed.
+    """
+    rows = db.session.execute(
+        select(categories.c.id, categories.c.parent_id, categories.c.path, categories.c.depth,
+               categories.c.product_count, categories.c.subtree_product_count)
+    ).all()
+    direct = dict(db.session.execute(
+        select(products.c.category_id, func.count())
+        .where(products.c.category_id.isnot(None))
+        .group_by(products.c.category_id)
+    ).all())
+
+    parents = {row.id: row.parent_id for row in rows}
+    paths = {}
+
+    def path_of(category_id, seen=()):
+        if category_id not in paths:
+            parent_id = parents[category_id]
+            if parent_id is None or parent_id not in parents or category_id in seen:
+                paths[category_id] = f'/{category_id}/'
+            else:
+                paths[category_id] = f'{path_of(parent_id, seen + (category_id,))}{category_id}/'
+        return paths[category_id]
+
+    subtree = defaultdict(int)
+    for category_id in parents:
+        for ancestor in path_ids(path_of(category_id)):
+            subtree[ancestor] += direct.get(category_id, 0)
+
+    drift = []
+    for row in rows:
+        path = path_of(row.id)
+        actual = (path, len(path_ids(path)) - 1, direct.get(row.id, 0), subtree[row.id])
+        stored = (row.path, row.depth, row.product_count, row.subtree_product_count)
+        if stored != actual:
+            drift.append((row.id, stored, actual))
+
+    if fix and drift:
+        for category_id, _, (path, depth, count, total) in drift:
+            db.session.execute(
+                update(categories)
+                .where(categories.c.id == category_id)
+                .values(path=path, depth=depth, product_count=count, subtree_product_count=total))
+        db.session.commit()
+    return drift
+
+
+def init_categories(app):
+    """Keep category paths and product counts up to date"""
+    # Mapper and Session-class events are shared by every app in the
+    # process, so only listen once
+    if not event.contains(Category, 'after_insert', _set_path):
+        event.listen(Category, 'after_insert', _set_path)
+    if not event.contains(Session, 'after_flush', _count_product_changes):
+        event.listen(Session, 'after_flush', _count_product_changes)
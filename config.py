@@ -12,15 +12,127 @@ class Config:
     # Neon Database Configuration
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
-    SQLALCHEMY_ENGINE_OPTIONS = {
-        'pool_size': 10,
-        'pool_recycle': 3600,
-        'pool_pre_ping': True,
-        'connect_args': {
-            'sslmode': 'require',
-            'connect_timeout': 10
-        }
+    # Computed per process from the connection budget (see connection_budget.py)
+    # unless set explicitly
+    SQLALCHEMY_ENGINE_OPTIONS = None
+
+    # Connection budget across all gunicorn workers and nodes
+    DB_CONNECTION_BUDGET = int(os.environ.get('DB_CONNECTION_BUDGET', 20))
+    DB_RESERVED_CONNECTIONS = int(os.environ.get('DB_RESERVED_CONNECTIONS', 3))  # migrations, psql, cron
+    DB_WORKERS = int(os.environ.get('DB_WORKERS', 0)) or None  # defaults to WEB_CONCURRENCY
+    DB_NODES = int(os.environ.get('DB_NODES', 1))
+    DB_PGBOUNCER = None  # None = auto-detect Neon -pooler hosts
+    DB_LIVENESS = os.environ.get('DB_LIVENESS', 'idle_ping')  # idle_ping, recycle or pre_ping
+    DB_IDLE_PING_AFTER = 30  # seconds idle before a checkout pings
+    DB_POOL_RECYCLE = 300  # seconds; below Neon's idle suspend
+    DB_POOL_TIMEOUT = 10  # seconds to wait for a free connection
+
+    # Read replicas for @replica_reads views (comma-separated DATABASE_REPLICA_URLS)
+    SQLALCHEMY_REPLICA_URIS = [url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+    REPLICA_READ_YOUR_WRITES_SECONDS = 5  # keep a user's reads on the primary after they write
+    REPLICA_HEALTH_CHECK_INTERVAL = 10  # seconds
+
+    # SQL instrumentation
+    SQL_SERVER_TIMING = False  # always send Server-Timing (it's on in debug mode and for admin pages)
+    SQL_SLOW_QUERY_MS = int(os.environ.get('SQL_SLOW_QUERY_MS', 100))
+    SQL_SLOW_QUERY_SAMPLE_RATE = float(os.environ.get('SQL_SLOW_QUERY_SAMPLE_RATE', 1.0))
+
+    # Structured logging (see monitoring/logs.py)
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # json or text
+    LOG_FILE = os.environ.get('LOG_FILE')  # default: stdout
+    LOG_SAMPLING = os.environ.get('LOG_SAMPLING', '')  # e.g. http.access=0.1,sql.slow=0.5
+    LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+
+    # Metrics (see monitoring/metrics.py); workers share METRICS_DIR
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', 1.0))
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # for scrapers; admins can always read /metrics
+
+    # Request profiling (see monitoring/profiling.py)
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.0))
+    PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+    PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 100))
+
+    # Memory diagnostics (see monitoring/memory.py)
+    MEMORY_RSS_GROWTH_ALARM_MB = float(os.environ.get('MEMORY_RSS_GROWTH_ALARM_MB', 20))
+    MEMORY_TRACEMALLOC = os.environ.get('MEMORY_TRACEMALLOC', 'false').lower() == 'true'
+    MEMORY_TRACEMALLOC_FRAMES = int(os.environ.get('MEMORY_TRACEMALLOC_FRAMES', 10))
+    MEMORY_SNAPSHOT_INTERVAL = int(os.environ.get('MEMORY_SNAPSHOT_INTERVAL', 0))
+    MEMORY_SNAPSHOTS_KEEP = int(os.environ.get('MEMORY_SNAPSHOTS_KEEP', 5))
+
+    # Scrubbed traffic capture for benchmarks/replay.py (see monitoring/capture.py)
+    TRAFFIC_CAPTURE = os.environ.get('TRAFFIC_CAPTURE', 'false').lower() == 'true'
+    TRAFFIC_CAPTURE_DIR = os.environ.get('TRAFFIC_CAPTURE_DIR')
+    TRAFFIC_CAPTURE_SAMPLE_RATE = float(os.environ.get('TRAFFIC_CAPTURE_SAMPLE_RATE', 1.0))
+    TRAFFIC_CAPTURE_ROTATE_MB = float(os.environ.get('TRAFFIC_CAPTURE_ROTATE_MB', 64))
+    TRAFFIC_CAPTURE_KEEP = int(os.environ.get('TRAFFIC_CAPTURE_KEEP', 50))
+    TRAFFIC_CAPTURE_MAX_BODY = int(os.environ.get('TRAFFIC_CAPTURE_MAX_BODY', 65536))
+
+    # Distributed tracing (see monitoring/tracing.py); spans go to the
+    # collector when TRACE_COLLECTOR_URL is set, else to TRACE_DIR
+    TRACING = os.environ.get('TRACING', 'false').lower() == 'true'
+    TRACE_DIR = os.environ.get('TRACE_DIR')
+    TRACE_COLLECTOR_URL = os.environ.get('TRACE_COLLECTOR_URL')
+    TRACE_SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 1.0))
+    TRACE_SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME', 'flaskmart')
+
+    # Storefront facet counts (see facets.py)
+    FACET_CACHE_SIZE = int(os.environ.get('FACET_CACHE_SIZE', 1024))  # filter combinations per process
+    FACET_REFRESH_INTERVAL = float(os.environ.get('FACET_REFRESH_INTERVAL', 2))  # seconds between change checks
+
+    # Closed orders older than this move to archived_orders (see archive.py)
+    ORDER_ARCHIVE_AFTER_DAYS = int(os.environ.get('ORDER_ARCHIVE_AFTER_DAYS', 90))
+
+    # PayPal
+    PAYPAL_CLIENT_ID = os.environ.get('PAYPAL_CLIENT_ID')
+    PAYPAL_CLIENT_SECRET = os.environ.get('PAYPAL_CLIENT_SECRET')
+    PAYPAL_API_URL = os.environ.get('PAYPAL_API_URL', 'https://api.sandbox.paypal.com')
+
+    # Bakong (point the URLs at stubs/payment_stub.py for local testing)
+    BAKONG_API_URL = os.environ.get('BAKONG_API_URL')
+    BAKONG_MERCHANT_ID = os.environ.get('BAKONG_MERCHANT_ID')
+    BAKONG_API_KEY = os.environ.get('BAKONG_API_KEY')
+    BAKONG_SECRET_KEY = os.environ.get('BAKONG_SECRET_KEY')
+    PAYMENT_CALLBACK_URL = os.environ.get('PAYMENT_CALLBACK_URL', 'http://localhost:5000/payment/callback')
+
+    # Stored webhook events are applied by a worker thread (see payment_events.py)
+    PAYMENT_EVENTS_INTERVAL = float(os.environ.get('PAYMENT_EVENTS_INTERVAL', 5))  # seconds between queue checks
+    PAYMENT_EVENTS_MAX_ATTEMPTS = 5  # failures before an event is set aside
+    PAYMENT_EVENTS_UNKNOWN_PAYMENT_HOURS = 24  # how long an event for an unknown payment is retried
+
+    # Idempotency keys for order/payment endpoints
+    IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', 24 * 3600))  # seconds
+    IDEMPOTENCY_WAIT_TIMEOUT = 10  # seconds a duplicate waits for the in-flight request
+    IDEMPOTENCY_LEASE = 60  # seconds before an in-progress key whose worker died can be taken over
+
+    # Telegram notifications; disabled unless TELEGRAM_BOT_TOKEN is set
+    TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN')
+    TELEGRAM_DEFAULT_CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID')
+    TELEGRAM_CHAT_ROUTES = {
+        # event -> list of chat ids; events not listed go to TELEGRAM_DEFAULT_CHAT_ID
     }
+    TELEGRAM_DIGEST_WINDOW = float(os.environ.get('TELEGRAM_DIGEST_WINDOW', 5))  # seconds to coalesce orders
+    TELEGRAM_MAX_DIGEST_SIZE = 50
+    TELEGRAM_GLOBAL_RATE = 25  # messages/second across all chats
+    TELEGRAM_CHAT_RATE = 1.0  # messages/second per chat
+    TELEGRAM_CHAT_BURST = 3
+
+    # Transactional email (one pooled SMTP setup per process); disabled unless
+    # MAIL_DEFAULT_SENDER is set. Leave the credentials unset for a relay without AUTH
+    MAIL_SERVER = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
+    MAIL_PORT = int(os.environ.get('MAIL_PORT', 587))
+    MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS', 'true').lower() == 'true'
+    MAIL_USE_SSL = os.environ.get('MAIL_USE_SSL', 'false').lower() == 'true'
+    MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
+    MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+    MAIL_DEFAULT_SENDER = os.environ.get('MAIL_DEFAULT_SENDER')
+    MAIL_TIMEOUT = 15  # seconds, per SMTP connection
+    MAIL_POOL_SIZE = 2  # open SMTP connections per process
+    MAIL_POOL_MAX_IDLE = 60  # seconds before an idle connection is dropped
+    MAIL_POOL_MAX_MESSAGES = 100  # messages per connection before reconnecting
+    MAIL_WORKERS = 1
 
     # File Upload Configuration
     UPLOAD_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
@@ -38,6 +150,7 @@ class DevelopmentConfig(Config):
     """Development configuration"""
     DEBUG = True
     SESSION_COOKIE_SECURE = False  # Allow HTTP in development
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')
 
 
 class ProductionConfig(Config):
@@ -0,0 +1,189 @@
+"""
+Database connection budget for Neon/Postgres across gunicorn workers.
+
+Every gunicorn worker has its own SQLAlchemy pool, so a fixed ``pool_size``
+silently multiplies by the number of workers and nodes. Instead we start
+from a global budget (what the server or PgBouncer allows us) and divide it:
+
+    per_engine = (DB_CONNECTION_BUDGET - DB_RESERVED_CONNECTIONS) // (workers * nodes * engines)
+
+Workers come from DB_WORKERS or WEB_CONCURRENCY (which gunicorn also reads),
+nodes from DB_NODES, engines are the primary plus SQLALCHEMY_REPLICA_URIS.
+``pool_size + max_overflow`` never exceeds the share, and a budget too small
+to give every pool one connection is an error at startup.
+
+Liveness strategies (DB_LIVENESS):
+
+    idle_ping  ping only connections that sat idle longer than DB_IDLE_PING_AFTER
+               (default); busy connections are handed out without a round trip
+    recycle    no ping, just recycle connections after DB_POOL_RECYCLE seconds
+    pre_ping   SQLAlchemy's pool_pre_ping, a round trip on every checkout
+
+All strategies keep TCP keepalives on and rely on SQLAlchemy invalidating the
+pool when a statement hits a dead connection.
+
+PgBouncer in transaction mode (DB_PGBOUNCER, auto-detected for Neon
+``-pooler`` hosts) can't keep server-side prepared statements or session
+state between transactions, so those are switched off for drivers that use
+them.
+"""
+import os
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+from monitoring.metrics import db_checkout_wait
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            db_checkout_wait.observe(time.perf_counter() - start)
+
+
+def _env_int(name, default):
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def default_budget(config):
+    """Budget settings from config, falling back to the environment"""
+    workers = config.get('DB_WORKERS') or _env_int('WEB_CONCURRENCY', 1)
+    return {
+        'budget': config.get('DB_CONNECTION_BUDGET', 20),
+        'reserved': config.get('DB_RESERVED_CONNECTIONS', 3),
+        'workers': max(1, int(workers)),
+        'nodes': max(1, int(config.get('DB_NODES', 1))),
+        'threads': max(1, int(config.get('DB_THREADS_PER_WORKER') or _env_int('GUNICORN_THREADS', 1))),
+        'engines': 1 + len(config.get('SQLALCHEMY_REPLICA_URIS') or []),
+    }
+
+
+def pool_share(budget, reserved, workers, nodes, threads=1, engines=1):
+    """Split a connection budget into (pool_size, max_overflow) per engine per worker process"""
+    pools = workers * nodes * engines
+    if budget - reserved < pools:
+        raise RuntimeError(
+            f'DB_CONNECTION_BUDGET={budget} minus {reserved} reserved cannot give one connection to each of '
+            f'{pools} pools ({workers} worker(s) x {nodes} node(s) x {engines} engine(s))')
+    share = (budget - reserved) // pools
+    # A sync worker only ever needs one connection per thread
+    pool_size = max(1, min(share, threads))
+    max_overflow = max(0, share - pool_size)
+    return pool_size, max_overflow
+
+
+def is_pgbouncer(url, config):
+    setting = config.get('DB_PGBOUNCER')
+    if setting is not None:
+        return bool(setting)
+    # Neon's pooled endpoints are PgBouncer in transaction mode
+    return '-pooler' in (url.host or '')
+
+
+def build_engine_options(config):
+    """Compute SQLALCHEMY_ENGINE_OPTIONS for this process from the budget"""
+    uri = config.get('SQLALCHEMY_DATABASE_URI')
+    if not uri:
+        return {}
+
+    url = make_url(uri)
+    if url.get_backend_name() != 'postgresql':
+        # SQLite and friends: the dialect picks an appropriate pool
+        return {}
+
+    settings = default_budget(config)
+    pool_size, max_overflow = pool_share(**settings)
+    liveness = config.get('DB_LIVENESS', 'idle_ping')
+
+    connect_args = {
+        'sslmode': 'require',
+        'connect_timeout': 10,
+        # Let the kernel notice dead peers instead of pinging from Python
+        'keepalives': 1,
+        'keepalives_idle': 30,
+        'keepalives_interval': 10,
+        'keepalives_count': 3,
+    }
+
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': pool_size,
+        'max_overflow': max_overflow,
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 10),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 300),
+        'pool_pre_ping': liveness == 'pre_ping',
+        'pool_use_lifo': True,  # let surplus connections go idle and get recycled
+    }
+
+    if is_pgbouncer(url, config):
+        driver = url.get_driver_name()
+        if driver == 'psycopg':
+            connect_args['prepare_threshold'] = None
+        elif driver == 'asyncpg':
+            connect_args['statement_cache_size'] = 0
+            connect_args['prepared_statement_cache_size'] = 0
+        # psycopg2 never uses server-side prepared statements
+
+    connect_args.update(config.get('DB_CONNECT_ARGS', {}))
+    options['connect_args'] = connect_args
+    return options
+
+
+def configure_engine_options(app):
+    """Fill in SQLALCHEMY_ENGINE_OPTIONS unless the config sets it explicitly"""
+    if app.config.get('SQLALCHEMY_ENGINE_OPTIONS') is None:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = build_engine_options(app.config)
+
+
+def install_idle_ping(engine, idle_after):
+    """Ping connections on checkout only if they have been idle for a while"""
+
+    @event.listens_for(engine, 'checkin')
+    def record_checkin(dbapi_connection, connection_record):
+        connection_record.info['checked_in_at'] = time.monotonic()
+
+    @event.listens_for(engine, 'checkout')
+    def ping_if_idle(dbapi_connection, connection_record, connection_proxy):
+        checked_in_at = connection_record.info.get('checked_in_at')
+        if checked_in_at is None or time.monotonic() - checked_in_at < idle_after:
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute('SELECT 1')
+        except Exception:
+            # The pool discards this connection and retries with a new one
+            raise exc.DisconnectionError()
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+
+def init_connection_budget(app, engine):
+    """Install liveness listeners on an engine created from our options"""
+    if app.config.get('DB_LIVENESS', 'idle_ping') == 'idle_ping' and engine.dialect.name == 'postgresql':
+        install_idle_ping(engine, app.config.get('DB_IDLE_PING_AFTER', 30))
+
+
+def pool_status(engine):
+    """Current pool utilisation plus the checkout-wait histogram"""
+    pool = engine.pool
+    status = {'pool': type(pool).__name__, 'checkout_wait_seconds': db_checkout_wait.cumulative()}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': pool.overflow(),
+            'max_overflow': pool._max_overflow,
+        })
+    return status
@@ -10,12 +10,20 @@ def login_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             flash('Please log in to access this page.', 'warning')
-            return redirect(url_for('login'))
+            return redirect(url_for('shop.login'))
         return f(*args, **kwargs)
 
     return decorated_function
 
 
+def is_admin():
+    """Is the logged-in user an administrator?"""
+    if 'user_id' not in session:
+        return False
+    user = User.query.get(session['user_id'])
+    return bool(user and user.is_admin)
+
+
 def admin_required(f):
     """Decorator to require admin privileges for a route"""
 
@@ -23,12 +31,12 @@ def admin_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             flash('Please log in to access this page.', 'warning')
-            return redirect(url_for('login'))
+            return redirect(url_for('shop.login'))
 
         user = User.query.get(session['user_id'])
         if not user or not user.is_admin:
             flash('You need administrator privileges to access this page.', 'error')
-            return redirect(url_for('catalog'))
+            return redirect(url_for('shop.catalog'))
 
         return f(*args, **kwargs)
 
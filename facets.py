@@ -0,0 +1,371 @@
+"""
+Faceted navigation.
+
+The storefront filters active products by category, price bucket, brand,
+in-stock and on-sale (compare_price above price). A category matches its
+whole subtree (categories.py), so a product counts towards its category
+and every ancestor. Counts follow the usual
+faceted rules: values of one facet are OR-ed, facets are AND-ed, and each
+facet's counts apply every filter except its own, so ticking a brand still
+shows how many products the other brands have.
+
+Counts come from a per-process bitmap index. Each facet value is a Python
+int with bit i set for the i-th active product, so a facet count is an AND
+of a few bitmaps and ``int.bit_count()``. That takes microseconds even at
+100k+ products, and the index costs about 12 KB per value. Results are also
+kept in an LRU per filter combination.
+
+Invalidation: product writes that change an indexed attribute, and
+category moves, bump the ``catalog`` row in cache_versions in the same
+transaction. This is done by a before_flush listener for ORM writes and by
+inventory.move_stock() when stock crosses zero. Bulk loads that bypass the
+ORM (generate_data.py) call invalidate() themselves. Each process checks
+that version at most every FACET_REFRESH_INTERVAL seconds. When it moved, the index is rebuilt in a
+background thread, and requests keep counting from the previous index until
+the new one is swapped in. Only the very first build, with nothing to serve
+yet, happens in the request.
+
+The admin product list gets its category and status counts from one
+grouped query instead. It includes inactive products and needs exact
+numbers right after an edit.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from sqlalchemy import case, event, false, func, inspect, or_, select
+from sqlalchemy.orm import Session
+
+from categories import path_ids, subtree_ids
+from models import db, upsert_insert
+from models.cache import CacheVersion
+from models.category import Category
+from models.product import Product
+
+CACHE_NAME = 'catalog'
+FACETS = ('category', 'price', 'brand', 'in_stock', 'on_sale')
+# (key, low, high): low <= price < high
+PRICE_BUCKETS = (('0-25', 0, 25), ('25-50', 25, 50), ('50-100', 50, 100), ('100-250', 100, 250),
+                 ('250-500', 250, 500), ('500+', 500, None))
+# Product attributes the index is built from; changing any of them invalidates it
+INDEXED_ATTRIBUTES = ('category_id', 'price', 'compare_price', 'brand', 'stock_quantity', 'is_active')
+
+logger = logging.getLogger(__name__)
+
+products = Product.__table__
+categories = Category.__table__
+versions = CacheVersion.__table__
+
+
+def price_bucket(price):
+    for key, low, high in PRICE_BUCKETS:
+        if price >= low and (high is None or price < high):
+            return key
+    return PRICE_BUCKETS[0][0]
+
+
+def parse_filters(args):
+    """Facet filters from request args: ?category=1&category=2&price=25-50&brand=X&in_stock=1&on_sale=1"""
+    buckets = {key for key, _, _ in PRICE_BUCKETS}
+    filters = {
+        'category': tuple(sorted({int(v) for v in args.getlist('category') if v.isdigit()})),
+        'price': tuple(sorted({v for v in args.getlist('price') if v in buckets})),
+        'brand': tuple(sorted({v.strip() for v in args.getlist('brand') if v.strip()})),
+        'in_stock': (True,) if args.get('in_stock') == '1' else (),
+        'on_sale': (True,) if args.get('on_sale') == '1' else (),
+    }
+    return {facet: values for facet, values in filters.items() if values}
+
+
+def filter_clauses(filters):
+    """The same filters as SQL, for fetching the matching products"""
+    clauses = []
+    if 'category' in filters:
+        paths = db.session.execute(
+            select(categories.c.path).where(categories.c.id.in_(filters['category']))).scalars().all()
+        matches = [products.c.category_id.in_(subtree_ids(*paths))] if paths else []
+        if 0 in filters['category']:
+            matches.append(products.c.category_id.is_(None))
+        clauses.append(or_(*matches) if matches else false())
+    if 'price' in filters:
+        ranges = []
+        for key, low, high in PRICE_BUCKETS:
+            if key in filters['price']:
+                ranges.append(products.c.price >= low if high is None
+                              else (products.c.price >= low) & (products.c.price < high))
+        clauses.append(or_(*ranges))
+    if 'brand' in filters:
+        clauses.append(products.c.brand.in_(filters['brand']))
+    if 'in_stock' in filters:
+        clauses.append(products.c.stock_quantity > 0)
+    if 'on_sale' in filters:
+        clauses.append(products.c.compare_price > products.c.price)
+    return clauses
+
+
+def invalidate(connection):
+    """Bump the catalog version on ``connection`` (inside the writer's transaction)"""
+    statement = upsert_insert(versions, connection).values(name=CACHE_NAME, version=1, updated_at=func.now())
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=['name'],
+        set_={'version': versions.c.version + 1, 'updated_at': func.now()},
+    ))
+
+
+def _invalidate_on_product_changes(session, flush_context, instances):
+    changed = any(isinstance(obj, Product) for obj in session.new | session.deleted) or any(
+        isinstance(obj, Product) and any(inspect(obj).attrs[name].history.has_changes() for name in INDEXED_ATTRIBUTES)
+        or isinstance(obj, Category) and inspect(obj).attrs.parent_id.history.has_changes()
+        for obj in session.dirty)
+    if changed:
+        # The flush hasn't started, so name the primary rather than let a read-only view route this to a replica
+        invalidate(session.connection(bind_arguments={'bind': db.engine}))
+
+
+class FacetIndex:
+    """Bitmaps over active products: bit i is set for the i-th product by id
+
+    ``ancestors`` maps a category id to the ids on its path, so a category's
+    bitmap covers its subtree.
+    """
+
+    def __init__(self, rows, version, ancestors=None):
+        ancestors = ancestors or {}
+        self.version = version
+        self.size = len(rows)
+        width = self.size // 8 + 1
+        arrays = {}
+        for i, (product_id, category_id, price, compare_price, brand, stock_quantity) in enumerate(rows):
+            keys = [('price', price_bucket(price))]
+            if category_id is None:
+                keys.append(('category', 0))
+            else:
+                keys.extend(('category', ancestor) for ancestor in ancestors.get(category_id, (category_id,)))
+            if brand:
+                keys.append(('brand', brand))
+            if stock_quantity > 0:
+                keys.append(('in_stock', True))
+            if compare_price is not None and compare_price > price:
+                keys.append(('on_sale', True))
+            for key in keys:
+                array = arrays.get(key)
+                if array is None:
+                    array = arrays[key] = bytearray(width)
+                array[i >> 3] |= 1 << (i & 7)
+
+        self.bitmaps = {key: int.from_bytes(array, 'little') for key, array in arrays.items()}
+        self.values = defaultdict(list)
+        for facet, value in sorted(self.bitmaps, key=lambda key: (key[0], str(key[1]))):
+            self.values[facet].append(value)
+        self.everything = (1 << self.size) - 1
+
+    def match(self, filters, skip=None):
+        """Bitmap of products passing every filter except facet ``skip``"""
+        result = self.everything
+        for facet, values in filters.items():
+            if facet == skip:
+                continue
+            selected = 0
+            for value in values:
+                selected |= self.bitmaps.get((facet, value), 0)
+            result &= selected
+        return result
+
+    def counts(self, filters):
+        """(matching products, {facet: {value: count}}) for ``filters``"""
+        counts = {}
+        for facet in FACETS:
+            base = self.match(filters, skip=facet)
+            counts[facet] = {value: (base & self.bitmaps[(facet, value)]).bit_count()
+                             for value in self.values[facet]}
+        return self.match(filters).bit_count(), counts
+
+
+class FacetCache:
+    """The process's FacetIndex plus an LRU of counts per filter combination"""
+
+    def __init__(self, size=1024, refresh_interval=2.0, app=None):
+        self.size = size
+        self.refresh_interval = refresh_interval
+        self.app = app  # for the rebuild thread's app context
+        self.index = None
+        self.hits = 0
+        self.misses = 0
+        self.rebuilds = 0
+        self._checked = 0.0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+        self._rebuilding = False
+
+    @staticmethod
+    def _current_version():
+        return db.session.execute(
+            select(versions.c.version).where(versions.c.name == CACHE_NAME)).scalar() or 0
+
+    def _build(self):
+        """A FacetIndex of the current catalog"""
+        # Version first: a write landing in between only costs one more rebuild
+        version = self._current_version()
+        rows = db.session.execute(
+            select(products.c.id, products.c.category_id, products.c.price, products.c.compare_price,
+                   products.c.brand, products.c.stock_quantity)
+            .where(products.c.is_active.is_(True))
+            .order_by(products.c.id)
+        ).all()
+        ancestors = {category_id: path_ids(path) for category_id, path in db.session.execute(
+            select(categories.c.id, categories.c.path))}
+        return FacetIndex(rows, version, ancestors)
+
+    def _swap(self, index):
+        with self._lock:
+            self.index = index
+            self._results.clear()
+            self.rebuilds += 1
+
+    def _rebuild_in_background(self):
+        try:
+            with self.app.app_context():
+                self._swap(self._build())
+        except Exception:
+            logger.exception('Facet index rebuild failed; still serving version %s', self.index.version)
+        finally:
+            self._rebuilding = False
+
+    def get_index(self):
+        index = self.index
+        if index is not None and time.monotonic() - self._checked < self.refresh_interval:
+            return index
+        with self._lock:
+            if self.index is None:
+                # Nothing to serve yet, so this one build happens in the request
+                self.index = self._build()
+                self.rebuilds += 1
+                self._checked = time.monotonic()
+                return self.index
+            if time.monotonic() - self._checked < self.refresh_interval:
+                return self.index
+            self._checked = time.monotonic()
+            stale = not self._rebuilding and self._current_version() != self.index.version
+            if stale and self.app is not None:
+                self._rebuilding = True
+                threading.Thread(target=self._rebuild_in_background, name='facet-rebuild', daemon=True).start()
+            elif stale:
+                self.index = self._build()
+                self._results.clear()
+                self.rebuilds += 1
+            return self.index
+
+    def counts(self, filters):
+        index = self.get_index()
+        key = (index.version, tuple(sorted(filters.items())))
+        with self._lock:
+            result = self._results.get(key)
+            if result is not None:
+                self._results.move_to_end(key)
+                self.hits += 1
+                return result
+        result = index.counts(filters)
+        with self._lock:
+            self.misses += 1
+            self._results[key] = result
+            while len(self._results) > self.size:
+                self._results.popitem(last=False)
+        return result
+
+    def stats(self):
+        return {'products': self.index.size if self.index else 0,
+                'version': self.index.version if self.index else None,
+                'cached': len(self._results), 'hits': self.hits, 'misses': self.misses,
+                'rebuilds': self.rebuilds}
+
+
+def facet_groups(counts, filters, category_tree, brand_limit=20):
+    """Sidebar entries [(label, param, [(value, text, count, selected, depth)])]
+
+    ``category_tree`` is [(id, name, parent_id, depth)] in tree order. Top
+    level categories are listed, plus the children of selected categories
+    and of their ancestors. Values with no matches are left out unless
+    selected; brands are limited to the ``brand_limit`` largest.
+    """
+    def entries(facet, values):
+        chosen = filters.get(facet, ())
+        return [(value, text, count, value in chosen, depth)
+                for value, text, count, depth in values if count or value in chosen]
+
+    parents = {category_id: parent_id for category_id, _, parent_id, _ in category_tree}
+    expanded = set()
+    for category_id in filters.get('category', ()):
+        while category_id in parents:
+            expanded.add(category_id)
+            category_id = parents[category_id]
+    categories = [(category_id, name, counts['category'].get(category_id, 0), depth)
+                  for category_id, name, parent_id, depth in category_tree
+                  if parent_id is None or parent_id in expanded]
+    categories.append((0, 'Uncategorized', counts['category'].get(0, 0), 0))
+
+    brands = sorted(counts['brand'].items(), key=lambda item: (-item[1], item[0]))[:brand_limit]
+    brands += [(value, counts['brand'].get(value, 0)) for value in filters.get('brand', ()) if value not in dict(brands)]
+    price_labels = {key: f'${low}+' if high is None else f'${low} - ${high}' for key, low, high in PRICE_BUCKETS}
+    return [
+        ('Category', 'category', entries('category', categories)),
+        ('Price', 'price', entries('price', [
+            (key, price_labels[key], counts['price'].get(key, 0), 0) for key, _, _ in PRICE_BUCKETS])),
+        ('Brand', 'brand', entries('brand', [(value, value, count, 0) for value, count in brands])),
+        ('Availability', 'in_stock', entries('in_stock', [(True, 'In stock', counts['in_stock'].get(True, 0), 0)])),
+        ('Deals', 'on_sale', entries('on_sale', [(True, 'On sale', counts['on_sale'].get(True, 0), 0)])),
+    ]
+
+
+def admin_counts(search_clause=None, category_id=None, status=''):
+    """Category and status counts for the admin product list from one grouped query
+
+    Each facet's counts apply the other facet's filter (and the search), like
+    the storefront: ({category_id: count}, {status: count}, all categories).
+    A category's count includes its subtree.
+    """
+    low_stock = (products.c.stock_quantity > 0) & (products.c.stock_quantity <= products.c.low_stock_threshold)
+    columns = {
+        '': func.count(),
+        'active': func.sum(case((products.c.is_active.is_(True), 1), else_=0)),
+        'inactive': func.sum(case((products.c.is_active.is_(False), 1), else_=0)),
+        'low_stock': func.sum(case((low_stock, 1), else_=0)),
+        'out_of_stock': func.sum(case((products.c.stock_quantity == 0, 1), else_=0)),
+    }
+    query = (select(func.coalesce(products.c.category_id, 0), *columns.values())
+             .group_by(func.coalesce(products.c.category_id, 0)))
+    if search_clause is not None:
+        query = query.where(search_clause)
+
+    ancestors = {category: path_ids(path) for category, path in db.session.execute(
+        select(categories.c.id, categories.c.path))}
+    statuses = list(columns)
+    by_category, by_status, total = defaultdict(int), dict.fromkeys(statuses, 0), 0
+    for category, *counts in db.session.execute(query).all():
+        row = dict(zip(statuses, (count or 0 for count in counts)))
+        total += row.get(status, row[''])
+        path = ancestors.get(category, [category])
+        for ancestor in path:
+            by_category[ancestor] += row.get(status, row[''])
+        if not category_id or category_id in path:
+            for name in statuses:
+                by_status[name] += row[name]
+    return dict(by_category), by_status, total
+
+
+def get_facet_cache():
+    from flask import current_app
+    return current_app.extensions['facets']
+
+
+def init_facets(app):
+    """Per-process facet index, invalidated through cache_versions"""
+    cache = FacetCache(size=app.config.get('FACET_CACHE_SIZE', 1024),
+                       refresh_interval=app.config.get('FACET_REFRESH_INTERVAL', 2.0), app=app)
+    app.extensions['facets'] = cache
+
+    # Session events are registered on the Session class, shared by every app
+    # in the process, so only listen once
+    if not event.contains(Session, 'before_flush', _invalidate_on_product_changes):
+        event.listen(Session, 'before_flush', _invalidate_on_product_changes)
+    return cache
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+"""
+Generate a large, realistic, reproducible dataset
+
+Categories, products, users, orders and order items with skewed
+distributions like production traffic:
+
+    - product popularity follows a Zipf law (a few best sellers, a long tail),
+      applied over a seeded shuffle so popular products are spread across ids
+    - categories are Zipf-sized too, and past the first len(CATEGORY_NAMES)
+      they nest one level under the category they're named after; prices
+      are log-normal
+    - repeat customers: orders pick users with a Zipf law, ~10% are guests
+    - order times are spread over --days and ids increase with time;
+      older orders are mostly delivered, recent ones mostly pending
+
+Rows are generated a batch at a time (``random.choices`` over precomputed
+cumulative weights) and written with ``COPY`` on PostgreSQL (psycopg2) or a
+multi-row ``executemany`` elsewhere, so memory stays flat and millions of
+orders take minutes. The same --seed and --now always produce the same data.
+
+Ids are assigned here, continuing after the current maximum, so the script
+can add to an existing database. PostgreSQL sequences are moved past the
+new rows afterwards.
+
+Usage:
+  python generate_data.py [--orders 1000000] [--products 20000] [--users 200000]
+                          [--categories 60] [--seed 42] [--zipf 1.1] [--days 365]
+"""
+import argparse
+import csv
+import io
+import itertools
+import random
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select, text
+
+ADJECTIVES = ['Classic', 'Wireless', 'Organic', 'Premium', 'Compact', 'Smart', 'Vintage', 'Ultra',
+              'Eco', 'Portable', 'Deluxe', 'Mini', 'Pro', 'Handmade', 'Lightweight', 'Heavy-Duty']
+NOUNS = ['Headphones', 'Yoga Mat', 'Coffee Maker', 'Backpack', 'Desk Lamp', 'Water Bottle', 'Sneakers',
+         'Watch', 'Keyboard', 'Blender', 'Jacket', 'Notebook', 'Speaker', 'Sunglasses', 'Tent', 'Kettle',
+         'Mouse', 'Camera', 'Wallet', 'Pillow', 'Charger', 'Mug', 'Chair', 'Rice Cooker']
+BRANDS = ['SoundMax', 'TechWear', 'BrewMaster', 'UrbanCarry', 'BoomSound', 'Northpeak', 'Lumen', 'Evergreen',
+          'Kinetic', 'Harbor & Co']
+CATEGORY_NAMES = ['Electronics', 'Sports & Fitness', 'Home & Kitchen', 'Fashion', 'Books', 'Toys',
+                  'Beauty', 'Garden', 'Automotive', 'Office', 'Pets', 'Groceries', 'Health', 'Music',
+                  'Outdoors', 'Baby']
+CITIES = [('Phnom Penh', 'Cambodia'), ('Siem Reap', 'Cambodia'), ('Battambang', 'Cambodia'),
+          ('Bangkok', 'Thailand'), ('Ho Chi Minh City', 'Vietnam'), ('Singapore', 'Singapore'),
+          ('Kuala Lumpur', 'Malaysia')]
+CITY_WEIGHTS = list(itertools.accumulate([50, 12, 8, 10, 8, 7, 5]))
+
+# (max age in days, [(status, weight), ...]); last row applies to anything older
+STATUS_BY_AGE = [
+    (2, [('pending', 60), ('approved', 25), ('processing', 10), ('cancelled', 5)]),
+    (7, [('approved', 20), ('processing', 20), ('shipped', 45), ('cancelled', 10), ('rejected', 5)]),
+    (None, [('delivered', 85), ('shipped', 3), ('cancelled', 8), ('rejected', 4)]),
+]
+
+
+def zipf_cum_weights(n, s):
+    """Cumulative Zipf weights for ranks 1..n"""
+    return list(itertools.accumulate(1.0 / (rank ** s) for rank in range(1, n + 1)))
+
+
+def user_email(n, domain='example.com'):
+    return f'user{n}@{domain}'
+
+
+class BulkWriter:
+    """COPY on PostgreSQL/psycopg2, executemany everywhere else"""
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.use_copy = engine.dialect.name == 'postgresql' and engine.dialect.driver == 'psycopg2'
+
+    def write(self, table, rows):
+        if not rows:
+            return
+        if self.use_copy:
+            self._copy(table, rows)
+        else:
+            with self.engine.begin() as conn:
+                conn.execute(table.insert(), rows)
+
+    def _copy(self, table, rows):
+        columns = list(rows[0])
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            # An unquoted empty field is NULL in COPY's CSV format
+            writer.writerow(['' if row[c] is None else row[c] for c in columns])
+        buffer.seek(0)
+        raw = self.engine.raw_connection()
+        try:
+            with raw.cursor() as cursor:
+                cursor.copy_expert(
+                    f'COPY {table.name} ({", ".join(columns)}) FROM STDIN WITH (FORMAT csv)', buffer)
+            raw.commit()
+        finally:
+            raw.close()
+
+    def next_id(self, table):
+        with self.engine.connect() as conn:
+            return (conn.execute(select(func.max(table.c.id))).scalar() or 0) + 1
+
+    def reset_sequence(self, table):
+        if self.engine.dialect.name != 'postgresql':
+            return
+        with self.engine.begin() as conn:
+            conn.execute(text(
+                f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+                f"(SELECT COALESCE(MAX(id), 1) FROM {table.name}))"))
+
+
+class Generator:
+    def __init__(self, engine, seed=42, zipf_s=1.1, days=365, batch_size=10000,
+                 password='password', email_domain='example.com', stock=(0, 500), inactive_rate=0.03,
+                 now=None, log=print):
+        self.writer = BulkWriter(engine)
+        self.rng = random.Random(seed)
+        self.zipf_s = zipf_s
+        self.days = days
+        self.batch_size = batch_size
+        self.password = password
+        self.email_domain = email_domain
+        self.stock = stock
+        self.inactive_rate = inactive_rate
+        # Timestamps are relative to midnight, so a seed gives the same data all day
+        self.now = now or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.log = log
+
+        from models.category import Category
+        from models.inventory import StockMovement
+        from models.order import Order, OrderItem
+        from models.product import Product
+        from models.user import User
+        self.categories = Category.__table__
+        self.products = Product.__table__
+        self.users = User.__table__
+        self.orders = Order.__table__
+        self.order_items = OrderItem.__table__
+        self.stock_movements = StockMovement.__table__
+
+    def _timed(self, label, count, fn):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        self.log(f"✓ {count:,} {label} in {elapsed:.1f}s ({count / elapsed if elapsed else 0:,.0f}/s)")
+
+    def _created_at(self, count):
+        """Random timestamps over the window, oldest first"""
+        span = self.days * 86400
+        return [self.now - timedelta(seconds=s)
+                for s in sorted((self.rng.randrange(span) for _ in range(count)), reverse=True)]
+
+    def generate_categories(self, count):
+        first = self.writer.next_id(self.categories)
+        rows = []
+        for i in range(count):
+            base = CATEGORY_NAMES[i % len(CATEGORY_NAMES)]
+            name = base if i < len(CATEGORY_NAMES) else f'{base} {i // len(CATEGORY_NAMES) + 1}'
+            parent_id = first + i % len(CATEGORY_NAMES) if i >= len(CATEGORY_NAMES) else None
+            # Product counts are filled in afterwards by `flask categories-check --fix`
+            rows.append({'id': first + i, 'name': f'{name} #{first + i}' if first > 1 else name,
+                         'slug': f'category-{first + i}', 'description': f'{name} products',
+                         'parent_id': parent_id, 'depth': 0 if parent_id is None else 1,
+                         'path': f'/{first + i}/' if parent_id is None else f'/{parent_id}/{first + i}/',
+                         'product_count': 0, 'subtree_product_count': 0,
+                         'is_active': True, 'created_at': self.now, 'updated_at': self.now})
+        self._timed('categories', count, lambda: self.writer.write(self.categories, rows))
+        self.writer.reset_sequence(self.categories)
+        return [row['id'] for row in rows]
+
+    def generate_products(self, count, category_ids):
+        first = self.writer.next_id(self.products)
+        category_weights = zipf_cum_weights(len(category_ids), 0.8)
+        created = self._created_at(count)
+        rng = self.rng
+        catalog = {}  # id -> (name, price) for order items
+
+        def write():
+            for start in range(0, count, self.batch_size):
+                size = min(self.batch_size, count - start)
+                cats = rng.choices(category_ids, cum_weights=category_weights, k=size)
+                rows, movements = [], []
+                for offset in range(size):
+                    pid = first + start + offset
+                    name = f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {pid}'
+                    price = round(min(max(rng.lognormvariate(3.3, 0.9), 1.0), 5000.0), 2)
+                    catalog[pid] = (name, price)
+                    compare_price = round(price * rng.uniform(1.1, 1.5), 2) if rng.random() < 0.25 else None
+                    cost_price = round(price * rng.uniform(0.4, 0.8), 2)
+                    stock = rng.randint(*self.stock)
+                    rows.append({
+                        'id': pid, 'name': name, 'slug': f'product-{pid}', 'sku': f'SKU-{pid:08d}',
+                        'description': f'{name}: synthetic product for load and query-plan testing.',
+                        'price': price,
+                        'compare_price': compare_price, 'cost_price': cost_price,
+                        'stock_quantity': stock, 'low_stock_threshold': 10,
+                        'image_url': None, 'weight': round(rng.uniform(0.1, 10), 2), 'dimensions': None,
+                        'brand': BRANDS[pid % len(BRANDS)],
+                        'category_id': cats[offset], 'is_active': rng.random() >= self.inactive_rate,
+                        'is_featured': rng.random() < 0.02,
+                        'created_at': created[start + offset], 'updated_at': created[start + offset],
+                    })
+                    # Opening stock goes in the ledger so `flask stock-check` adds up
+                    if stock:
+                        movements.append({'product_id': pid, 'kind': 'restock', 'quantity': stock,
+                                          'balance_after': stock, 'order_id': None, 'user_id': None,
+                                          'note': 'Opening stock', 'created_at': created[start + offset]})
+                self.writer.write(self.products, rows)
+                self.writer.write(self.stock_movements, movements)
+
+        self._timed('products', count, write)
+        self.writer.reset_sequence(self.products)
+        self.writer.reset_sequence(self.stock_movements)
+        return catalog
+
+    def generate_users(self, count):
+        from werkzeug.security import generate_password_hash
+
+        first = self.writer.next_id(self.users)
+        # Hashing is deliberately slow; every synthetic user shares one hash
+        password_hash = generate_password_hash(self.password)
+        created = self._created_at(count)
+
+        def write():
+            for start in range(0, count, self.batch_size):
+                rows = [{'id': uid, 'username': f'user{uid}', 'email': user_email(uid, self.email_domain),
+                         'password_hash': password_hash, 'is_admin': False, 'created_at': created[uid - first]}
+                        for uid in range(first + start, first + min(start + self.batch_size, count))]
+                self.writer.write(self.users, rows)
+
+        self._timed('users', count, write)
+        self.writer.reset_sequence(self.users)
+        return list(range(first, first + count))
+
+    def _status(self, age_days):
+        for max_age, choices in STATUS_BY_AGE:
+            if max_age is None or age_days <= max_age:
+                return self.rng.choices([c[0] for c in choices], weights=[c[1] for c in choices])[0]
+
+    def generate_orders(self, count, catalog, user_ids, guest_rate=0.1, max_items=5):
+        first_order = self.writer.next_id(self.orders)
+        first_item = self.writer.next_id(self.order_items)
+        rng = self.rng
+
+        # Popularity rank -> product id, shuffled so best sellers aren't just the lowest ids
+        ranked_products = list(catalog)
+        rng.shuffle(ranked_products)
+        product_weights = zipf_cum_weights(len(ranked_products), self.zipf_s)
+        ranked_users = list(user_ids)
+        rng.shuffle(ranked_users)
+        user_weights = zipf_cum_weights(len(ranked_users), 0.7) if ranked_users else None
+        # 1 item is most common, then 2, ...
+        item_counts = list(range(1, max_items + 1))
+        item_count_weights = list(itertools.accumulate(0.5 ** n for n in item_counts))
+        created = self._created_at(count)
+        totals = {'items': 0}
+
+        def write():
+            item_id = first_item
+            for start in range(0, count, self.batch_size):
+                size = min(self.batch_size, count - start)
+                n_items = rng.choices(item_counts, cum_weights=item_count_weights, k=size)
+                picks = iter(rng.choices(ranked_products, cum_weights=product_weights, k=sum(n_items)))
+                buyers = rng.choices(ranked_users, cum_weights=user_weights, k=size) if ranked_users else [None] * size
+                order_rows, item_rows = [], []
+                for offset in range(size):
+                    oid = first_order + start + offset
+                    created_at = created[start + offset]
+                    status = self._status((self.now - created_at).days)
+                    subtotal = 0.0
+                    for product_id in dict.fromkeys(itertools.islice(picks, n_items[offset])):
+                        quantity = 1 if rng.random() < 0.8 else rng.randint(2, 4)
+                        name, price = catalog[product_id]
+                        line = round(price * quantity, 2)
+                        subtotal += line
+                        item_rows.append({
+                            'id': item_id, 'order_id': oid, 'product_id': product_id,
+                            'product_name': name, 'product_sku': f'SKU-{product_id:08d}',
+                            'product_image': None, 'price': price, 'quantity': quantity,
+                            'subtotal': line,
+                        })
+                        item_id += 1
+                    shipping = 0.0 if subtotal >= 100 else 5.0
+                    city, country = rng.choices(CITIES, cum_weights=CITY_WEIGHTS)[0]
+                    guest = rng.random() < guest_rate
+                    user_id = None if guest else buyers[offset]
+                    order_rows.append({
+                        'id': oid, 'order_number': f'ORD-GEN{oid:010d}', 'user_id': user_id,
+                        'customer_name': f'Customer {user_id or oid}',
+                        'customer_email': user_email(user_id, self.email_domain) if user_id else f'guest{oid}@example.net',
+                        'customer_phone': f'0{rng.randint(10000000, 99999999)}',
+                        'shipping_address': f'{rng.randint(1, 999)} Street {rng.randint(1, 600)}',
+                        'shipping_city': city, 'shipping_state': None, 'shipping_zip': None,
+                        'shipping_country': country,
+                        'subtotal': round(subtotal, 2), 'shipping_cost': shipping, 'tax': 0,
+                        'total': round(subtotal + shipping, 2), 'status': status,
+                        'payment_method': rng.choice(['bakong', 'paypal', 'cod']),
+                        'payment_status': 'paid' if status in ('shipped', 'delivered') else 'pending',
+                        'customer_notes': None, 'admin_notes': None,
+                        'created_at': created_at, 'updated_at': created_at,
+                        'approved_at': created_at + timedelta(hours=2) if status not in ('pending', 'cancelled', 'rejected') else None,
+                        'shipped_at': created_at + timedelta(days=1) if status in ('shipped', 'delivered') else None,
+                        'delivered_at': created_at + timedelta(days=3) if status == 'delivered' else None,
+                    })
+                self.writer.write(self.orders, order_rows)
+                self.writer.write(self.order_items, item_rows)
+                totals['items'] += len(item_rows)
+                if (start // self.batch_size) % 20 == 19:
+                    self.log(f"  {start + size:,} / {count:,} orders")
+
+        self._timed('orders', count, write)
+        self.log(f"✓ {totals['items']:,} order items")
+        self.writer.reset_sequence(self.orders)
+        self.writer.reset_sequence(self.order_items)
+
+
+def generate(engine, categories=60, products=20000, users=200000, orders=1000000, **options):
+    """Create tables if needed and append a synthetic dataset"""
+    from models import db
+
+    db.metadata.create_all(engine)
+    generator = Generator(engine, **options)
+    category_ids = generator.generate_categories(categories)
+    catalog = generator.generate_products(products, category_ids)
+    user_ids = generator.generate_users(users)
+    generator.generate_orders(orders, catalog, user_ids)
+    return generator
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a large synthetic dataset')
+    parser.add_argument('--categories', type=int, default=60)
+    parser.add_argument('--products', type=int, default=20000)
+    parser.add_argument('--users', type=int, default=200000)
+    parser.add_argument('--orders', type=int, default=1000000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--zipf', type=float, default=1.1, help='product popularity skew')
+    parser.add_argument('--days', type=int, default=365, help='spread orders over this many days')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    parser.add_argument('--password', default='password', help='password for every generated user')
+    parser.add_argument('--email-domain', default='example.com', help='users are user<id>@<domain>')
+    parser.add_argument('--now', type=datetime.fromisoformat,
+                        help='end of the order window (default: today 00:00 UTC); fix it for identical reruns')
+    args = parser.parse_args()
+
+    from app import create_app
+    from models import db
+
+    app = create_app()
+    with app.app_context():
+        engine = db.engine
+        print(f"Generating into {engine.url.render_as_string(hide_password=True)} (seed {args.seed})")
+        generate(engine, categories=args.categories, products=args.products, users=args.users,
+                 orders=args.orders, seed=args.seed, zipf_s=args.zipf, days=args.days,
+                 batch_size=args.batch_size, password=args.password,
+                 email_domain=args.email_domain, now=args.now)
+
+        # Products went in around the ORM; count them into their categories
+        from categories import check_tree
+        start = time.perf_counter()
+        drift = check_tree(fix=True)
+        print(f"✓ {len(drift):,} category counts in {time.perf_counter() - start:.1f}s")
+
+        # Orders went in without status transitions; rebuild the sales rollups from them
+        from analytics import backfill
+        start = time.perf_counter()
+        rows = backfill()
+        print(f"✓ {rows:,} sales rollup rows in {time.perf_counter() - start:.1f}s")
+
+        # Running workers' facet indexes don't know about the new products yet
+        from facets import invalidate
+        invalidate(db.session.connection())
+        db.session.commit()
+        print("✓ Facet cache invalidated")
@@ -0,0 +1,64 @@
+"""
+Gunicorn settings
+
+Run with:  gunicorn wsgi:app
+
+WEB_CONCURRENCY sets the worker count; connection_budget.py reads the same
+variable to size each worker's database pool, so the total stays within
+DB_CONNECTION_BUDGET. With more than one node, set NODE_COUNT and a
+distinct NODE_ID on each.
+"""
+import glob
+import os
+import tempfile
+
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+
+# Export the worker count so the app sees it even when it came from the default
+os.environ.setdefault('WEB_CONCURRENCY', str(workers))
+os.environ.setdefault('GUNICORN_THREADS', str(threads))
+
+
+def on_starting(server):
+    from order_ids import SLOTS_PER_NODE, node_id
+
+    # Fails now, not at the first order, when NODE_ID is missing or out of range
+    node_id()
+    if workers > SLOTS_PER_NODE:
+        raise RuntimeError(f'At most {SLOTS_PER_NODE} workers per node can have their own order id slot')
+
+    # Metrics from a previous run would otherwise be merged into this one
+    metrics_dir = os.environ.get('METRICS_DIR') or os.path.join(tempfile.gettempdir(), 'flaskmart-metrics')
+    for path in glob.glob(os.path.join(metrics_dir, '*.json')):
+        os.remove(path)
+
+
+# Order id slots suggested to live workers; only the master touches this.
+# The slot lock files are what actually keeps ids apart (see order_ids.py)
+_used_slots = set()
+
+
+def pre_fork(server, worker):
+    # Runs in the master, so the pool sees every worker; a respawned worker
+    # is offered the slot its predecessor gave back in child_exit
+    from order_ids import SLOTS_PER_NODE
+    worker.order_id_slot = min(set(range(SLOTS_PER_NODE)) - _used_slots)
+    _used_slots.add(worker.order_id_slot)
+
+
+def post_fork(server, worker):
+    from order_ids import lock_slot, worker_id_for
+
+    # Held until the worker exits; another process may already have the suggested slot
+    slot = lock_slot(worker.order_id_slot)
+    if slot != worker.order_id_slot:
+        server.log.warning('Order id slot %d is held by another process; worker %s took slot %d',
+                           worker.order_id_slot, worker.pid, slot)
+    os.environ['ORDER_ID_WORKER_ID'] = str(worker_id_for(slot))
+
+
+def child_exit(server, worker):
+    _used_slots.discard(getattr(worker, 'order_id_slot', None))
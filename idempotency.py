@@ -0,0 +1,210 @@
+"""
+Idempotency-key support for POST endpoints.
+
+Clients send an ``Idempotency-Key`` header (or an ``idempotency_key`` form
+field for plain HTML forms). The first request with a key claims it by
+inserting an ``in_progress`` row; the unique index on (endpoint, key) makes
+the claim atomic across workers. Duplicates that arrive while the first
+request is still running wait for it to finish and get its stored response
+instead of redoing the work.
+
+A claim is a lease of IDEMPOTENCY_LEASE seconds. If the worker holding it
+dies mid-request (OOM, SIGKILL, deploy), the key is never released, so
+once the lease has passed a retry takes the key over and runs the request
+again. A stored response is kept for IDEMPOTENCY_TTL seconds. Failed
+requests (exceptions or 5xx responses) release their key so the client can
+retry; anything below 500 is replayed, so a decorated view must not answer
+a failure worth retrying with a 200 error page.
+"""
+import hashlib
+import time
+from datetime import datetime, timedelta
+from functools import wraps
+
+from flask import request, session, current_app, jsonify, make_response
+from sqlalchemy import insert, select, update, delete
+from sqlalchemy.exc import IntegrityError
+
+from models import db
+from models.idempotency import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+FORM_FIELD = 'idempotency_key'
+
+DEFAULT_TTL = 24 * 3600
+DEFAULT_WAIT_TIMEOUT = 10
+LEASE_FACTOR = 6  # default lease, in wait timeouts
+POLL_INTERVAL = 0.05
+MAX_POLL_INTERVAL = 0.5
+
+table = IdempotencyKey.__table__
+
+
+def get_request_key():
+    """Return the idempotency key sent with the current request, if any"""
+    key = request.headers.get(HEADER) or request.form.get(FORM_FIELD)
+    if key:
+        key = key.strip()[:200]
+    return key or None
+
+
+def request_fingerprint():
+    """Hash the request payload so a key can't be reused for a different request"""
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.path.encode())
+    if request.form:
+        for name, value in sorted(request.form.items(multi=True)):
+            if name != FORM_FIELD:
+                digest.update(f'{name}={value}\n'.encode())
+    else:
+        digest.update(request.get_data(cache=True))
+    return digest.hexdigest()
+
+
+def _scoped_key(key):
+    # Keys are per user, so two customers can't collide on the same value
+    return f"{session.get('user_id', 'guest')}:{key}"
+
+
+def _claim(endpoint, key, fingerprint, lease):
+    """Try to claim a key for ``lease`` seconds; returns the claim's created_at, or None"""
+    now = datetime.utcnow()
+    with db.engine.begin() as conn:
+        # An expired key, or an in-progress one whose lease ran out, is free to be claimed again
+        conn.execute(
+            delete(table).where(
+                table.c.endpoint == endpoint,
+                table.c.key == key,
+                table.c.expires_at < now
+            )
+        )
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(insert(table).values(
+                endpoint=endpoint,
+                key=key,
+                fingerprint=fingerprint,
+                status='in_progress',
+                created_at=now,
+                expires_at=now + timedelta(seconds=lease)
+            ))
+        return now
+    except IntegrityError:
+        return None
+
+
+def _load(endpoint, key):
+    with db.engine.connect() as conn:
+        return conn.execute(
+            select(table).where(table.c.endpoint == endpoint, table.c.key == key)
+        ).first()
+
+
+def _release(endpoint, key, claimed_at):
+    # Only this request's own claim, not one that took it over after its lease ran out
+    with db.engine.begin() as conn:
+        conn.execute(delete(table).where(table.c.endpoint == endpoint, table.c.key == key,
+                                         table.c.created_at == claimed_at))
+
+
+def _store(endpoint, key, claimed_at, response, ttl):
+    """Keep the response for replays, for ``ttl`` seconds from now (own claim only)"""
+    with db.engine.begin() as conn:
+        conn.execute(
+            update(table)
+            .where(table.c.endpoint == endpoint, table.c.key == key, table.c.created_at == claimed_at)
+            .values(
+                status='completed',
+                response_status=response.status_code,
+                response_mimetype=response.mimetype,
+                response_body=response.get_data(),
+                expires_at=datetime.utcnow() + timedelta(seconds=ttl)
+            )
+        )
+
+
+def _replay(row):
+    response = make_response(row.response_body, row.response_status)
+    response.mimetype = row.response_mimetype
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def _conflict(message, status):
+    return jsonify({'success': False, 'message': message}), status
+
+
+def _wait_for_completion(endpoint, key, timeout):
+    """Poll until the in-flight request finishes; returns the final row or None"""
+    deadline = time.monotonic() + timeout
+    interval = POLL_INTERVAL
+    while time.monotonic() < deadline:
+        time.sleep(interval)
+        row = _load(endpoint, key)
+        if row is None or row.status == 'completed':
+            return row
+        interval = min(interval * 2, MAX_POLL_INTERVAL)
+    return _load(endpoint, key)
+
+
+def idempotent(f):
+    """Decorator making a POST endpoint safe to retry with an Idempotency-Key"""
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        key = get_request_key()
+        if not key:
+            return f(*args, **kwargs)
+
+        ttl = current_app.config.get('IDEMPOTENCY_TTL', DEFAULT_TTL)
+        wait_timeout = current_app.config.get('IDEMPOTENCY_WAIT_TIMEOUT', DEFAULT_WAIT_TIMEOUT)
+        lease = current_app.config.get('IDEMPOTENCY_LEASE') or wait_timeout * LEASE_FACTOR
+
+        endpoint = request.endpoint
+        key = _scoped_key(key)
+        fingerprint = request_fingerprint()
+
+        # Loop in case the request we waited on failed and released the key,
+        # or died and let its lease run out
+        for _ in range(3):
+            claimed_at = _claim(endpoint, key, fingerprint, lease)
+            if claimed_at is not None:
+                break
+
+            row = _load(endpoint, key)
+            if row is not None and row.fingerprint != fingerprint:
+                return _conflict('Idempotency key was already used for a different request', 422)
+
+            if row is not None and row.status == 'in_progress':
+                row = _wait_for_completion(endpoint, key, wait_timeout)
+
+            if row is not None and row.status == 'completed':
+                return _replay(row)
+            if row is not None and row.expires_at < datetime.utcnow():
+                continue
+            if row is not None:
+                return _conflict('A request with this idempotency key is still in progress', 409)
+        else:
+            return _conflict('Could not acquire idempotency key, please retry', 409)
+
+        try:
+            response = make_response(f(*args, **kwargs))
+        except Exception:
+            _release(endpoint, key, claimed_at)
+            raise
+
+        if response.status_code >= 500:
+            _release(endpoint, key, claimed_at)
+        else:
+            _store(endpoint, key, claimed_at, response, ttl)
+        return response
+
+    return decorated_function
+
+
+def purge_expired():
+    """Delete expired keys; returns the number of rows removed"""
+    with db.engine.begin() as conn:
+        result = conn.execute(delete(table).where(table.c.expires_at < datetime.utcnow()))
+    return result.rowcount
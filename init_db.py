@@ -2,7 +2,7 @@
 """
 Database initialization and management script
 """
-from app import app
+from wsgi import app
 from models import db
 from models.user import User
 
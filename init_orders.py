@@ -2,7 +2,7 @@
 """
 Initialize Orders tables in the database
 """
-from app import app
+from wsgi import app
 from models import db
 from models.order import Order, OrderItem
 
@@ -70,11 +70,11 @@ def get_order_stats():
         print(f"Rejected: {rejected}")
 
         if total > 0:
-            from sqlalchemy import func
-            total_revenue = db.session.query(func.sum(Order.total)).filter(
-                Order.status.in_(['approved', 'shipped', 'delivered'])
-            ).scalar() or 0
-            print(f"\nTotal Revenue (Approved+): ${total_revenue:.2f}")
+            from analytics import sales_totals
+            totals = sales_totals('all')
+            revenue = totals[0][3] if totals else 0
+            print(f"\nTotal Revenue (Approved+, items): ${revenue:.2f}")
+            print("  from the sales rollups; run `flask sales-backfill` if orders were loaded directly")
 
 
 if __name__ == '__main__':
@@ -2,7 +2,7 @@
 """
 Initialize Product and Category tables in the database
 """
-from app import app
+from wsgi import app
 from models import db
 from models.category import Category
 from models.product import Product
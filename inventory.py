@@ -0,0 +1,187 @@
+"""
+Stock ledger.
+
+Every change to a product's stock is an append-only ``stock_movements`` row:
+
+    order       stock taken by a placed order (negative)
+    cancel      stock returned by a rejected or cancelled order
+    restock     stock received, including a new product's opening stock
+    adjustment  manual correction from the admin product form
+
+``Product.stock_quantity`` is the projection of that ledger: move_stock() updates
+it with a single ``stock_quantity = stock_quantity + delta`` statement in the
+same transaction as the movement, so reading current stock stays O(1) and
+concurrent orders and admin saves add up instead of overwriting each other.
+Order movements are conditional on enough stock being left, which replaces
+the old read-then-write check.
+
+``flask stock-snapshot`` (run it from cron, e.g. nightly) records every
+product's on-hand quantity; stock_at() answers "how many did we have on
+date X" from the movement just before X, and ``flask stock-check`` compares
+the projection against the last snapshot plus the movements since.
+"""
+from datetime import datetime
+
+from sqlalchemy import func, insert, literal, select, update
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from facets import invalidate as invalidate_facets
+from models import db
+from models.inventory import StockMovement, StockSnapshot
+from models.product import Product
+
+KINDS = ('order', 'cancel', 'restock', 'adjustment')
+
+products = Product.__table__
+movements = StockMovement.__table__
+snapshots = StockSnapshot.__table__
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product, requested):
+        super().__init__(f"Insufficient stock for '{product.name}'")
+        self.product = product
+        self.requested = requested
+
+
+def move_stock(product, quantity, kind, order_id=None, user_id=None, note=None, allow_negative=False):
+    """Apply a signed stock change and append it to the ledger
+
+    Raises InsufficientStock if taking stock out would leave less than zero
+    (unless ``allow_negative``). Nothing is committed; the caller's
+    transaction covers both the projection and the movement.
+    """
+    if kind not in KINDS:
+        raise ValueError(f'Unknown stock movement kind {kind!r}')
+    if quantity == 0:
+        return None
+
+    statement = (update(products)
+                 .where(products.c.id == product.id)
+                 .values(stock_quantity=products.c.stock_quantity + quantity, updated_at=datetime.utcnow())
+                 .returning(products.c.stock_quantity))
+    if quantity < 0 and not allow_negative:
+        statement = statement.where(products.c.stock_quantity >= -quantity)
+
+    balance = db.session.execute(statement).scalar()
+    if balance is None:
+        raise InsufficientStock(product, -quantity)
+
+    # The row was updated behind the ORM's back; keep the loaded object in step
+    if object_session(product) is not None:
+        set_committed_value(product, 'stock_quantity', balance)
+
+    # In or out of stock changes the storefront's in-stock facet
+    if (balance > 0) != (balance - quantity > 0):
+        invalidate_facets(db.session.connection())
+
+    movement = StockMovement(product_id=product.id, kind=kind, quantity=quantity, balance_after=balance,
+                             order_id=order_id, user_id=user_id, note=note)
+    db.session.add(movement)
+    return movement
+
+
+def take_stock_for_order(order, lines):
+    """Take stock for (product, quantity) lines of a new order
+
+    Products are updated in id order so two orders for the same products
+    can't deadlock on each other's row locks.
+    """
+    for product, quantity in sorted(lines, key=lambda line: line[0].id):
+        move_stock(product, -quantity, 'order', order_id=order.id)
+
+
+def return_stock_for_order(order, note=None, user_id=None):
+    """Put a rejected or cancelled order's items back in stock
+
+    Call it only after Order.change_status() has succeeded, so a
+    double-submitted cancel can't return the stock twice.
+    """
+    for item in sorted(order.items, key=lambda item: item.product_id or 0):
+        if item.product:
+            move_stock(item.product, item.quantity, 'cancel', order_id=order.id, user_id=user_id, note=note)
+
+
+def stock_history(product_id, start=None, end=None, limit=200):
+    """Movements for one product, newest first, optionally within [start, end)"""
+    query = StockMovement.query.filter(StockMovement.product_id == product_id)
+    if start is not None:
+        query = query.filter(StockMovement.created_at >= start)
+    if end is not None:
+        query = query.filter(StockMovement.created_at < end)
+    return query.order_by(StockMovement.created_at.desc(), StockMovement.id.desc()).limit(limit).all()
+
+
+def stock_at(product_id, when):
+    """On-hand quantity at ``when``, or None if the ledger doesn't go back that far"""
+    balance = db.session.execute(
+        select(movements.c.balance_after)
+        .where(movements.c.product_id == product_id, movements.c.created_at <= when)
+        .order_by(movements.c.created_at.desc(), movements.c.id.desc())
+        .limit(1)
+    ).scalar()
+    if balance is not None:
+        return balance
+    # No movement yet at that time: the last snapshot before it, if any
+    return db.session.execute(
+        select(snapshots.c.on_hand)
+        .where(snapshots.c.product_id == product_id, snapshots.c.taken_at <= when)
+        .order_by(snapshots.c.taken_at.desc())
+        .limit(1)
+    ).scalar()
+
+
+def take_snapshot(now=None):
+    """Record every product's on-hand quantity; returns the number of rows
+
+    One INSERT ... SELECT, so the quantities and the last movement ids come
+    from the same consistent read.
+    """
+    now = now or datetime.utcnow()
+    last_movement = (select(func.max(movements.c.id))
+                     .where(movements.c.product_id == products.c.id)
+                     .scalar_subquery())
+    result = db.session.execute(
+        insert(snapshots).from_select(
+            ['product_id', 'taken_at', 'on_hand', 'last_movement_id'],
+            select(products.c.id, literal(now, snapshots.c.taken_at.type), products.c.stock_quantity, last_movement)
+        )
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def check_projection():
+    """Products whose stock_quantity disagrees with their last snapshot plus later movements
+
+    Returns [(product_id, stock_quantity, expected)]. Products without a
+    snapshot are checked against their whole ledger, which only adds up if
+    it starts with the opening stock; take a snapshot once after loading
+    products some other way (init_products.py).
+    """
+    latest = (select(snapshots.c.product_id, func.max(snapshots.c.taken_at).label('taken_at'))
+              .group_by(snapshots.c.product_id)
+              .subquery())
+    base = (select(snapshots.c.product_id, snapshots.c.on_hand, snapshots.c.last_movement_id)
+            .join(latest, (latest.c.product_id == snapshots.c.product_id) & (latest.c.taken_at == snapshots.c.taken_at))
+            .subquery())
+    since = (select(movements.c.product_id, func.sum(movements.c.quantity).label('delta'))
+             .select_from(movements.outerjoin(base, base.c.product_id == movements.c.product_id))
+             .where(movements.c.id > func.coalesce(base.c.last_movement_id, 0))
+             .group_by(movements.c.product_id)
+             .subquery())
+    rows = db.session.execute(
+        select(products.c.id, products.c.stock_quantity, base.c.on_hand, since.c.delta)
+        .select_from(products.outerjoin(base, base.c.product_id == products.c.id)
+                     .outerjoin(since, since.c.product_id == products.c.id))
+    ).all()
+
+    drift = []
+    for product_id, stock_quantity, on_hand, delta in rows:
+        if on_hand is None and delta is None:
+            continue  # no snapshot and no ledger: nothing to compare against
+        expected = (on_hand or 0) + (delta or 0)
+        if expected != stock_quantity:
+            drift.append((product_id, stock_quantity, expected))
+    return drift
@@ -1,22 +1,33 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from sqlalchemy.dialects import postgresql, sqlite
 
-db = SQLAlchemy()
+from replicas import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 migrate = Migrate()
 
 
+def upsert_insert(table, bind=None):
+    """An INSERT on ``table`` that supports ``on_conflict_do_*`` for the dialect of ``bind`` (default: db.engine)"""
+    dialect = (bind if bind is not None else db.engine).dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table)
+    if dialect == 'sqlite':
+        return sqlite.insert(table)
+    raise NotImplementedError(f'Upserts into {table.name} are not implemented for {dialect}')
+
+
 def init_db(app):
-    """Initialize database with Flask app"""
+    """Initialize database with Flask app
+
+    Does not connect to the database; tables are created explicitly by
+    ``flask init-db`` or the init_*.py scripts.
+    """
     db.init_app(app)
     migrate.init_app(app, db)
 
-    with app.app_context():
-        # Import models here to ensure they're registered
-        from models.user import User
-        # from models.product import Product
-        # from models.catalog import Catalog
-        # from models.orders import Order
-        # Create tables if they don't exist
-        db.create_all()
+    # Import models here to ensure they're registered with the metadata
+    from models import user, category, product, order, idempotency, inventory, analytics, recommendation, review, cache, payment
 
     return db
\ No newline at end of file
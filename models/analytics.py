@@ -0,0 +1,38 @@
+from models import db
+
+
+class SalesRollup(db.Model):
+    """Pre-aggregated sales per hour or day, overall and per category and product (see analytics.py)"""
+    __tablename__ = 'sales_rollups'
+    __table_args__ = (
+        # One row per bucket; incremental updates upsert against this key
+        db.UniqueConstraint('grain', 'dimension', 'dimension_id', 'bucket', name='uq_sales_rollups_key'),
+        # Time series for everything at one grain, e.g. the dashboard's last 30 days
+        db.Index('ix_sales_rollups_grain_bucket', 'grain', 'bucket'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    grain = db.Column(db.String(10), nullable=False)  # hour, day
+    bucket = db.Column(db.DateTime, nullable=False)  # start of the hour/day (UTC)
+
+    dimension = db.Column(db.String(20), nullable=False)  # all, category, product
+    dimension_id = db.Column(db.Integer, nullable=False, default=0)  # 0 for 'all' and for missing ids
+
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(14, 2), nullable=False, default=0)  # sum of item subtotals
+
+    def __repr__(self):
+        return f'<SalesRollup {self.grain} {self.bucket} {self.dimension}={self.dimension_id}>'
+
+    def to_dict(self):
+        return {
+            'grain': self.grain,
+            'bucket': self.bucket.isoformat(),
+            'dimension': self.dimension,
+            'dimension_id': self.dimension_id,
+            'orders': self.orders,
+            'units': self.units,
+            'revenue': float(self.revenue)
+        }
@@ -0,0 +1,14 @@
+from models import db
+from datetime import datetime
+
+
+class CacheVersion(db.Model):
+    """A counter bumped whenever the data behind a cache changes; caches compare it to their own"""
+    __tablename__ = 'cache_versions'
+
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<CacheVersion {self.name}={self.version}>'
@@ -1,8 +1,16 @@
 from models import db
 from datetime import datetime
+from sqlalchemy.dialects import postgresql
 
 
 class Category(db.Model):
+    """A node in the category tree
+
+    ``path`` is the materialized path of ids from the root down to and
+    including this category, e.g. ``/3/17/42/``. A subtree is then one
+    range on the path index (see categories.py) and the ancestors are the
+    ids in the path, so neither needs a recursive query.
+    """
     __tablename__ = 'categories'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -10,15 +18,35 @@ class Category(db.Model):
     slug = db.Column(db.String(100), unique=True, nullable=False)
     description = db.Column(db.Text, nullable=True)
     is_active = db.Column(db.Boolean, default=True, nullable=False)
+
+    # Tree: parent_id is the source of truth, path and depth are derived from it
+    # by categories.py. Paths compare bytewise ("C" collation on PostgreSQL) so
+    # subtree ranges work regardless of the database locale.
+    parent_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=True, index=True)
+    path = db.Column(db.String(255).with_variant(postgresql.VARCHAR(255, collation='C'), 'postgresql'),
+                     nullable=False, default='', index=True)
+    depth = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+
+    # Product counts (active and inactive), kept up to date by categories.py as products change
+    product_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    subtree_product_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+
     created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Relationship to products
     products = db.relationship('Product', backref='category', lazy='dynamic', cascade='all, delete-orphan')
+    children = db.relationship('Category', backref=db.backref('parent', remote_side=[id]), lazy='dynamic',
+                               order_by='Category.name')
 
     def __repr__(self):
         return f'<Category {self.name}>'
 
+    @property
+    def ancestor_ids(self):
+        """Ids from the root down to the parent"""
+        return [int(part) for part in self.path.strip('/').split('/')[:-1]] if self.path else []
+
     def to_dict(self):
         """Convert category to dictionary"""
         return {
@@ -27,7 +55,11 @@ class Category(db.Model):
             'slug': self.slug,
             'description': self.description,
             'is_active': self.is_active,
-            'product_count': self.products.count(),
+            'parent_id': self.parent_id,
+            'path': self.path,
+            'depth': self.depth,
+            'product_count': self.product_count,
+            'subtree_product_count': self.subtree_product_count,
             'created_at': self.created_at.isoformat(),
             'updated_at': self.updated_at.isoformat()
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,30 @@
+from models import db
+from datetime import datetime
+
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+    __table_args__ = (
+        db.UniqueConstraint('endpoint', 'key', name='uq_idempotency_keys_endpoint_key'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    endpoint = db.Column(db.String(100), nullable=False)
+    key = db.Column(db.String(255), nullable=False)
+    fingerprint = db.Column(db.String(64), nullable=False)  # sha256 of the request payload
+
+    status = db.Column(db.String(20), default='in_progress', nullable=False)
+    # Statuses: in_progress, completed
+
+    # Stored response, replayed for duplicates
+    response_status = db.Column(db.Integer, nullable=True)
+    response_mimetype = db.Column(db.String(100), nullable=True)
+    response_body = db.Column(db.LargeBinary, nullable=True)
+
+    # Timestamps
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # The claim's lease while in_progress, then when the stored response expires
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.endpoint}:{self.key}>'
@@ -0,0 +1,61 @@
+from models import db
+from datetime import datetime
+
+
+class StockMovement(db.Model):
+    """Append-only stock ledger; Product.stock_quantity is the running total"""
+    __tablename__ = 'stock_movements'
+    __table_args__ = (
+        # History for one product over a date range is an index range scan
+        db.Index('ix_stock_movements_product_created', 'product_id', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+
+    kind = db.Column(db.String(20), nullable=False)
+    # Kinds: order, cancel, restock, adjustment
+
+    quantity = db.Column(db.Integer, nullable=False)  # signed: negative takes stock out
+    balance_after = db.Column(db.Integer, nullable=False)  # on hand right after this movement
+
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id', ondelete='SET NULL'), nullable=True, index=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
+    note = db.Column(db.String(255), nullable=True)
+
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    product = db.relationship('Product', lazy=True)
+
+    def __repr__(self):
+        return f'<StockMovement {self.kind} {self.quantity:+d} product={self.product_id}>'
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'product_id': self.product_id,
+            'kind': self.kind,
+            'quantity': self.quantity,
+            'balance_after': self.balance_after,
+            'order_id': self.order_id,
+            'user_id': self.user_id,
+            'note': self.note,
+            'created_at': self.created_at.isoformat()
+        }
+
+
+class StockSnapshot(db.Model):
+    """On-hand quantity per product at a point in time (see inventory.take_snapshot)"""
+    __tablename__ = 'stock_snapshots'
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'taken_at', name='uq_stock_snapshots_product_taken'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    taken_at = db.Column(db.DateTime, nullable=False, index=True)
+    on_hand = db.Column(db.Integer, nullable=False)
+    last_movement_id = db.Column(db.Integer, nullable=True)  # movements after this one are not included
+
+    def __repr__(self):
+        return f'<StockSnapshot product={self.product_id} {self.taken_at} {self.on_hand}>'
@@ -4,6 +4,16 @@ from datetime import datetime
 
 class Order(db.Model):
     __tablename__ = 'orders'
+    __table_args__ = (
+        # Admin lists are newest first, optionally per status; archive.py scans by status and age
+        db.Index('ix_orders_created', 'created_at'),
+        db.Index('ix_orders_status_created', 'status', 'created_at'),
+        # A customer's history page by page (keyset on created_at, id); updated_at
+        # makes the conditional-GET check an index-only scan
+        db.Index('ix_orders_user_created', 'user_id', 'created_at', 'id', 'updated_at'),
+        # Guest tracking by order number + email, covering the same check
+        db.Index('ix_orders_tracking', 'order_number', 'customer_email', 'updated_at', postgresql_include=['id']),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     order_number = db.Column(db.String(50), unique=True, nullable=False)
@@ -48,7 +58,8 @@ class Order(db.Model):
     delivered_at = db.Column(db.DateTime, nullable=True)
 
     # Relationships
-    user = db.relationship('User', backref='orders', lazy=True)
+    # Dynamic so nothing loads a customer's whole history at once; see order_history.py
+    user = db.relationship('User', backref=db.backref('orders', lazy='dynamic'), lazy=True)
     items = db.relationship('OrderItem', backref='order', lazy='dynamic', cascade='all, delete-orphan')
 
     def __repr__(self):
@@ -88,6 +99,29 @@ class Order(db.Model):
         """Check if order can be shipped"""
         return self.status in ['approved', 'processing']
 
+    def change_status(self, status, **values):
+        """Move the order from the status it was read with to ``status``, atomically
+
+        One conditional UPDATE (... WHERE id = :id AND status = :previous), so
+        of two concurrent changes (a double-submit, two admins) exactly one
+        wins. Returns False, changing nothing, if the order was no longer in
+        the status it was read with. ``values`` are other columns to set,
+        e.g. approved_at. Nothing is committed.
+        """
+        from sqlalchemy import update
+        from sqlalchemy.orm.attributes import set_committed_value
+
+        orders = Order.__table__
+        values = dict(values, status=status, updated_at=datetime.utcnow())
+        result = db.session.execute(
+            update(orders).where(orders.c.id == self.id, orders.c.status == self.status).values(**values))
+        if result.rowcount != 1:
+            return False
+        # Updated behind the ORM's back; keep this object in step
+        for name, value in values.items():
+            set_committed_value(self, name, value)
+        return True
+
     def to_dict(self):
         """Convert order to dictionary"""
         return {
@@ -150,4 +184,38 @@ class OrderItem(db.Model):
             'price': float(self.price),
             'quantity': self.quantity,
             'subtotal': float(self.subtotal)
-        }
\ No newline at end of file
+        }
+
+
+class ArchivedOrder(db.Model):
+    """A closed order moved out of orders/order_items by archive.py
+
+    The order and its items are kept as zlib-compressed JSON in ``payload``;
+    the columns beside it are what lists and lookups filter on. On
+    PostgreSQL the table is range-partitioned by month of ``created_at``,
+    so a month's archive is one partition and date-bounded queries skip
+    the others; elsewhere it is one table with the same indexes.
+    """
+    __tablename__ = 'archived_orders'
+    __table_args__ = (
+        db.Index('ix_archived_orders_number', 'order_number'),
+        db.Index('ix_archived_orders_user_created', 'user_id', 'created_at', 'id'),
+        db.Index('ix_archived_orders_created', 'created_at'),
+        {'postgresql_partition_by': 'RANGE (created_at)'},
+    )
+
+    # The partition key has to be part of the primary key
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)  # the original orders.id
+    created_at = db.Column(db.DateTime, primary_key=True)
+    order_number = db.Column(db.String(50), nullable=False)
+    user_id = db.Column(db.Integer, nullable=True)
+    customer_name = db.Column(db.String(200), nullable=False)
+    customer_email = db.Column(db.String(200), nullable=False)
+    status = db.Column(db.String(50), nullable=False)
+    total = db.Column(db.Numeric(10, 2), nullable=False)
+    item_count = db.Column(db.Integer, nullable=False, default=0)
+    payload = db.Column(db.LargeBinary, nullable=False)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ArchivedOrder {self.order_number}>'
@@ -0,0 +1,65 @@
+from models import db
+from datetime import datetime
+
+
+class Payment(db.Model):
+    """A payment started with a gateway; its status follows the gateway's callbacks"""
+    __tablename__ = 'payments'
+
+    id = db.Column(db.Integer, primary_key=True)
+    gateway = db.Column(db.String(20), nullable=False)
+    payment_id = db.Column(db.String(100), unique=True, nullable=False)  # the gateway's id
+
+    # The order being paid for, if the payment was started for one
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id', ondelete='SET NULL'), nullable=True, index=True)
+
+    amount = db.Column(db.Numeric(10, 2), nullable=False)
+    currency = db.Column(db.String(3), default='USD', nullable=False)
+    description = db.Column(db.String(255), nullable=True)
+    customer_name = db.Column(db.String(200), nullable=True)
+    customer_email = db.Column(db.String(200), nullable=True)
+
+    status = db.Column(db.String(20), default='pending', nullable=False)
+    # Statuses: pending, paid, failed, refunded (see payment_events.py)
+
+    # Lets the gateway's callbacks link back to the trace that started the payment
+    traceparent = db.Column(db.String(55), nullable=True)
+
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    order = db.relationship('Order', lazy=True)
+
+    def __repr__(self):
+        return f'<Payment {self.gateway}:{self.payment_id}>'
+
+
+class PaymentEvent(db.Model):
+    """A gateway webhook delivery, stored as received and processed later"""
+    __tablename__ = 'payment_events'
+    __table_args__ = (
+        # A redelivered event is a conflict here, not a second row
+        db.UniqueConstraint('gateway', 'event_key', name='uq_payment_events_gateway_key'),
+        # The worker's queue: only unprocessed events are in this index
+        db.Index('ix_payment_events_pending', 'id',
+                 postgresql_where=db.text('processed_at IS NULL'),
+                 sqlite_where=db.text('processed_at IS NULL')),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    gateway = db.Column(db.String(20), nullable=False)
+    event_key = db.Column(db.String(150), nullable=False)  # the event id, else payment id + status
+    payment_id = db.Column(db.String(100), nullable=False, index=True)
+    status = db.Column(db.String(50), nullable=True)  # as the gateway sent it
+
+    payload = db.Column(db.Text, nullable=False)  # the raw request body
+    traceparent = db.Column(db.String(55), nullable=True)  # the delivery's trace
+
+    received_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime, nullable=True)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    retry_at = db.Column(db.DateTime, nullable=True)  # after a failure, not before this
+    error = db.Column(db.Text, nullable=True)  # last failure, kept once processed
+
+    def __repr__(self):
+        return f'<PaymentEvent {self.gateway}:{self.event_key}>'
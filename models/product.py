@@ -23,9 +23,16 @@ class Product(db.Model):
     weight = db.Column(db.Numeric(10, 2), nullable=True)  # in kg
     dimensions = db.Column(db.String(100), nullable=True)  # e.g., "10x20x30 cm"
 
+    brand = db.Column(db.String(100), nullable=True, index=True)
+
     # Category relationship
     category_id = db.Column(db.Integer, db.ForeignKey('categories.id'), nullable=True)
 
+    # Review aggregates, kept up to date by reviews.py as reviews change
+    rating_count = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    rating_sum = db.Column(db.Integer, default=0, server_default='0', nullable=False)
+    rating_avg = db.Column(db.Numeric(3, 2), nullable=True, index=True)  # NULL until reviewed
+
     # Status
     is_active = db.Column(db.Boolean, default=True, nullable=False)
     is_featured = db.Column(db.Boolean, default=False, nullable=False)
@@ -77,6 +84,9 @@ class Product(db.Model):
             'image_url': self.image_url,
             'weight': float(self.weight) if self.weight else None,
             'dimensions': self.dimensions,
+            'brand': self.brand,
+            'rating_avg': float(self.rating_avg) if self.rating_avg is not None else None,
+            'rating_count': self.rating_count,
             'category_id': self.category_id,
             'category_name': self.category.name if self.category else None,
             'is_active': self.is_active,
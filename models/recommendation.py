@@ -0,0 +1,57 @@
+from models import db
+from datetime import datetime
+
+
+class ProductPair(db.Model):
+    """Sparse co-occurrence counts: orders containing both products
+
+    Stored once per pair with product_id <= related_id; the diagonal
+    (product_id == related_id) is the number of orders containing the product.
+    """
+    __tablename__ = 'product_pairs'
+    __table_args__ = (
+        db.Index('ix_product_pairs_related', 'related_id'),
+    )
+
+    product_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    related_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ProductPair {self.product_id}-{self.related_id} x{self.orders}>'
+
+
+class ProductRecommendation(db.Model):
+    """Top-K "frequently bought together" neighbours per product, best first"""
+    __tablename__ = 'product_recommendations'
+
+    # (product_id, rank) is the primary key, so a product's list is one index range scan
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), primary_key=True,
+                           autoincrement=False)
+    rank = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    related_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    orders = db.Column(db.Integer, nullable=False)  # orders containing both
+
+    related = db.relationship('Product', foreign_keys=[related_id], lazy='joined')
+
+    def __repr__(self):
+        return f'<ProductRecommendation {self.product_id} #{self.rank} -> {self.related_id}>'
+
+
+class RecommendationRun(db.Model):
+    """One build of the recommendations; the latest run's last_order_id is the incremental watermark"""
+    __tablename__ = 'recommendation_runs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # full, incremental
+    metric = db.Column(db.String(20), nullable=False)  # cosine, lift
+    last_order_id = db.Column(db.Integer, nullable=False, default=0)
+    total_orders = db.Column(db.Integer, nullable=False, default=0)  # orders counted so far
+    new_orders = db.Column(db.Integer, nullable=False, default=0)
+    products_scored = db.Column(db.Integer, nullable=False, default=0)
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<RecommendationRun {self.kind} up to order {self.last_order_id}>'
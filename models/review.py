@@ -0,0 +1,45 @@
+from models import db
+from datetime import datetime
+
+
+class Review(db.Model):
+    """A customer's rating of a product; one per user and product"""
+    __tablename__ = 'reviews'
+    __table_args__ = (
+        db.UniqueConstraint('product_id', 'user_id', name='uq_reviews_product_user'),
+        db.CheckConstraint('rating BETWEEN 1 AND 5', name='ck_reviews_rating'),
+        # Newest reviews of a product for its detail page
+        db.Index('ix_reviews_product_created', 'product_id', 'created_at'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.id', ondelete='CASCADE'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, index=True)
+
+    rating = db.Column(db.SmallInteger, nullable=False)  # 1-5
+    title = db.Column(db.String(200), nullable=True)
+    body = db.Column(db.Text, nullable=True)
+
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # Relationships
+    user = db.relationship('User', lazy='joined')
+    product = db.relationship('Product', lazy=True)
+
+    def __repr__(self):
+        return f'<Review {self.rating}/5 product={self.product_id} user={self.user_id}>'
+
+    def to_dict(self):
+        """Convert review to dictionary"""
+        return {
+            'id': self.id,
+            'product_id': self.product_id,
+            'user_id': self.user_id,
+            'username': self.user.username if self.user else None,
+            'rating': self.rating,
+            'title': self.title,
+            'body': self.body,
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat()
+        }
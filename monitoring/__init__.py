@@ -0,0 +1,7 @@
+from monitoring.sql import init_sql_instrumentation, slow_queries, current_stats
+from monitoring.metrics import init_metrics, track_outbound
+from monitoring.profiling import init_profiling
+from monitoring.memory import init_memory_diagnostics
+from monitoring.capture import init_traffic_capture
+from monitoring.tracing import init_tracing
+from monitoring.logs import init_logging
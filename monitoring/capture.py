@@ -0,0 +1,289 @@
+"""
+Traffic capture for replay load tests.
+
+With TRAFFIC_CAPTURE on, a WSGI middleware records every request (or a
+TRAFFIC_CAPTURE_SAMPLE_RATE fraction) as one JSON line:
+
+    ts, method, path, query, content type, body, status, duration, client
+
+Before anything is written, bodies are scrubbed, in JSON bodies (at any
+depth), form bodies and query strings alike. Passwords and tokens are
+dropped. Every other value (text, numbers, booleans) is replaced with a
+placeholder unless its field is in KEEP_FIELDS or is an id, so free text
+(reviews, notes, search terms, fields added later) never reaches the files.
+The ``client`` field is an HMAC of the logged-in user id (or of address and
+user agent for anonymous traffic), so requests can be grouped into sessions
+without identifying anyone.
+
+Records go through a queue to a writer thread that appends to gzip files in
+TRAFFIC_CAPTURE_DIR, rotated every TRAFFIC_CAPTURE_ROTATE_MB of input and
+pruned to the newest TRAFFIC_CAPTURE_KEEP files. A file a live worker is
+still writing is never pruned. benchmarks/replay.py replays them.
+"""
+import glob
+import gzip
+import hashlib
+import hmac
+import io
+import json
+import logging
+import os
+import queue
+import random
+import re
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode
+
+from werkzeug.wsgi import ClosingIterator
+
+from monitoring.metrics import _pid_alive, telemetry_dropped
+
+logger = logging.getLogger(__name__)
+
+USER_KEY = 'flaskmart.capture_user'
+
+DROP_FIELDS = {'password', 'password_confirm', 'new_password', 'current_password', 'card_number', 'cvv',
+               'token', 'access_token', 'secret'}
+# Values kept as sent: what replay needs and never personal
+KEEP_FIELDS = {'id', 'ids', 'sku', 'quantity', 'restock_quantity', 'stock_quantity', 'stock_quantity_original',
+               'low_stock_threshold', 'price', 'cost_price', 'compare_price', 'min_price', 'max_price', 'amount',
+               'currency', 'weight', 'rating', 'status', 'payment_status', 'payment_method', 'shipping_method',
+               'action', 'is_active', 'is_featured', 'remove_image', 'remember', 'idempotency_key',
+               'category', 'sort', 'page', 'per_page', 'limit', 'days', 'start', 'end', 'grain', 'group',
+               'dimension', 'month', 'before', 'at', 'archived', 'new', 'old', 'next'}
+_CAMEL = re.compile(r'(?<!^)(?=[A-Z])')
+_CAPTURE_FILE = re.compile(r'capture-\d{8}-\d{6}-(\d+)\.jsonl\.gz$')
+
+
+def _normalize_key(key):
+    return _CAMEL.sub('_', str(key)).lower() if isinstance(key, str) else key
+
+
+def _keep(key):
+    key = _normalize_key(key)
+    return isinstance(key, str) and (key in KEEP_FIELDS or key.endswith(('_id', '_ids')))
+
+
+def _placeholder(key, value):
+    if value is None or _keep(key):
+        return value
+    key = _normalize_key(key) if isinstance(key, str) else ''
+    if 'email' in key:
+        return 'user@example.com'
+    if 'phone' in key:
+        return '000000000'
+    # Numbers and booleans can be personal too (a phone number sent as an int)
+    return 'redacted' if isinstance(value, str) else type(value)()
+
+
+def scrub(value, key=None):
+    """Drop secrets and replace values not in KEEP_FIELDS, recursively"""
+    if isinstance(value, dict):
+        return {item_key: scrub(item, item_key) for item_key, item in value.items()
+                if _normalize_key(item_key) not in DROP_FIELDS}
+    if isinstance(value, list):
+        return [scrub(item, key) for item in value]
+    return _placeholder(key, value)
+
+
+def scrub_pairs(pairs):
+    return [(key, _placeholder(key, value)) for key, value in pairs if _normalize_key(key) not in DROP_FIELDS]
+
+
+def scrub_body(content_type, body):
+    """(kind, scrubbed body) for a raw request body"""
+    if not body:
+        return None, None
+    if content_type.startswith('application/json'):
+        try:
+            return 'json', scrub(json.loads(body))
+        except ValueError:
+            return 'omitted', None
+    if content_type.startswith('application/x-www-form-urlencoded'):
+        pairs = parse_qsl(body.decode('utf-8', 'replace'), keep_blank_values=True)
+        return 'form', urlencode(scrub_pairs(pairs))
+    # Uploads and anything else we can't scrub reliably
+    return 'omitted', None
+
+
+class CaptureWriter:
+    """Background thread appending records to rotating gzip files"""
+
+    def __init__(self, directory, rotate_bytes, keep):
+        self.directory = directory
+        self.rotate_bytes = rotate_bytes
+        self.keep = keep
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=10000)
+        self._pid = None
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def submit(self, record):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            # Never slow requests down for the sake of the capture
+            self.dropped += 1
+            telemetry_dropped.inc('captures')
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='traffic-capture', daemon=True).start()
+
+    def _open(self):
+        path = os.path.join(self.directory, f'capture-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}.jsonl.gz')
+        return path, gzip.open(path, 'at', encoding='utf-8')
+
+    def _prune(self):
+        paths = sorted(glob.glob(os.path.join(self.directory, 'capture-*.jsonl.gz')), key=os.path.getmtime)
+        # Each process's newest file is the one it is writing
+        newest = {}
+        for path in paths:
+            match = _CAPTURE_FILE.search(path)
+            if match:
+                newest[int(match.group(1))] = path
+        open_paths = {path for pid, path in newest.items() if _pid_alive(pid)}
+        for path in [path for path in paths[:-self.keep] if path not in open_paths]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _run(self):
+        path, handle, written = None, None, 0
+        while True:
+            try:
+                record = self._queue.get(timeout=1)
+            except queue.Empty:
+                if handle is not None:
+                    handle.flush()
+                continue
+            if handle is None or written >= self.rotate_bytes:
+                if handle is not None:
+                    handle.close()
+                path, handle = self._open()
+                written = 0
+                self._prune()
+            line = json.dumps(record, separators=(',', ':')) + '\n'
+            handle.write(line)
+            written += len(line)
+
+
+class TrafficCapture:
+    """WSGI middleware recording scrubbed requests for replay"""
+
+    def __init__(self, wsgi_app, writer, secret, sample_rate=1.0, max_body=65536,
+                 exclude=('/static/', '/metrics')):
+        self.wsgi_app = wsgi_app
+        self.writer = writer
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+        self.sample_rate = sample_rate
+        self.max_body = max_body
+        self.exclude = exclude
+
+    def _client(self, environ):
+        user_id = environ.get(USER_KEY)
+        if user_id is not None:
+            identity = f'user:{user_id}'
+        else:
+            identity = f"anon:{environ.get('REMOTE_ADDR')}:{environ.get('HTTP_USER_AGENT', '')}"
+        return hmac.new(self.secret, identity.encode(), hashlib.sha256).hexdigest()[:16]
+
+    def _read_body(self, environ):
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if not length or length > self.max_body:
+            return None
+        body = environ['wsgi.input'].read(length)
+        # Let the app read the body again
+        environ['wsgi.input'] = io.BytesIO(body)
+        return body
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path.startswith(self.exclude) or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+            return self.wsgi_app(environ, start_response)
+
+        started = time.time()
+        start = time.perf_counter()
+        content_type = environ.get('CONTENT_TYPE', '')
+        body = self._read_body(environ)
+        status = {}
+
+        def capture_start_response(status_line, headers, exc_info=None):
+            status['code'] = int(status_line.split(' ', 1)[0])
+            return start_response(status_line, headers, exc_info)
+
+        def record():
+            try:
+                if body is None and environ.get('CONTENT_LENGTH', '0') not in ('', '0'):
+                    kind, data = 'omitted', None  # larger than TRAFFIC_CAPTURE_MAX_BODY
+                else:
+                    kind, data = scrub_body(content_type, body)
+                query = environ.get('QUERY_STRING', '')
+                self.writer.submit({
+                    'ts': round(started, 6),
+                    'method': environ.get('REQUEST_METHOD'),
+                    'path': path,
+                    'query': urlencode(scrub_pairs(parse_qsl(query, keep_blank_values=True))) if query else '',
+                    'content_type': content_type.split(';')[0] or None,
+                    'body_kind': kind,
+                    'body': data,
+                    'headers': {'X-Requested-With': environ.get('HTTP_X_REQUESTED_WITH'),
+                                'Idempotency-Key': environ.get('HTTP_IDEMPOTENCY_KEY')},
+                    'status': status.get('code'),
+                    'duration_ms': round((time.perf_counter() - start) * 1000, 3),
+                    'client': self._client(environ),
+                })
+            except Exception:
+                logger.exception('Failed to capture %s', path)
+
+        return ClosingIterator(self.wsgi_app(environ, capture_start_response), [record])
+
+
+def read_captures(paths):
+    """Yield records from capture files, tolerating a truncated last block"""
+    for path in paths:
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as handle:
+                for line in handle:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except (EOFError, OSError):
+            # File still being written or cut short by a crash
+            continue
+
+
+def init_traffic_capture(app):
+    """Wrap the app in TrafficCapture when TRAFFIC_CAPTURE is on"""
+    if not app.config.get('TRAFFIC_CAPTURE'):
+        return None
+
+    from flask import request, session
+
+    writer = CaptureWriter(
+        app.config.get('TRAFFIC_CAPTURE_DIR') or os.path.join(tempfile.gettempdir(), 'flaskmart-capture'),
+        rotate_bytes=int(app.config.get('TRAFFIC_CAPTURE_ROTATE_MB', 64) * 2 ** 20),
+        keep=app.config.get('TRAFFIC_CAPTURE_KEEP', 50),
+    )
+    app.wsgi_app = TrafficCapture(app.wsgi_app, writer, app.secret_key,
+                                  sample_rate=app.config.get('TRAFFIC_CAPTURE_SAMPLE_RATE', 1.0),
+                                  max_body=app.config.get('TRAFFIC_CAPTURE_MAX_BODY', 65536))
+
+    @app.before_request
+    def note_capture_user():
+        request.environ[USER_KEY] = session.get('user_id')
+
+    return writer
@@ -0,0 +1,234 @@
+"""
+Structured, non-blocking logging.
+
+init_logging() routes every logger through one QueueHandler: the calling
+thread only stamps the record with its context and puts it on a bounded
+queue; a listener thread per process formats it as one JSON object per line
+and writes it to stdout or LOG_FILE. A slow sink therefore never holds a
+request worker, and when the queue is full records are dropped rather than
+blocking, and counted in telemetry_dropped_total on /metrics.
+
+Every record carries, when available:
+
+    request_id  X-Request-ID from the client or generated, echoed back
+    trace_id    the current trace (monitoring/tracing.py)
+    elapsed_ms  time since the request started
+    endpoint
+
+plus anything passed as ``extra``, e.g.::
+
+    current_app.logger.info('Order created', extra={'order_number': number, 'total': total})
+
+LOG_SAMPLING keeps only a fraction of a noisy logger's records below
+WARNING, e.g. ``http.access=0.1,sql.slow=0.5``; sampled records include
+``sample_rate`` so counts can be scaled back up. Each request is logged on
+``http.access`` with its status and duration.
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+from monitoring.metrics import telemetry_dropped
+from monitoring.tracing import current_context
+
+ACCESS_LOGGER = 'http.access'
+
+# Attributes every LogRecord has; anything else came in through ``extra``
+_RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+_CONTEXT = ('request_id', 'trace_id', 'elapsed_ms', 'endpoint', 'sample_rate')
+
+
+def parse_sampling(value):
+    """'http.access=0.1,sql.slow=0.5' -> {'http.access': 0.1, 'sql.slow': 0.5}"""
+    rates = {}
+    for part in (value or '').split(','):
+        name, _, rate = part.partition('=')
+        if name.strip() and rate.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of records below WARNING per logger (and its children)"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def rate_for(self, name):
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition('.')[0]
+        return 1.0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rate_for(record.name)
+        if rate >= 1.0:
+            return True
+        if random.random() >= rate:
+            return False
+        record.sample_rate = rate
+        return True
+
+
+class ContextFilter(logging.Filter):
+    """Stamp records with request and trace context on the calling thread"""
+
+    def filter(self, record):
+        from flask import g, has_request_context, request
+
+        context = current_context()
+        if context is not None and not hasattr(record, 'trace_id'):
+            record.trace_id = context.trace_id
+        if has_request_context():
+            record.request_id = getattr(record, 'request_id', None) or g.get('request_id')
+            record.endpoint = getattr(record, 'endpoint', None) or request.endpoint
+            started = g.get('log_request_started')
+            if started is not None and not hasattr(record, 'elapsed_ms'):
+                record.elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 6),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key in _CONTEXT:
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        for key, value in vars(record).items():
+            if key not in _RESERVED and key not in entry and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = record.stack_info
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that never blocks and starts its listener lazily per process"""
+
+    def __init__(self, sink, maxsize=10000):
+        super().__init__(queue.Queue(maxsize=maxsize))
+        self.sink = sink
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def prepare(self, record):
+        # Resolve the message and traceback now, while args and the exception
+        # are still valid; keep the rest of the record for the JSON formatter
+        record = logging.makeLogRecord(vars(record))
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            record.exc_text = ''.join(traceback.format_exception(*record.exc_info)).rstrip()
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            telemetry_dropped.inc('logs')
+
+    def emit(self, record):
+        self._ensure_listener()
+        super().emit(record)
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked: the parent's listener thread did not come with us
+                self._pid = os.getpid()
+                self._listener = logging.handlers.QueueListener(self.queue, self.sink, respect_handler_level=True)
+                self._listener.start()
+
+    def stop(self):
+        """Drain the queue (at exit); later records still go through a new listener"""
+        with self._lock:
+            if self._listener is not None and self._pid == os.getpid():
+                self._listener.stop()
+            self._listener, self._pid = None, None
+
+
+def configure_logging(level='INFO', fmt='json', log_file=None, sampling=None, queue_size=10000):
+    """Install the async handler on the root logger; returns it"""
+    sink = logging.FileHandler(log_file, encoding='utf-8') if log_file else logging.StreamHandler(sys.stdout)
+    if fmt == 'json':
+        sink.setFormatter(JSONFormatter())
+    else:
+        sink.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s',
+                                            defaults={'request_id': '-'}))
+
+    handler = AsyncQueueHandler(sink, maxsize=queue_size)
+    handler.addFilter(SamplingFilter(sampling or {}))
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for existing in [h for h in root.handlers if isinstance(h, AsyncQueueHandler)]:
+        existing.stop()
+        root.removeHandler(existing)
+        atexit.unregister(existing.stop)
+    root.addHandler(handler)
+    root.setLevel(level)
+    atexit.register(handler.stop)
+    return handler
+
+
+def init_logging(app):
+    """Structured async logging plus a request id and access log per request"""
+    from flask import g, request
+    from flask.logging import default_handler
+
+    handler = configure_logging(
+        level=app.config.get('LOG_LEVEL', 'INFO'),
+        fmt=app.config.get('LOG_FORMAT', 'json'),
+        log_file=app.config.get('LOG_FILE'),
+        sampling=parse_sampling(app.config.get('LOG_SAMPLING')),
+        queue_size=app.config.get('LOG_QUEUE_SIZE', 10000),
+    )
+    # Flask's own handler writes synchronously to stderr; let records reach root instead
+    app.logger.removeHandler(default_handler)
+    app.extensions['log_handler'] = handler
+    access = logging.getLogger(ACCESS_LOGGER)
+
+    @app.before_request
+    def assign_request_id():
+        g.log_request_started = time.perf_counter()
+        incoming = request.headers.get('X-Request-ID', '')
+        g.request_id = incoming[:64] if incoming.isprintable() and incoming else uuid.uuid4().hex
+
+    @app.after_request
+    def log_request(response):
+        request_id = g.get('request_id')
+        if request_id:
+            response.headers['X-Request-ID'] = request_id
+        if access.isEnabledFor(logging.INFO):
+            access.info('%s %s %s', request.method, request.path, response.status_code,
+                        extra={'method': request.method, 'path': request.path, 'status': response.status_code})
+        return response
+
+    return handler
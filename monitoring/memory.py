@@ -0,0 +1,245 @@
+"""
+Per-worker memory diagnostics.
+
+Every request records the worker's RSS before and after and how many ORM
+objects entered the SQLAlchemy identity map, aggregated per endpoint. A request that
+grows RSS by more than MEMORY_RSS_GROWTH_ALARM_MB logs a warning on the
+``memory`` logger, so endpoints that leak (or materialize far too much) show
+up before the worker is OOM-killed.
+
+tracemalloc is off by default because it slows allocation down. Turn it on
+at startup with MEMORY_TRACEMALLOC, or per worker from the admin API. While
+it runs, snapshots are taken on demand and every MEMORY_SNAPSHOT_INTERVAL
+seconds (0 disables), the newest MEMORY_SNAPSHOTS_KEEP are kept, and any two
+can be diffed to list the allocation sites that grew.
+
+All of this is per process: each gunicorn worker answers for itself.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+from monitoring.metrics import REGISTRY
+
+logger = logging.getLogger('memory')
+
+try:
+    PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    PAGE_SIZE = 4096
+
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+
+def rss_bytes():
+    """Current resident set size of this process"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    # Peak rather than current RSS, but the best we have off Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class EndpointMemory:
+    def __init__(self):
+        self.requests = 0
+        self.rss_growth = 0
+        self.max_rss_growth = 0
+        self.alarms = 0
+        self.max_identity_map = 0
+        self.total_identity_map = 0
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'rss_growth_mb': round(self.rss_growth / 2 ** 20, 2),
+            'max_rss_growth_mb': round(self.max_rss_growth / 2 ** 20, 2),
+            'alarms': self.alarms,
+            'max_identity_map': self.max_identity_map,
+            'avg_identity_map': round(self.total_identity_map / self.requests, 1) if self.requests else 0,
+        }
+
+
+class MemoryTracker:
+    """Per-endpoint RSS growth and tracemalloc snapshots for this worker"""
+
+    def __init__(self, alarm_bytes, keep=5, frames=10):
+        self.alarm_bytes = alarm_bytes
+        self.keep = keep
+        self.frames = frames
+        self.endpoints = {}
+        self.snapshots = []  # (taken_at, rss, snapshot), oldest first
+        self.started_rss = rss_bytes()
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, rss_before, rss_after, identity_map):
+        growth = rss_after - rss_before
+        with self._lock:
+            stats = self.endpoints.get(endpoint)
+            if stats is None:
+                stats = self.endpoints[endpoint] = EndpointMemory()
+            stats.requests += 1
+            stats.rss_growth += max(growth, 0)
+            stats.max_rss_growth = max(stats.max_rss_growth, growth)
+            stats.max_identity_map = max(stats.max_identity_map, identity_map)
+            stats.total_identity_map += identity_map
+            if growth > self.alarm_bytes:
+                stats.alarms += 1
+        if growth > self.alarm_bytes:
+            logger.warning('RSS grew %.1f MB during %s (identity map %d objects, RSS now %.1f MB)',
+                           growth / 2 ** 20, endpoint, identity_map, rss_after / 2 ** 20)
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start_tracing(self, frames=None):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames or self.frames)
+
+    def stop_tracing(self):
+        tracemalloc.stop()
+        with self._lock:
+            self.snapshots = []
+
+    def take_snapshot(self):
+        """Snapshot current allocations; returns its index"""
+        if not tracemalloc.is_tracing():
+            raise RuntimeError('tracemalloc is not running')
+        snapshot = tracemalloc.take_snapshot().filter_traces(_IGNORED)
+        with self._lock:
+            self.snapshots.append((time.time(), rss_bytes(), snapshot))
+            del self.snapshots[:-self.keep]
+            return len(self.snapshots) - 1
+
+    def diff(self, old=0, new=-1, limit=20, key_type='lineno'):
+        """Allocation sites that changed most between two kept snapshots"""
+        with self._lock:
+            old_taken, old_rss, old_snapshot = self.snapshots[old]
+            new_taken, new_rss, new_snapshot = self.snapshots[new]
+        stats = new_snapshot.compare_to(old_snapshot, key_type)
+        return {
+            'seconds': round(new_taken - old_taken, 1),
+            'rss_growth_mb': round((new_rss - old_rss) / 2 ** 20, 2),
+            'traced_growth_mb': round(sum(stat.size_diff for stat in stats) / 2 ** 20, 2),
+            'top': [{
+                'site': str(stat.traceback[0]) if stat.traceback else '?',
+                'traceback': stat.traceback.format()[-6:] if key_type == 'traceback' else None,
+                'size_kb': round(stat.size / 1024, 1),
+                'size_diff_kb': round(stat.size_diff / 1024, 1),
+                'count': stat.count,
+                'count_diff': stat.count_diff,
+            } for stat in stats[:limit]],
+        }
+
+    def top_allocations(self, limit=20):
+        """Largest allocation sites in the newest snapshot"""
+        with self._lock:
+            _, _, snapshot = self.snapshots[-1]
+        return [{'site': str(stat.traceback[0]), 'size_kb': round(stat.size / 1024, 1), 'count': stat.count}
+                for stat in snapshot.statistics('lineno')[:limit]]
+
+    def status(self):
+        rss = rss_bytes()
+        with self._lock:
+            endpoints = {name: stats.as_dict() for name, stats in self.endpoints.items()}
+            snapshots = [{'index': i, 'taken_at': taken, 'rss_mb': round(snap_rss / 2 ** 20, 2)}
+                         for i, (taken, snap_rss, _) in enumerate(self.snapshots)]
+        status = {
+            'pid': os.getpid(),
+            'rss_mb': round(rss / 2 ** 20, 2),
+            'rss_growth_since_start_mb': round((rss - self.started_rss) / 2 ** 20, 2),
+            'alarm_threshold_mb': round(self.alarm_bytes / 2 ** 20, 2),
+            'tracemalloc': self.tracing,
+            'snapshots': snapshots,
+            'endpoints': dict(sorted(endpoints.items(), key=lambda item: item[1]['rss_growth_mb'], reverse=True)),
+        }
+        if self.tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            status['traced_mb'] = round(current / 2 ** 20, 2)
+            status['traced_peak_mb'] = round(peak / 2 ** 20, 2)
+        return status
+
+
+class SnapshotScheduler:
+    """Takes a snapshot every ``interval`` seconds while tracemalloc runs"""
+
+    def __init__(self, tracker, interval):
+        self.tracker = tracker
+        self.interval = interval
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if not self.interval or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='memory-snapshots', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.tracker.take_snapshot()
+            except RuntimeError:
+                # tracemalloc is off; nothing to snapshot
+                pass
+
+
+def init_memory_diagnostics(app, db):
+    """Track RSS growth and identity-map size per request"""
+    tracker = MemoryTracker(
+        alarm_bytes=app.config.get('MEMORY_RSS_GROWTH_ALARM_MB', 20) * 2 ** 20,
+        keep=app.config.get('MEMORY_SNAPSHOTS_KEEP', 5),
+        frames=app.config.get('MEMORY_TRACEMALLOC_FRAMES', 10),
+    )
+    scheduler = SnapshotScheduler(tracker, app.config.get('MEMORY_SNAPSHOT_INTERVAL', 0))
+    app.extensions['memory_tracker'] = tracker
+    if app.config.get('MEMORY_TRACEMALLOC'):
+        tracker.start_tracing()
+
+    resident_memory = REGISTRY.gauge('process_resident_memory_bytes', 'Resident memory size of each worker')
+    REGISTRY.add_collector(lambda: resident_memory.set(rss_bytes()))
+
+    # The identity map is weak-referencing, so by the end of the request most
+    # objects are gone from it; count objects as they enter it instead
+    @event.listens_for(db.session, 'loaded_as_persistent')
+    @event.listens_for(db.session, 'pending_to_persistent')
+    def count_identity_map_entry(db_session, instance):
+        if has_request_context():
+            g.identity_map_entries = g.get('identity_map_entries', 0) + 1
+
+    @app.before_request
+    def note_rss():
+        scheduler.ensure_started()
+        g.rss_before = rss_bytes()
+
+    @app.after_request
+    def check_rss(response):
+        rss_before = g.pop('rss_before', None)
+        if rss_before is None:
+            return response
+        tracker.record(request.endpoint or 'unknown', rss_before, rss_bytes(), g.pop('identity_map_entries', 0))
+        return response
+
+    return tracker
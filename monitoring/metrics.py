@@ -0,0 +1,470 @@
+"""
+Built-in metrics registry with a Prometheus text endpoint.
+
+Each gunicorn worker keeps its metrics in memory and writes a snapshot to
+``METRICS_DIR/<pid>.json`` every METRICS_FLUSH_INTERVAL seconds (atomically,
+via rename). Whichever worker answers ``/metrics`` flushes its own snapshot
+and merges every worker's file:
+
+    counters, histograms  summed over all workers, including ones that have
+                          exited, so totals never go backwards
+    gauges                summed over live workers only
+
+Exited workers' files are folded into ``exited.json`` (counters and
+histograms only) and deleted, so they don't pile up under max_requests.
+
+``/metrics`` answers admins, and scrapers that send
+``Authorization: Bearer <METRICS_TOKEN>``. gunicorn.conf.py clears
+METRICS_DIR when the master starts.
+"""
+import bisect
+import glob
+import hmac
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from monitoring.tracing import TRACER
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+# Waiting for a pooled connection is usually well under a millisecond
+WAIT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def default_metrics_dir():
+    return os.environ.get('METRICS_DIR') or os.path.join(tempfile.gettempdir(), 'flaskmart-metrics')
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}')
+        return tuple(str(value) for value in labels)
+
+    def describe(self):
+        return {'type': self.type, 'help': self.documentation, 'labelnames': list(self.labelnames)}
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(key): value for key, value in self._values.items()}
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, *labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, *labels, amount=1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(key): value for key, value in self._values.items()}
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0}
+            entry['counts'][index] += 1
+            entry['sum'] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def describe(self):
+        return {**super().describe(), 'buckets': list(self.buckets)}
+
+    def snapshot(self):
+        with self._lock:
+            return {json.dumps(key): {'counts': list(entry['counts']), 'sum': entry['sum']}
+                    for key, entry in self._values.items()}
+
+    def cumulative(self, *labels):
+        """(upper_bound, cumulative_count) pairs plus count and sum for one label set"""
+        with self._lock:
+            entry = self._values.get(self._key(labels))
+            counts = list(entry['counts']) if entry else [0] * (len(self.buckets) + 1)
+            total = entry['sum'] if entry else 0.0
+        return _cumulative(self.buckets, counts, total)
+
+
+def _cumulative(buckets, counts, total):
+    pairs, running = [], 0
+    for bound, count in zip(list(buckets) + ['+Inf'], counts):
+        running += count
+        pairs.append((bound, running))
+    return {'buckets': pairs, 'count': running, 'sum': total}
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector):
+        """Register a callable run before each snapshot, e.g. to refresh gauges"""
+        self._collectors.append(collector)
+
+    def snapshot(self):
+        for collector in list(self._collectors):
+            try:
+                collector()
+            except Exception:
+                pass
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: {**metric.describe(), 'values': metric.snapshot()} for metric in metrics}
+
+
+REGISTRY = Registry()
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge_metrics(merged, metrics, gauges=True):
+    """Add one snapshot's metrics into ``merged``, in place"""
+    for name, metric in metrics.items():
+        if metric['type'] == 'gauge' and not gauges:
+            continue
+        target = merged.setdefault(name, {**metric, 'values': {}})
+        for key, value in metric['values'].items():
+            if metric['type'] == 'histogram':
+                current = target['values'].get(key)
+                if current is None:
+                    target['values'][key] = {'counts': list(value['counts']), 'sum': value['sum']}
+                else:
+                    current['counts'] = [a + b for a, b in zip(current['counts'], value['counts'])]
+                    current['sum'] += value['sum']
+            else:
+                target['values'][key] = target['values'].get(key, 0) + value
+    return merged
+
+
+class MultiProcessStore:
+    """Per-process snapshot files in a shared directory"""
+
+    EXITED = 'exited'
+
+    def __init__(self, registry, directory=None):
+        self.registry = registry
+        self.directory = directory or default_metrics_dir()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def path(self, pid=None):
+        return os.path.join(self.directory, f'{pid or os.getpid()}.json')
+
+    def _write(self, path, snapshot):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp, path)
+
+    def flush(self):
+        self._write(self.path(), {'pid': os.getpid(), 'written_at': time.time(), 'metrics': self.registry.snapshot()})
+
+    @contextmanager
+    def _locked(self):
+        # Folding and reading in one worker at a time, so no file is counted twice
+        import fcntl
+
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _fold_exited(self):
+        """Add exited workers' counters and histograms to exited.json and delete their files"""
+        folded = []
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            name = os.path.basename(path)[:-len('.json')]
+            if not name.isdigit() or _pid_alive(int(name)):
+                continue
+            try:
+                with open(path) as f:
+                    folded.append((path, json.load(f)['metrics']))
+            except (OSError, ValueError):
+                continue
+        if not folded:
+            return 0
+        exited_path = self.path(self.EXITED)
+        try:
+            with open(exited_path) as f:
+                metrics = json.load(f)['metrics']
+        except (OSError, ValueError):
+            metrics = {}
+        for _, snapshot in folded:
+            _merge_metrics(metrics, snapshot, gauges=False)
+        self._write(exited_path, {'pid': None, 'written_at': time.time(), 'metrics': metrics})
+        for path, _ in folded:
+            os.remove(path)
+        return len(folded)
+
+    def read_all(self):
+        snapshots = []
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                # Being replaced right now, or a worker died mid-write
+                continue
+        return snapshots
+
+    def merged(self):
+        """Merge all workers' snapshots into one set of metrics"""
+        merged = {}
+        with self._locked():
+            self._fold_exited()
+            snapshots = self.read_all()
+        for snapshot in snapshots:
+            alive = snapshot['pid'] is not None and _pid_alive(snapshot['pid'])
+            _merge_metrics(merged, snapshot['metrics'], gauges=alive)
+        return merged
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    if isinstance(value, float) and math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(metrics):
+    """Prometheus text exposition format (version 0.0.4)"""
+    lines = []
+    for name in sorted(metrics):
+        metric = metrics[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        labelnames = metric['labelnames']
+        for key in sorted(metric['values']):
+            labels = json.loads(key)
+            value = metric['values'][key]
+            if metric['type'] == 'histogram':
+                data = _cumulative(metric['buckets'], value['counts'], value['sum'])
+                for bound, count in data['buckets']:
+                    le = bound if bound == '+Inf' else _number(float(bound))
+                    lines.append(f"{name}_bucket{_labels(labelnames, labels, ('le', le))} {count}")
+                lines.append(f"{name}_sum{_labels(labelnames, labels)} {_number(data['sum'])}")
+                lines.append(f"{name}_count{_labels(labelnames, labels)} {data['count']}")
+            else:
+                lines.append(f"{name}{_labels(labelnames, labels)} {_number(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+# ----------------------------------------------------------------------
+# Application metrics
+# ----------------------------------------------------------------------
+
+request_latency = REGISTRY.histogram(
+    'http_request_duration_seconds', 'Request latency by endpoint',
+    ('blueprint', 'endpoint', 'method', 'status'))
+requests_in_flight = REGISTRY.gauge(
+    'http_requests_in_flight', 'Requests currently being handled')
+outbound_latency = REGISTRY.histogram(
+    'outbound_request_duration_seconds', 'Latency of calls to external services',
+    ('service', 'operation', 'outcome'))
+db_pool_connections = REGISTRY.gauge(
+    'db_pool_connections', 'Database pool connections by state', ('engine', 'state'))
+notification_backlog = REGISTRY.gauge(
+    'notification_backlog', 'Notifications queued but not yet sent', ('channel',))
+db_checkout_wait = REGISTRY.histogram(
+    'db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled connection',
+    buckets=WAIT_BUCKETS)
+telemetry_dropped = REGISTRY.counter(
+    'telemetry_dropped_total', 'Log records, spans and capture records dropped instead of written', ('kind',))
+notifications_delivered = REGISTRY.counter(
+    'notifications_delivered_total', 'Notifications sent, or given up on as failed', ('channel', 'outcome'))
+
+
+@contextmanager
+def track_outbound(service, operation):
+    """Time a call to an external service (Bakong, PayPal, Telegram, ...)
+
+    Also a client span when tracing is on; pass ``inject_headers()`` to the
+    request inside the block so the trace continues downstream. Raise inside
+    the block for a failed response; an exception with ``status_code`` 429
+    is recorded as ``rate_limited``.
+    """
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        with TRACER.span(f'{service} {operation}', kind='client', attributes={'peer.service': service}) as span:
+            yield span
+        outcome = 'ok'
+    except Exception as e:
+        if getattr(e, 'status_code', None) == 429:
+            outcome = 'rate_limited'
+        raise
+    finally:
+        outbound_latency.observe(time.perf_counter() - start, service, operation, outcome)
+
+
+class MetricsFlusher:
+    """Writes this worker's snapshot periodically from a daemon thread"""
+
+    def __init__(self, store, interval=1.0):
+        self.store = store
+        self.interval = interval
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='metrics-flusher', daemon=True).start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.store.flush()
+            except OSError:
+                pass
+
+
+def init_metrics(app, engines):
+    """Time every request and expose /metrics for all workers
+
+    ``engines`` maps a label (``primary``, ``replica0``, ...) to an engine.
+    """
+    from flask import Response, abort, g, request
+
+    store = MultiProcessStore(REGISTRY, app.config.get('METRICS_DIR'))
+    flusher = MetricsFlusher(store, app.config.get('METRICS_FLUSH_INTERVAL', 1.0))
+    app.extensions['metrics_store'] = store
+
+    def collect_subsystems():
+        for label, engine in engines.items():
+            pool = engine.pool
+            if hasattr(pool, 'checkedout'):
+                db_pool_connections.set(pool.checkedout(), label, 'checked_out')
+                db_pool_connections.set(pool.checkedin(), label, 'idle')
+                db_pool_connections.set(pool.size(), label, 'size')
+                db_pool_connections.set(max(pool.overflow(), 0), label, 'overflow')
+        for channel, notifier in (('telegram', app.extensions.get('telegram_notifier')),
+                                  ('email', app.extensions.get('mailer'))):
+            if notifier is not None:
+                notification_backlog.set(notifier.pending(), channel)
+
+    REGISTRY.add_collector(collect_subsystems)
+
+    @app.before_request
+    def start_request_timer():
+        flusher.ensure_started()
+        g.request_started = time.perf_counter()
+        requests_in_flight.inc()
+
+    @app.teardown_request
+    def finish_request_timer(exc):
+        started = g.pop('request_started', None)
+        if started is None:
+            return
+        requests_in_flight.dec()
+        status = g.pop('response_status', 500 if exc else 200)
+        request_latency.observe(time.perf_counter() - started,
+                                request.blueprint or 'app',
+                                request.endpoint or 'unknown',
+                                request.method,
+                                status)
+
+    @app.after_request
+    def remember_status(response):
+        g.response_status = response.status_code
+        return response
+
+    def metrics_view():
+        token = app.config.get('METRICS_TOKEN')
+        if not (token and hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}')):
+            from decorators import is_admin
+            if not is_admin():
+                abort(401)
+        store.flush()
+        return Response(render(store.merged()), mimetype='text/plain; version=0.0.4')
+
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
+    return store
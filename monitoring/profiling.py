@@ -0,0 +1,231 @@
+"""
+On-demand request profiling.
+
+A request is profiled when an admin sends ``X-Profile: 1`` or ``?_profile=1``,
+or when it is picked by PROFILE_SAMPLE_RATE (0 by default). While the view
+runs, a sampler thread records the request thread's stack every
+PROFILE_INTERVAL_MS milliseconds. The result is saved as:
+
+    folded stacks   ``root;caller;callee count`` lines, the input format of
+                    flamegraph.pl, speedscope and inferno
+    SQL timeline    every statement's offset, duration and text, taken from
+                    the per-request stats in monitoring/sql.py
+
+Profiles are JSON files in PROFILE_DIR, shared by all workers, and the newest
+PROFILE_KEEP are kept. Admins browse them at /admin/profiles. Responses that
+were profiled carry an ``X-Profile-Id`` header.
+"""
+import glob
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+
+from flask import g, request, session
+
+from monitoring.sql import ROOT, current_stats
+
+PROFILE_HEADER = 'X-Profile'
+PROFILE_ARG = '_profile'
+
+
+def default_profile_dir():
+    return os.environ.get('PROFILE_DIR') or os.path.join(tempfile.gettempdir(), 'flaskmart-profiles')
+
+
+def frame_name(frame):
+    code = frame.f_code
+    filename = code.co_filename
+    if filename.startswith(ROOT):
+        filename = os.path.relpath(filename, ROOT)
+    else:
+        # Keep library paths short: .../site-packages/flask/app.py -> flask/app.py
+        marker = 'site-packages' + os.sep
+        if marker in filename:
+            filename = filename.split(marker, 1)[1]
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'.replace(';', ',')
+
+
+def collapse(frame):
+    """Stack from the outermost frame to ``frame`` as a folded-stack key"""
+    names = []
+    while frame is not None:
+        names.append(frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """Samples one thread's stack from a background thread"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration_ms = (time.perf_counter() - self.started) * 1000
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            self.stacks[collapse(frame)] += 1
+            self.samples += 1
+
+    def folded(self):
+        return '\n'.join(f'{stack} {count}' for stack, count in self.stacks.most_common())
+
+    def top_functions(self, limit=20):
+        """Functions by self samples (leaf frames) and by inclusive samples"""
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for name in set(frames):
+                total[name] += count
+        return [{'function': name, 'self': count, 'total': total[name]}
+                for name, count in own.most_common(limit)]
+
+
+class ProfileStore:
+    """Profiles as JSON files in a directory shared by all workers"""
+
+    def __init__(self, directory=None, keep=100):
+        self.directory = directory or default_profile_dir()
+        self.keep = keep
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, profile_id):
+        if not profile_id.replace('-', '').isalnum():
+            raise ValueError('bad profile id')
+        return os.path.join(self.directory, f'{profile_id}.json')
+
+    def save(self, profile):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(profile, f)
+        os.replace(tmp, self._path(profile['id']))
+        self._prune()
+
+    def _prune(self):
+        paths = sorted(glob.glob(os.path.join(self.directory, '*.json')), key=os.path.getmtime)
+        for path in paths[:-self.keep]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def get(self, profile_id):
+        try:
+            with open(self._path(profile_id)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def recent(self, limit=50):
+        """Newest profiles first, without their stacks"""
+        paths = sorted(glob.glob(os.path.join(self.directory, '*.json')), key=os.path.getmtime, reverse=True)
+        profiles = []
+        for path in paths[:limit]:
+            try:
+                with open(path) as f:
+                    profile = json.load(f)
+            except (OSError, ValueError):
+                continue
+            profile.pop('folded', None)
+            profile.pop('sql_timeline', None)
+            profiles.append(profile)
+        return profiles
+
+
+def sql_timeline(stats):
+    if stats is None:
+        return []
+    return [{'offset_ms': round(offset, 2), 'duration_ms': round(duration, 2),
+             'fingerprint': key, 'statement': stats.statements[key][0]}
+            for offset, duration, key in stats.timeline]
+
+
+def _requested_by_admin():
+    flag = request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_ARG)
+    if flag not in ('1', 'true', 'yes'):
+        return False
+    from decorators import is_admin
+    return is_admin()
+
+
+def init_profiling(app):
+    """Profile flagged or sampled requests and keep the results for admins"""
+    store = ProfileStore(app.config.get('PROFILE_DIR'), app.config.get('PROFILE_KEEP', 100))
+    app.extensions['profile_store'] = store
+    interval = app.config.get('PROFILE_INTERVAL_MS', 5) / 1000
+    sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0.0)
+
+    @app.before_request
+    def start_profile():
+        if request.endpoint == 'static':
+            return
+        if _requested_by_admin():
+            trigger = 'admin'
+        elif sample_rate and random.random() < sample_rate:
+            trigger = 'sampled'
+        else:
+            return
+        g.profile_trigger = trigger
+        g.profile_id = f'{int(time.time())}-{uuid.uuid4().hex[:8]}'
+        g.profile_sampler = StackSampler(threading.get_ident(), interval).start()
+
+    @app.after_request
+    def finish_profile(response):
+        sampler = g.pop('profile_sampler', None)
+        if sampler is None:
+            return response
+        sampler.stop()
+        stats = current_stats()
+        store.save({
+            'id': g.profile_id,
+            'trigger': g.profile_trigger,
+            'created_at': time.time(),
+            'pid': os.getpid(),
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'status': response.status_code,
+            'user_id': session.get('user_id'),
+            'duration_ms': round(sampler.duration_ms, 2),
+            'interval_ms': interval * 1000,
+            'samples': sampler.samples,
+            'sql_count': stats.count if stats else 0,
+            'sql_ms': round(stats.total_ms, 2) if stats else 0,
+            'top_functions': sampler.top_functions(),
+            'folded': sampler.folded(),
+            'sql_timeline': sql_timeline(stats),
+        })
+        response.headers['X-Profile-Id'] = g.profile_id
+        return response
+
+    @app.teardown_request
+    def stop_abandoned_profile(exc):
+        sampler = g.pop('profile_sampler', None)
+        if sampler is not None:
+            sampler.stop()
+
+    return store
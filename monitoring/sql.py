@@ -0,0 +1,195 @@
+"""
+Per-request SQL instrumentation.
+
+Hooks ``before/after_cursor_execute`` on the primary and replica engines and
+accumulates, per request:
+
+    - number of statements and total time spent in the database
+    - time per normalized statement fingerprint, to spot N+1 patterns
+
+The totals go out as a ``Server-Timing`` header (visible in the browser's
+network panel) when the app is in debug mode, for admin pages, or when
+SQL_SERVER_TIMING is on.
+
+Statements slower than SQL_SLOW_QUERY_MS are sampled at
+SQL_SLOW_QUERY_SAMPLE_RATE into the ``sql.slow`` logger with the view and
+the application line that issued them, and aggregated per fingerprint for
+/admin/api/slow-queries.
+"""
+import hashlib
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger('sql.slow')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LIBRARY_PATHS = ('site-packages', 'dist-packages', os.path.join(ROOT, 'monitoring'))
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PARAM = re.compile(r'%\(\w+\)s|:\w+|\$\d+|\?|%s')
+_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+_SPACE = re.compile(r'\s+')
+
+
+def normalize(statement):
+    """Collapse literals and parameter lists so similar statements group together"""
+    text = _STRING.sub('?', statement)
+    text = _PARAM.sub('?', text)
+    text = _NUMBER.sub('?', text)
+    text = _IN_LIST.sub('(?+)', text)
+    return _SPACE.sub(' ', text).strip()
+
+
+def fingerprint(statement):
+    normalized = normalize(statement)
+    return hashlib.sha1(normalized.encode()).hexdigest()[:12], normalized
+
+
+def call_site():
+    """First frame outside SQLAlchemy/Flask and this module, as 'file:line in func'"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(ROOT) and not any(path in filename for path in LIBRARY_PATHS):
+            return f"{os.path.relpath(filename, ROOT)}:{frame.f_lineno} in {frame.f_code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+class RequestStats:
+    """SQL activity for one request"""
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.statements = {}  # fingerprint -> [normalized, count, total_ms]
+        self.timeline = []  # (offset_ms, duration_ms, fingerprint) per statement
+        self.started = time.perf_counter()
+
+    def record(self, key, normalized, start, duration_ms):
+        self.count += 1
+        self.total_ms += duration_ms
+        entry = self.statements.get(key)
+        if entry is None:
+            entry = self.statements[key] = [normalized, 0, 0.0]
+        entry[1] += 1
+        entry[2] += duration_ms
+        self.timeline.append(((start - self.started) * 1000, duration_ms, key))
+
+    def top(self, limit=3):
+        return sorted(self.statements.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+
+
+class SlowQueryLog:
+    """Bounded per-fingerprint aggregate of slow statements"""
+
+    def __init__(self, max_entries=200):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, key, normalized, duration_ms, site, endpoint):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                entry = {'fingerprint': key, 'statement': normalized, 'count': 0,
+                         'total_ms': 0.0, 'max_ms': 0.0, 'call_sites': {}, 'endpoints': {}}
+            entry['count'] += 1
+            entry['total_ms'] += duration_ms
+            entry['max_ms'] = max(entry['max_ms'], duration_ms)
+            if site:
+                entry['call_sites'][site] = entry['call_sites'].get(site, 0) + 1
+            if endpoint:
+                entry['endpoints'][endpoint] = entry['endpoints'].get(endpoint, 0) + 1
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def entries(self):
+        with self._lock:
+            entries = [dict(entry) for entry in self._entries.values()]
+        return sorted(entries, key=lambda entry: entry['total_ms'], reverse=True)
+
+
+slow_queries = SlowQueryLog()
+
+
+def current_stats():
+    """The RequestStats for the current request, or None outside a request"""
+    if not has_request_context():
+        return None
+    return g.get('sql_stats')
+
+
+def instrument_engine(engine, config):
+    """Time every statement on an engine and attribute it to the current request"""
+    slow_ms = config.get('SQL_SLOW_QUERY_MS', 100)
+    sample_rate = config.get('SQL_SLOW_QUERY_SAMPLE_RATE', 1.0)
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('query_start')
+        if not starts:
+            return
+        start = starts.pop()
+        duration_ms = (time.perf_counter() - start) * 1000
+
+        stats = current_stats()
+        is_slow = duration_ms >= slow_ms
+        if stats is None and not is_slow:
+            return
+
+        key, normalized = fingerprint(statement)
+        if stats is not None:
+            stats.record(key, normalized, start, duration_ms)
+
+        if is_slow and random.random() < sample_rate:
+            site = call_site()
+            endpoint = request.endpoint if has_request_context() else None
+            slow_queries.add(key, normalized, duration_ms, site, endpoint)
+            logger.warning('slow query %.1fms [%s] %s at %s (%s)',
+                           duration_ms, key, normalized[:500], site, endpoint)
+
+
+def _wants_server_timing(app):
+    return app.debug or app.config.get('SQL_SERVER_TIMING') or request.blueprint == 'admin'
+
+
+def server_timing(stats, limit=3):
+    """Format request SQL stats as a Server-Timing header value"""
+    parts = [f'db;dur={stats.total_ms:.1f};desc="{stats.count} queries"']
+    for index, (key, (normalized, count, total_ms)) in enumerate(stats.top(limit), 1):
+        desc = normalized[:60].replace('"', "'")
+        parts.append(f'sql{index};dur={total_ms:.1f};desc="{count}x {desc}"')
+    return ', '.join(parts)
+
+
+def init_sql_instrumentation(app, engines):
+    """Instrument engines and attach per-request SQL stats to every blueprint"""
+    for engine in engines:
+        instrument_engine(engine, app.config)
+
+    @app.before_request
+    def start_sql_stats():
+        g.sql_stats = RequestStats()
+
+    @app.after_request
+    def add_server_timing(response):
+        stats = g.get('sql_stats')
+        if stats is not None and _wants_server_timing(app):
+            response.headers.add('Server-Timing', server_timing(stats))
+        return response
@@ -0,0 +1,569 @@
+"""
+Distributed tracing across requests, SQL, outbound HTTP and notifications.
+
+With TRACING on, every request gets a server span (continuing the caller's
+trace if it sent a W3C ``traceparent`` header) and children for:
+
+    db.query      each SQL statement, normalized so no values leak
+    db.commit     flush + commit of the session
+    <service> <operation>
+                  outbound calls wrapped in track_outbound (Bakong, PayPal,
+                  Telegram), which also send ``traceparent`` downstream
+
+The trace context travels with queued Telegram and email jobs, so the
+worker's ``telegram.deliver`` / ``mail.render`` / ``mail.deliver`` spans land in the same
+trace as the checkout that queued them (a digest covering several orders
+continues the first one's trace and links to the others). Bakong callbacks
+link back to the request that created the payment.
+
+Sampling is decided once per trace (TRACE_SAMPLE_RATE) and inherited by
+every span in it. Finished spans are exported from a background thread as
+JSON lines to TRACE_DIR/spans-<pid>.jsonl, or POSTed in batches to
+TRACE_COLLECTOR_URL (stubs/trace_collector.py is a local stand-in).
+
+    python -m monitoring.tracing TRACE_FILE... [--name 'POST /api/place-order']
+                                 [--slowest 5] [--trace TRACE_ID]
+
+prints where time goes per hop and a waterfall of the slowest traces.
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import queue
+import random
+import tempfile
+import threading
+import time
+from collections import defaultdict, namedtuple
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+TRACEPARENT = 'traceparent'
+
+_current = ContextVar('flaskmart_span', default=None)
+
+
+class SpanContext(namedtuple('SpanContext', 'trace_id span_id sampled')):
+    """What crosses process and thread boundaries: ids plus the sampling decision"""
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    @classmethod
+    def from_traceparent(cls, value):
+        parts = (value or '').strip().split('-')
+        if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+            return None
+        try:
+            int(parts[1], 16), int(parts[2], 16)
+            flags = int(parts[3], 16)
+        except ValueError:
+            return None
+        if parts[1] == '0' * 32 or parts[2] == '0' * 16:
+            return None
+        return cls(parts[1], parts[2], bool(flags & 1))
+
+
+def _new_id(bits):
+    return f'{random.getrandbits(bits):0{bits // 4}x}'
+
+
+class Span:
+    def __init__(self, tracer, name, context, parent_id=None, kind='internal', attributes=None, links=()):
+        self.tracer = tracer
+        self.name = name
+        self.context = context
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.links = [link for link in links if link is not None]
+        self.status = 'ok'
+        self.error = None
+        self.start = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def add_link(self, context):
+        if context is not None:
+            self.links.append(context)
+
+    def record_error(self, exc):
+        self.status = 'error'
+        self.error = f'{type(exc).__name__}: {exc}'
+
+    def end(self):
+        if self.duration is None:
+            self.duration = time.perf_counter() - self._start
+            self.tracer._finish(self)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.context.trace_id,
+            'span_id': self.context.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'kind': self.kind,
+            'service': self.tracer.service,
+            'pid': os.getpid(),
+            'start': round(self.start, 6),
+            'duration_ms': round(self.duration * 1000, 3),
+            'status': self.status,
+            'error': self.error,
+            'attributes': self.attributes,
+            'links': [{'trace_id': link.trace_id, 'span_id': link.span_id} for link in self.links],
+        }
+
+
+class _NoopSpan:
+    """Stands in for a span when tracing is off, so callers never check"""
+    context = None
+
+    def set_attribute(self, key, value):
+        pass
+
+    def add_link(self, context):
+        pass
+
+    def record_error(self, exc):
+        pass
+
+    def end(self):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class BatchExporter:
+    """Ships finished spans from a background thread; never blocks the caller"""
+
+    def __init__(self, batch_size=200, interval=1.0):
+        self.batch_size = batch_size
+        self.interval = interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=10000)
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self._drop(1)
+
+    def _drop(self, count):
+        # monitoring.metrics imports this module, so it can't be imported at the top
+        from monitoring.metrics import telemetry_dropped
+        self.dropped += count
+        telemetry_dropped.inc('spans', amount=count)
+
+    def flush(self, timeout=10):
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return self._queue.unfinished_tasks == 0
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='trace-exporter', daemon=True).start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self.write(batch)
+            except Exception:
+                self._drop(len(batch))
+                logger.warning('Failed to export %d span(s)', len(batch), exc_info=True)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def write(self, spans):
+        raise NotImplementedError
+
+
+class FileExporter(BatchExporter):
+    """Appends spans as JSON lines to <directory>/spans-<pid>.jsonl"""
+
+    def __init__(self, directory, **kwargs):
+        super().__init__(**kwargs)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, spans):
+        path = os.path.join(self.directory, f'spans-{os.getpid()}.jsonl')
+        with open(path, 'a', encoding='utf-8') as handle:
+            handle.write(''.join(json.dumps(span, separators=(',', ':')) + '\n' for span in spans))
+
+
+class HTTPExporter(BatchExporter):
+    """POSTs batches of spans as {"spans": [...]} to a collector"""
+
+    def __init__(self, url, timeout=5, **kwargs):
+        super().__init__(**kwargs)
+        self.url = url
+        self.timeout = timeout
+        self._http = None
+
+    def write(self, spans):
+        if self._http is None:
+            self._http = requests.Session()
+        self._http.post(self.url, json={'spans': spans}, timeout=self.timeout).raise_for_status()
+
+
+class Tracer:
+    def __init__(self, service='flaskmart', exporter=None, sample_rate=1.0):
+        self.service = service
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+
+    @property
+    def enabled(self):
+        return self.exporter is not None
+
+    def configure(self, exporter, sample_rate=1.0, service=None):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        if service:
+            self.service = service
+
+    def start_span(self, name, kind='internal', parent=None, attributes=None, links=()):
+        """Start a span under ``parent`` (a SpanContext), or the current span
+
+        The span is not made current; use span() or activate() for that.
+        """
+        if not self.enabled:
+            return NOOP_SPAN
+        if parent is None:
+            current = _current.get()
+            parent = current.context if current is not None else None
+        if parent is None:
+            context = SpanContext(_new_id(128), _new_id(64), random.random() < self.sample_rate)
+            parent_id = None
+        else:
+            context = SpanContext(parent.trace_id, _new_id(64), parent.sampled)
+            parent_id = parent.span_id
+        return Span(self, name, context, parent_id, kind, attributes, links)
+
+    @contextmanager
+    def span(self, name, kind='internal', parent=None, attributes=None, links=()):
+        """Run a block inside a new current span, marking it failed on exceptions"""
+        if not self.enabled:
+            yield NOOP_SPAN
+            return
+        span = self.start_span(name, kind, parent, attributes, links)
+        token = _current.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            _current.reset(token)
+            span.end()
+
+    def _finish(self, span):
+        if span.context.sampled and self.exporter is not None:
+            self.exporter.export(span.to_dict())
+
+
+TRACER = Tracer()
+
+
+def activate(span):
+    """Make ``span`` current; returns a token for deactivate()"""
+    return _current.set(span) if span is not NOOP_SPAN else None
+
+
+def deactivate(token):
+    if token is not None:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # Token from a different context (e.g. teardown after a copied context)
+            _current.set(None)
+
+
+def current_span():
+    return _current.get() or NOOP_SPAN
+
+
+def current_context():
+    """SpanContext to hand to a background job, or None"""
+    span = _current.get()
+    return span.context if span is not None else None
+
+
+def inject_headers(headers=None):
+    """Add ``traceparent`` for the current span to outbound request headers"""
+    headers = dict(headers or {})
+    context = current_context()
+    if context is not None:
+        headers[TRACEPARENT] = context.traceparent()
+    return headers
+
+
+def extract(headers):
+    """SpanContext from incoming request headers, if the caller sent one"""
+    return SpanContext.from_traceparent(headers.get(TRACEPARENT))
+
+
+def _instrument_engine(engine, label):
+    from sqlalchemy import event
+
+    from monitoring.sql import normalize
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query_span(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is None:
+            return
+        span = TRACER.start_span('db.query', kind='client', attributes={
+            'db.engine': label,
+            'db.statement': normalize(statement)[:500],
+            'db.executemany': executemany,
+        })
+        conn.info.setdefault('trace_spans', []).append(span)
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def end_query_span(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get('trace_spans')
+        if spans:
+            span = spans.pop()
+            if cursor.rowcount is not None and cursor.rowcount >= 0:
+                span.set_attribute('db.rows', cursor.rowcount)
+            span.end()
+
+    @event.listens_for(engine, 'handle_error')
+    def fail_query_span(exception_context):
+        conn = exception_context.connection
+        spans = conn.info.get('trace_spans') if conn is not None else None
+        if spans:
+            span = spans.pop()
+            span.record_error(exception_context.original_exception)
+            span.end()
+
+
+def _start_commit_span(db_session):
+    from flask import g, has_app_context
+
+    if _current.get() is not None and has_app_context():
+        # Current, so the flush's statements nest under it
+        g.trace_commit_span = TRACER.start_span('db.commit')
+        g.trace_commit_token = activate(g.trace_commit_span)
+
+
+def _end_commit_span(db_session, error=False):
+    from flask import g, has_app_context
+
+    if not has_app_context():
+        return
+    span = g.pop('trace_commit_span', None)
+    if span is not None:
+        deactivate(g.pop('trace_commit_token', None))
+        if error:
+            span.status = 'error'
+        span.end()
+
+
+def _fail_commit_span(db_session):
+    _end_commit_span(db_session, error=True)
+
+
+def _instrument_session(session):
+    from sqlalchemy import event
+
+    # Session events are registered on the Session class, shared by every app
+    # in the process, so only listen once
+    for name, listener in (('before_commit', _start_commit_span), ('after_commit', _end_commit_span),
+                           ('after_rollback', _fail_commit_span)):
+        if not event.contains(session, name, listener):
+            event.listen(session, name, listener)
+
+
+def init_tracing(app, engines, db):
+    """Trace requests, SQL and the session when TRACING is on"""
+    if not app.config.get('TRACING'):
+        return None
+
+    from flask import g, request
+
+    collector = app.config.get('TRACE_COLLECTOR_URL')
+    if collector:
+        exporter = HTTPExporter(collector)
+    else:
+        exporter = FileExporter(app.config.get('TRACE_DIR') or os.path.join(tempfile.gettempdir(), 'flaskmart-traces'))
+    TRACER.configure(exporter, app.config.get('TRACE_SAMPLE_RATE', 1.0), app.config.get('TRACE_SERVICE_NAME'))
+    app.extensions['tracer'] = TRACER
+
+    for label, engine in engines.items():
+        _instrument_engine(engine, label)
+    _instrument_session(db.session)
+
+    @app.before_request
+    def start_request_span():
+        route = request.url_rule.rule if request.url_rule is not None else request.path
+        span = TRACER.start_span(f'{request.method} {route}', kind='server', parent=extract(request.headers),
+                                 attributes={'http.method': request.method, 'http.route': route,
+                                             'http.target': request.path})
+        g.trace_span = span
+        g.trace_token = activate(span)
+
+    @app.after_request
+    def tag_response(response):
+        span = g.get('trace_span')
+        if span is not None and span is not NOOP_SPAN:
+            span.set_attribute('http.status_code', response.status_code)
+            if response.status_code >= 500:
+                span.status = 'error'
+            if span.context.sampled:
+                response.headers['X-Trace-Id'] = span.context.trace_id
+        return response
+
+    @app.teardown_request
+    def end_request_span(exc):
+        span = g.pop('trace_span', None)
+        if span is None:
+            return
+        if exc is not None:
+            span.record_error(exc)
+        deactivate(g.pop('trace_token', None))
+        span.end()
+
+    return TRACER
+
+
+# ----------------------------------------------------------------------
+# Reading traces back
+# ----------------------------------------------------------------------
+
+def load_spans(paths):
+    """Spans grouped by trace id, from span files (JSON lines)"""
+    traces = defaultdict(list)
+    for path in paths:
+        with open(path, encoding='utf-8') as handle:
+            for line in handle:
+                try:
+                    span = json.loads(line)
+                except ValueError:
+                    continue
+                traces[span['trace_id']].append(span)
+    return traces
+
+
+def root_of(spans):
+    ids = {span['span_id'] for span in spans}
+    roots = [span for span in spans if span['parent_id'] not in ids]
+    return min(roots, key=lambda span: span['start']) if roots else None
+
+
+def hop_breakdown(traces, name=None):
+    """Mean time per span name across traces rooted at ``name``
+
+    Returns [(span name, count, mean ms per trace, share of root time)],
+    where background spans that finish after the response are included
+    with their own duration (share is relative to the root span).
+    """
+    totals, counts, root_total, matched = defaultdict(float), defaultdict(int), 0.0, 0
+    for spans in traces.values():
+        root = root_of(spans)
+        if root is None or (name and root['name'] != name):
+            continue
+        matched += 1
+        root_total += root['duration_ms']
+        for span in spans:
+            if span is root:
+                continue
+            totals[span['name']] += span['duration_ms']
+            counts[span['name']] += 1
+    if not matched:
+        return []
+    return sorted(((span_name, counts[span_name], total / matched, total / root_total if root_total else 0)
+                   for span_name, total in totals.items()), key=lambda row: -row[2])
+
+
+def waterfall(spans, width=40):
+    """Text waterfall of one trace, children indented under parents"""
+    root = root_of(spans)
+    if root is None:
+        return ''
+    t0 = min(span['start'] for span in spans)
+    t1 = max(span['start'] + span['duration_ms'] / 1000 for span in spans)
+    scale = width / max(t1 - t0, 1e-6)
+    children = defaultdict(list)
+    for span in spans:
+        children[span['parent_id']].append(span)
+
+    lines = [f"trace {root['trace_id']}  {root['name']}  {root['duration_ms']:.1f} ms"]
+
+    def walk(span, depth):
+        offset = span['start'] - t0
+        bar_start = int(offset * scale)
+        bar = ' ' * bar_start + '█' * max(1, int(span['duration_ms'] / 1000 * scale))
+        label = span['name']
+        if span['name'] == 'db.query':
+            label = f"db.query {span['attributes'].get('db.statement', '')[:40]}"
+        status = ' !' if span['status'] == 'error' else ''
+        lines.append(f"{offset * 1000:9.1f} {span['duration_ms']:9.1f}  {bar:<{width}}  "
+                     f"{'  ' * depth}{label}{status}")
+        for child in sorted(children[span['span_id']], key=lambda s: s['start']):
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize exported spans')
+    parser.add_argument('paths', nargs='*', help='span files (default: TRACE_DIR/*.jsonl)')
+    parser.add_argument('--name', help="root span to analyse, e.g. 'POST /api/place-order'")
+    parser.add_argument('--slowest', type=int, default=3, help='waterfalls for the N slowest traces')
+    parser.add_argument('--trace', help='print only this trace id')
+    args = parser.parse_args()
+
+    paths = args.paths or glob.glob(os.path.join(
+        os.environ.get('TRACE_DIR') or os.path.join(tempfile.gettempdir(), 'flaskmart-traces'), '*.jsonl'))
+    traces = load_spans(paths)
+    if args.trace:
+        print(waterfall(traces.get(args.trace, [])) or f'No spans for trace {args.trace}')
+        return
+
+    rows = hop_breakdown(traces, args.name)
+    if not rows:
+        raise SystemExit('No matching traces')
+    print(f"{'Span':<50} {'Count':>7} {'ms/trace':>10} {'Share':>7}")
+    for span_name, count, mean_ms, share in rows:
+        print(f"{span_name[:50]:<50} {count:>7} {mean_ms:>10.2f} {share:>6.0%}")
+
+    matching = [spans for spans in traces.values()
+                if root_of(spans) and (not args.name or root_of(spans)['name'] == args.name)]
+    for spans in sorted(matching, key=lambda s: -root_of(s)['duration_ms'])[:args.slowest]:
+        print()
+        print(waterfall(spans))
+
+
+if __name__ == '__main__':
+    main()
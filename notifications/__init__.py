@@ -0,0 +1,21 @@
+from notifications.telegram_notifier import TelegramNotifier, TokenBucket
+from notifications.mailer import Mailer, SMTPConnectionPool
+
+
+def init_notifications(app):
+    """Create the per-process notifiers for a Flask app"""
+    app.extensions['telegram_notifier'] = TelegramNotifier.from_config(app.config)
+    app.extensions['mailer'] = Mailer.from_app(app)
+    return app.extensions['telegram_notifier'], app.extensions['mailer']
+
+
+def get_telegram_notifier(app=None):
+    """Return the Telegram notifier for the current app"""
+    from flask import current_app
+    return (app or current_app).extensions['telegram_notifier']
+
+
+def get_mailer(app=None):
+    """Return the transactional mailer for the current app"""
+    from flask import current_app
+    return (app or current_app).extensions['mailer']
@@ -0,0 +1,337 @@
+"""
+Transactional email over a persistent SMTP connection pool.
+
+The mailer is configured once per app from the MAIL_* settings. Messages are
+queued by request threads and sent by background workers that keep their
+SMTP+TLS sessions open between messages, so a burst of orders reuses a few
+connections instead of doing a TCP, TLS and AUTH handshake per email.
+
+Templates are compiled once when the mailer is created and rendered without
+an app context, so workers never touch ``app.config`` or process-wide socket
+defaults.
+"""
+import logging
+import os
+import queue
+import smtplib
+import threading
+import time
+from contextlib import contextmanager
+from email.message import EmailMessage
+from email.utils import make_msgid, formatdate
+
+from monitoring.metrics import notifications_delivered
+from monitoring.tracing import TRACER, current_context
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES = {
+    'invoice': 'mail/invoice.html',
+    'order_status': 'mail/order_status.html',
+}
+
+STATUS_SUBJECTS = {
+    'approved': 'Your order {order_number} has been approved',
+    'rejected': 'Your order {order_number} has been rejected',
+    'shipped': 'Your order {order_number} has shipped',
+}
+
+
+def build_message(sender, subject, recipients, html=None, body=None):
+    message = EmailMessage()
+    message['Subject'] = subject
+    message['From'] = sender
+    message['To'] = ', '.join(recipients)
+    message['Date'] = formatdate(localtime=True)
+    message['Message-ID'] = make_msgid()
+    message.set_content(body or '')
+    if html:
+        message.add_alternative(html, subtype='html')
+    return message
+
+
+class SMTPConnectionPool:
+    """Thread-safe pool of logged-in SMTP connections"""
+
+    def __init__(self, host, port=587, username=None, password=None, use_tls=True,
+                 use_ssl=False, timeout=15, size=2, max_idle=60, max_messages=100):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.size = size
+        self.max_idle = max_idle
+        self.max_messages = max_messages
+
+        self._idle = []  # (connection, last_used, messages_sent)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self.connections_opened = 0
+
+    def _connect(self):
+        if self.use_ssl:
+            connection = smtplib.SMTP_SSL(self.host, self.port, timeout=self.timeout)
+        else:
+            connection = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.use_tls:
+                connection.starttls()
+        if self.username and self.password:
+            connection.login(self.username, self.password)
+        self.connections_opened += 1
+        return connection
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.quit()
+        except (smtplib.SMTPException, OSError):
+            connection.close()
+
+    def _checkout(self):
+        with self._lock:
+            while self._idle:
+                connection, last_used, sent = self._idle.pop()
+                idle_for = time.monotonic() - last_used
+                if idle_for > self.max_idle or sent >= self.max_messages:
+                    self._close(connection)
+                    continue
+                return connection, sent
+        return self._connect(), 0
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; it goes back to the pool unless an error occurred"""
+        self._slots.acquire()
+        try:
+            connection, sent = self._checkout()
+            state = {'sent': sent}
+            try:
+                yield connection, state
+            except Exception:
+                self._close(connection)
+                raise
+            with self._lock:
+                self._idle.append((connection, time.monotonic(), state['sent']))
+        finally:
+            self._slots.release()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for connection, _, _ in idle:
+            self._close(connection)
+
+
+class Mailer:
+    """Queues outgoing email and delivers it from background workers"""
+
+    def __init__(self, pool, sender, jinja_env, workers=1, batch_size=20, max_retries=2):
+        # Without a sender there is nothing to send as; send() drops messages
+        self.enabled = bool(sender)
+        self.pool = pool
+        self.sender = sender
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+
+        # Compile once; Environment.get_template would re-stat the file
+        # on every render when auto_reload is on
+        self.templates = {name: jinja_env.get_template(path) for name, path in TEMPLATES.items()}
+
+        self._queue = queue.Queue()
+        self._threads = []
+        self._pid = None
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+
+    @classmethod
+    def from_app(cls, app):
+        config = app.config
+        pool = SMTPConnectionPool(
+            host=config['MAIL_SERVER'],
+            port=config['MAIL_PORT'],
+            username=config.get('MAIL_USERNAME'),
+            password=config.get('MAIL_PASSWORD'),
+            use_tls=config.get('MAIL_USE_TLS', True),
+            use_ssl=config.get('MAIL_USE_SSL', False),
+            timeout=config.get('MAIL_TIMEOUT', 15),
+            size=config.get('MAIL_POOL_SIZE', 2),
+            max_idle=config.get('MAIL_POOL_MAX_IDLE', 60),
+            max_messages=config.get('MAIL_POOL_MAX_MESSAGES', 100),
+        )
+        if not config.get('MAIL_DEFAULT_SENDER'):
+            logger.info('MAIL_DEFAULT_SENDER is not set; transactional email is disabled')
+        return cls(pool, config.get('MAIL_DEFAULT_SENDER'), app.jinja_env,
+                   workers=config.get('MAIL_WORKERS', 1))
+
+    # ------------------------------------------------------------------
+    # Building messages
+    # ------------------------------------------------------------------
+
+    def render(self, template, context):
+        return self.templates[template].render(**context)
+
+    def send(self, subject, recipients, html=None, body=None, template=None, context=None):
+        """Queue a message; never blocks on SMTP
+
+        With ``template`` the HTML is rendered by the worker, keeping template
+        errors and rendering cost off the request thread.
+        """
+        recipients = [r for r in recipients if r]
+        if not recipients or not self.enabled:
+            return
+        self._ensure_workers()
+        self._queue.put({
+            'subject': subject,
+            'recipients': recipients,
+            'html': html,
+            'body': body,
+            'template': template,
+            'context': context or {},
+            'trace': current_context(),
+            'queued_at': time.time(),
+        })
+
+    def send_order_confirmation(self, order_number, name, email, phone, address, billing, items, totals, notes):
+        self.send(f'Order Confirmation - {order_number}', [email],
+                  body=f'Thank you for your order! Order number: {order_number}',
+                  template='invoice',
+                  context={
+                      'name': name,
+                      'email': email,
+                      'phone': phone,
+                      'order_number': order_number,
+                      'address': address,
+                      'full_address': billing,
+                      'items': items,
+                      'totals': totals,
+                      'notes': notes,
+                  })
+
+    def send_status_update(self, order, status, reason=None, tracking_number=None):
+        """Email the customer about an admin status change (approved, rejected, shipped)"""
+        subject = STATUS_SUBJECTS[status].format(order_number=order.order_number)
+        self.send(subject, [order.customer_email],
+                  body=f'Order {order.order_number} is now {status}.',
+                  template='order_status',
+                  context={
+                      'status': status,
+                      'name': order.customer_name,
+                      'order_number': order.order_number,
+                      'total': float(order.total),
+                      'reason': reason,
+                      'tracking_number': tracking_number,
+                  })
+
+    def _build(self, job):
+        html = job['html']
+        if job['template']:
+            html = self.render(job['template'], job['context'])
+        return build_message(self.sender, job['subject'], job['recipients'], html=html, body=job['body'])
+
+    # ------------------------------------------------------------------
+    # Delivery
+    # ------------------------------------------------------------------
+
+    def pending(self):
+        """Number of messages waiting to be sent"""
+        return self._queue.qsize()
+
+    def flush(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return self._queue.unfinished_tasks == 0
+
+    def close(self):
+        self.flush()
+        self.pool.close()
+
+    def _ensure_workers(self):
+        if self._pid == os.getpid() and all(t.is_alive() for t in self._threads):
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked: the parent's threads and sockets are not ours
+                self._threads = []
+                self.pool._idle = []
+                self._pid = os.getpid()
+            self._threads = [t for t in self._threads if t.is_alive()]
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run, name=f'mailer-{len(self._threads)}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                messages = []
+                for job in batch:
+                    try:
+                        with TRACER.span('mail.render', parent=job['trace'],
+                                         attributes={'mail.template': job['template'],
+                                                     'queue.wait_ms': round((time.time() - job['queued_at']) * 1000, 1)}):
+                            messages.append((self._build(job), job['trace']))
+                    except Exception:
+                        self.failed += 1
+                        notifications_delivered.inc('email', 'failed')
+                        logger.exception('Failed to render email %r', job['subject'])
+                self._deliver(messages)
+            except Exception:
+                logger.exception('Mailer failed to deliver batch')
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _deliver(self, batch):
+        """Send (message, trace context) pairs over one pooled connection, reconnecting on failure"""
+        remaining = list(batch)
+        attempts = 0
+        while remaining and attempts <= self.max_retries:
+            try:
+                with self.pool.connection() as (connection, state):
+                    while remaining:
+                        message, trace = remaining[0]
+                        try:
+                            with TRACER.span('mail.deliver', kind='client', parent=trace,
+                                             attributes={'peer.service': 'smtp', 'mail.recipients': len(message['To'].split(','))}):
+                                connection.send_message(message)
+                        except smtplib.SMTPRecipientsRefused as e:
+                            # Bad address; retrying won't help
+                            logger.error('Email to %s refused: %s', message['To'], e.recipients)
+                            self.failed += 1
+                            notifications_delivered.inc('email', 'failed')
+                        except smtplib.SMTPResponseException as e:
+                            if e.smtp_code < 500:
+                                raise
+                            # A 5xx for this message (sender refused, data rejected) is
+                            # permanent; skip it rather than retry the whole batch.
+                            # smtplib has reset the transaction, so the connection is reusable
+                            logger.error('Email to %s rejected: %s %s', message['To'], e.smtp_code, e.smtp_error)
+                            self.failed += 1
+                            notifications_delivered.inc('email', 'failed')
+                        else:
+                            self.sent += 1
+                            notifications_delivered.inc('email', 'sent')
+                        state['sent'] += 1
+                        remaining.pop(0)
+            except (smtplib.SMTPException, OSError) as e:
+                # Connection-level or temporary (4xx) failure: reconnect and resume
+                attempts += 1
+                logger.warning('SMTP error, %d message(s) left to send: %s', len(remaining), e)
+                time.sleep(min(2 ** attempts, 10))
+
+        if remaining:
+            self.failed += len(remaining)
+            notifications_delivered.inc('email', 'failed', amount=len(remaining))
+            logger.error('Dropping %d email(s) after %d attempts', len(remaining), attempts)
@@ -0,0 +1,360 @@
+"""
+Background Telegram notifier with rate limiting and digest mode.
+
+Orders are queued by the request thread and sent by one worker thread per
+process. Orders arriving within TELEGRAM_DIGEST_WINDOW seconds of each other
+are coalesced into a single digest message per chat, so a flash sale produces
+a handful of messages instead of one per order.
+
+Sends go through a global token bucket (Telegram allows ~30 msg/s per bot)
+and a per-chat bucket (~1 msg/s per chat, ~20 msg/min for groups). A 429
+response pauses the chat for the ``retry_after`` Telegram asks for and the
+message is retried instead of being dropped.
+"""
+import html
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import defaultdict
+
+import requests
+
+import telegram
+from monitoring.metrics import notifications_delivered
+from monitoring.tracing import TRACER, current_context
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Classic token bucket: ``rate`` tokens per second, bursts up to ``capacity``"""
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._clock = clock
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    def delay(self):
+        """Seconds until a token is available (0 if one is available now)"""
+        with self._lock:
+            now = self._clock()
+            self._refill(now)
+            wait = max(0.0, self._blocked_until - now)
+            if self._tokens < 1:
+                wait = max(wait, (1 - self._tokens) / self.rate)
+            return wait
+
+    def consume(self):
+        """Take a token; the caller is expected to have waited for delay()"""
+        with self._lock:
+            self._refill(self._clock())
+            self._tokens -= 1
+
+    def block(self, seconds):
+        """Stop handing out tokens for ``seconds`` (server told us to back off)"""
+        with self._lock:
+            now = self._clock()
+            self._blocked_until = max(self._blocked_until, now + seconds)
+            self._tokens = 0
+            self._updated = now
+
+
+def format_money(value):
+    return f"{float(value or 0):.2f}"
+
+
+def format_order(order):
+    """Full message for a single order"""
+    from tabulate import tabulate
+
+    table_data = []
+    for item in order['items']:
+        subtotal = float(item['price']) * int(item['quantity'])
+        table_data.append([item['name'], item['price'], item['quantity'], format_money(subtotal)])
+
+    table_data.append(['SHIPPING', '', '', order['totals'].get('shipping', 0)])
+    table_data.append(['───────────────', '────────', '────────', '──────────'])
+    table_data.append(['TOTAL', '', '', order['totals'].get('total', 0)])
+
+    items_table = tabulate(table_data, headers=['Name', 'Price', 'Quantity', 'Subtotal'])
+
+    return f"""<strong>🛒 NEW ORDER: {html.escape(order['order_number'])}</strong>
+<strong>Customer Name: {html.escape(order['name'])}</strong>
+<strong>Email: {html.escape(order['email'])}</strong>
+<strong>Phone: {html.escape(order['phone'])}</strong>
+<strong>Address: {html.escape(order['address'])}</strong>
+<pre>{html.escape(items_table)}</pre>
+<strong>Status: PENDING APPROVAL</strong>
+"""
+
+
+def format_digest(orders):
+    """One compact message summarising several orders"""
+    total = sum(float(order['totals'].get('total', 0) or 0) for order in orders)
+    lines = [f"<strong>🛒 {len(orders)} NEW ORDERS (${format_money(total)})</strong>"]
+    for order in orders:
+        units = sum(int(item['quantity']) for item in order['items'])
+        lines.append(
+            f"• <strong>{html.escape(order['order_number'])}</strong> "
+            f"{html.escape(order['name'])}: {units} item(s), "
+            f"${format_money(order['totals'].get('total'))}"
+        )
+    lines.append("<strong>Status: PENDING APPROVAL</strong>")
+    return '\n'.join(lines)
+
+
+# A tag, an entity, a run of plain text, or a stray < or &
+TOKEN = re.compile(r'<[^>]*>|&#?\w+;|[^<&]+|[<&]')
+
+
+def _track_tags(stack, token):
+    """Push or pop ``token`` on a stack of (name, opening tag) if it is a tag"""
+    if token.startswith('</') and token.endswith('>'):
+        name = token[2:-1].strip().lower()
+        if stack and stack[-1][0] == name:
+            stack.pop()
+    elif token.startswith('<') and token.endswith('>') and len(token) > 2 and not token.endswith('/>'):
+        stack.append((token[1:-1].split()[0].lower(), token))
+
+
+def _closing(stack):
+    return ''.join(f'</{name}>' for name, _ in reversed(stack))
+
+
+def split_message(text, limit=telegram.MAX_MESSAGE_LENGTH):
+    """Split so each chunk fits Telegram's length limit, on line boundaries where possible
+
+    Telegram rejects a chunk whose HTML doesn't parse, so tags still open at a
+    cut (a long <pre> items table) are closed there and reopened in the next
+    chunk. Tags and entities are never cut.
+    """
+    chunks = []
+    stack = []  # tags open at the end of ``current``
+    current, fresh = '', True  # fresh: nothing yet but reopened tags
+
+    def flush():
+        nonlocal current, fresh
+        chunks.append(current + _closing(stack))
+        current, fresh = ''.join(tag for _, tag in stack), True
+
+    for line in text.split('\n'):
+        tokens = TOKEN.findall(line)
+        after = list(stack)
+        for token in tokens:
+            _track_tags(after, token)
+
+        # The whole line, in this chunk or else the next
+        piece = line if fresh else '\n' + line
+        if not fresh and len(current) + len(piece) + len(_closing(after)) > limit:
+            flush()
+            piece = line
+        if len(current) + len(piece) + len(_closing(after)) <= limit:
+            current += piece
+            stack[:] = after
+            fresh = fresh and not piece
+            continue
+
+        # Too long for a chunk of its own: cut it between tokens, or inside plain text
+        for token in tokens:
+            while True:
+                tentative = list(stack)
+                _track_tags(tentative, token)
+                room = limit - len(current) - len(_closing(tentative))
+                if len(token) <= room or fresh and (token[0] in '<&' or room <= 0):
+                    current += token
+                    stack[:] = tentative
+                    fresh = False
+                    break
+                if token[0] not in '<&' and room > 0:
+                    current += token[:room]
+                    token = token[room:]
+                    fresh = False
+                flush()
+    if not fresh:
+        chunks.append(current + _closing(stack))
+    return chunks
+
+
+class TelegramNotifier:
+    """Queues notifications and delivers them from a background thread"""
+
+    def __init__(self, routes=None, default_chat_id=None, digest_window=5.0,
+                 max_digest_size=50, global_rate=25, chat_rate=1.0, chat_burst=3,
+                 max_retries=5, send=None, bot_token=None, enabled=True):
+        self.enabled = enabled
+        self.bot_token = bot_token
+        self.routes = routes or {}
+        self.default_chat_id = default_chat_id
+        self.digest_window = digest_window
+        self.max_digest_size = max_digest_size
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self._send = send or self._send_http
+
+        self._global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets = {}
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._http = None
+        self.sent = 0
+        self.failed = 0
+
+    @classmethod
+    def from_config(cls, config):
+        bot_token = config.get('TELEGRAM_BOT_TOKEN') or telegram.token
+        if not bot_token:
+            logger.info('TELEGRAM_BOT_TOKEN is not set; Telegram notifications are disabled')
+        return cls(
+            bot_token=bot_token,
+            enabled=bool(bot_token),
+            routes=config.get('TELEGRAM_CHAT_ROUTES'),
+            default_chat_id=config.get('TELEGRAM_DEFAULT_CHAT_ID'),
+            digest_window=config.get('TELEGRAM_DIGEST_WINDOW', 5.0),
+            max_digest_size=config.get('TELEGRAM_MAX_DIGEST_SIZE', 50),
+            global_rate=config.get('TELEGRAM_GLOBAL_RATE', 25),
+            chat_rate=config.get('TELEGRAM_CHAT_RATE', 1.0),
+            chat_burst=config.get('TELEGRAM_CHAT_BURST', 3),
+        )
+
+    # ------------------------------------------------------------------
+    # Producer side (request threads)
+    # ------------------------------------------------------------------
+
+    def chats_for(self, event):
+        chats = self.routes.get(event)
+        if chats is None:
+            chats = [self.default_chat_id] if self.default_chat_id else []
+        return [str(chat) for chat in chats]
+
+    def notify_order(self, order, event='new_order'):
+        """Queue an order for delivery; never blocks the caller"""
+        if not self.enabled:
+            return
+        self._ensure_worker()
+        # Carry the trace so delivery shows up under the request that queued it
+        self._queue.put((event, order, current_context(), time.time()))
+
+    def pending(self):
+        """Number of notifications waiting to be sent"""
+        return self._queue.qsize()
+
+    def flush(self, timeout=10):
+        """Block until queued notifications are sent (used at shutdown and in tests)"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return self._queue.unfinished_tasks == 0
+
+    def _ensure_worker(self):
+        # Threads don't survive fork, so check the pid as well
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._http = requests.Session()
+                self._thread = threading.Thread(target=self._run, name='telegram-notifier', daemon=True)
+                self._thread.start()
+
+    # ------------------------------------------------------------------
+    # Worker side
+    # ------------------------------------------------------------------
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.digest_window
+            while len(batch) < self.max_digest_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            try:
+                self._deliver(batch)
+            except Exception:
+                logger.exception('Telegram notifier failed to deliver batch')
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _deliver(self, batch):
+        per_chat = defaultdict(list)
+        for event, order, trace, queued_at in batch:
+            for chat_id in self.chats_for(event):
+                per_chat[chat_id].append((order, trace, queued_at))
+
+        for chat_id, entries in per_chat.items():
+            orders = [order for order, _, _ in entries]
+            traces = [trace for _, trace, _ in entries]
+            # A digest continues the first order's trace and links the rest
+            with TRACER.span('telegram.deliver', kind='consumer', parent=traces[0], links=traces[1:],
+                             attributes={'telegram.chat_id': chat_id, 'telegram.orders': len(orders),
+                                         'queue.wait_ms': round((time.time() - entries[0][2]) * 1000, 1)}):
+                text = format_order(orders[0]) if len(orders) == 1 else format_digest(orders)
+                for chunk in split_message(text):
+                    self._send_with_retry(chat_id, chunk)
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _send_with_retry(self, chat_id, text):
+        chat_bucket = self._chat_bucket(chat_id)
+        backoff = 1.0
+
+        for attempt in range(self.max_retries + 1):
+            wait = max(self._global_bucket.delay(), chat_bucket.delay())
+            if wait:
+                time.sleep(wait)
+            self._global_bucket.consume()
+            chat_bucket.consume()
+
+            try:
+                self._send(chat_id, text)
+                self.sent += 1
+                notifications_delivered.inc('telegram', 'sent')
+                return True
+            except telegram.TelegramError as e:
+                if e.status_code == 429:
+                    logger.warning('Telegram rate limited chat %s, retrying after %ss', chat_id, e.retry_after)
+                    chat_bucket.block(e.retry_after or backoff)
+                    continue
+                if e.status_code and e.status_code < 500:
+                    # Bad chat id, bad markup, etc. Retrying won't help.
+                    logger.error('Telegram rejected message for chat %s: %s', chat_id, e)
+                    break
+                logger.warning('Telegram error for chat %s: %s', chat_id, e)
+            except requests.RequestException as e:
+                logger.warning('Telegram request failed for chat %s: %s', chat_id, e)
+
+            chat_bucket.block(backoff)
+            backoff = min(backoff * 2, 60)
+
+        self.failed += 1
+        notifications_delivered.inc('telegram', 'failed')
+        logger.error('Dropping Telegram message for chat %s after %d attempts', chat_id, attempt + 1)
+        return False
+
+    def _send_http(self, chat_id, text):
+        return telegram.sendMessage(chat_id, text, http=self._http, bot_token=self.bot_token)
@@ -0,0 +1,163 @@
+"""
+Customer order history and guest order tracking.
+
+A customer's orders are read a page at a time with keyset pagination on
+(created_at, id), newest first. The cursor is the last row of the previous
+page, so every page is one range scan on ix_orders_user_created, however
+far back it is. Orders that have been archived (archive.py) continue the
+same sequence from archived_orders. Each page merges the next rows of both
+tables.
+
+Guests track an order by its number plus the email it was placed with
+(ix_orders_tracking). A successful lookup is remembered in the session,
+so the order page can then be reloaded like a customer's own.
+
+Both pages answer conditional GETs. The ETag is derived from the
+(id, updated_at) of the orders shown. It is computed from the indexes
+alone, before any order, item or template is loaded. A customer refreshing
+while waiting for shipment gets 304s until something about the order
+actually changes.
+"""
+import hashlib
+from datetime import datetime, timezone
+
+from flask import request, session
+from sqlalchemy import func, select, tuple_
+
+from models import db
+from models.order import ArchivedOrder, Order, OrderItem
+
+PAGE_SIZE = 10
+TRACKED_LIMIT = 10  # order numbers a guest session remembers
+
+orders = Order.__table__
+order_items = OrderItem.__table__
+archived = ArchivedOrder.__table__
+
+
+def encode_cursor(created_at, order_id):
+    return f'{created_at:%Y%m%d%H%M%S%f}-{order_id}'
+
+
+def decode_cursor(value):
+    """(created_at, id) from a cursor, or None if it isn't one"""
+    try:
+        stamp, order_id = value.split('-')
+        return datetime.strptime(stamp, '%Y%m%d%H%M%S%f'), int(order_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def _keyset(table, changed, user_id, before, limit):
+    query = (select(table.c.created_at, table.c.id, changed)
+             .where(table.c.user_id == user_id)
+             .order_by(table.c.created_at.desc(), table.c.id.desc())
+             .limit(limit))
+    if before is not None:
+        query = query.where(tuple_(table.c.created_at, table.c.id) < tuple_(*before))
+    return query
+
+
+def history_page(user_id, before=None, limit=PAGE_SIZE):
+    """One page of a user's orders, newest first: ([(created_at, id, updated_at, archived)], next_cursor)
+
+    ``before`` is a decoded cursor. Only indexes are read.
+    """
+    rows = [(*row, False) for row in db.session.execute(
+        _keyset(orders, orders.c.updated_at, user_id, before, limit + 1))]
+    rows += [(*row, True) for row in db.session.execute(
+        _keyset(archived, archived.c.archived_at, user_id, before, limit + 1))]
+    rows.sort(key=lambda row: (row[0], row[1]), reverse=True)
+
+    page = rows[:limit]
+    next_cursor = encode_cursor(page[-1][0], page[-1][1]) if len(rows) > limit else None
+    return page, next_cursor
+
+
+def load_page(page):
+    """The orders for a history_page() as [(order, item_count, archived)], in page order
+
+    Live orders get their item counts from one grouped query; archived
+    orders store theirs.
+    """
+    live_ids = [order_id for _, order_id, _, is_archived in page if not is_archived]
+    archived_ids = [order_id for _, order_id, _, is_archived in page if is_archived]
+    loaded = {}
+    if live_ids:
+        counts = dict(db.session.execute(
+            select(order_items.c.order_id, func.count())
+            .where(order_items.c.order_id.in_(live_ids))
+            .group_by(order_items.c.order_id)
+        ).all())
+        for order in Order.query.filter(Order.id.in_(live_ids)):
+            loaded[(order.id, False)] = (order, counts.get(order.id, 0), False)
+    if archived_ids:
+        created = [created_at for created_at, _, _, is_archived in page if is_archived]
+        # Bounded by created_at as well, so PostgreSQL skips unrelated partitions
+        for order in ArchivedOrder.query.filter(ArchivedOrder.id.in_(archived_ids),
+                                                ArchivedOrder.created_at >= min(created),
+                                                ArchivedOrder.created_at <= max(created)):
+            loaded[(order.id, True)] = (order, order.item_count, True)
+    return [loaded[(order_id, is_archived)]
+            for _, order_id, _, is_archived in page if (order_id, is_archived) in loaded]
+
+
+def order_version(order_number):
+    """(id, user_id, email, updated_at, archived) of an order by number, or None"""
+    row = db.session.execute(
+        select(orders.c.id, orders.c.user_id, orders.c.customer_email, orders.c.updated_at)
+        .where(orders.c.order_number == order_number)
+    ).first()
+    if row is not None:
+        return (*row, False)
+    row = db.session.execute(
+        select(archived.c.id, archived.c.user_id, archived.c.customer_email, archived.c.archived_at)
+        .where(archived.c.order_number == order_number)
+    ).first()
+    return (*row, True) if row is not None else None
+
+
+def find_tracked_order(order_number, email):
+    """Whether an order with this number was placed with this email (case-insensitive)"""
+    email = email.strip().lower()
+    for table in (orders, archived):
+        found = db.session.execute(
+            select(table.c.customer_email).where(table.c.order_number == order_number)
+        ).scalar()
+        if found is not None:
+            return found.strip().lower() == email
+    return False
+
+
+def remember_tracked(order_number):
+    tracked = [number for number in session.get('tracked_orders', []) if number != order_number]
+    session['tracked_orders'] = ([order_number] + tracked)[:TRACKED_LIMIT]
+
+
+def can_view(order_user_id, order_number):
+    """The order's customer, or a session that tracked it by number + email"""
+    user_id = session.get('user_id')
+    return (user_id is not None and user_id == order_user_id) or order_number in session.get('tracked_orders', [])
+
+
+def etag_for(*parts):
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def not_modified(etag, last_modified=None):
+    """True if the request already has this version (If-None-Match, else If-Modified-Since)"""
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since and last_modified is not None:
+        return last_modified.replace(microsecond=0, tzinfo=timezone.utc) <= request.if_modified_since
+    return False
+
+
+def with_validators(response, etag, last_modified=None):
+    """Mark a response private and always revalidated, with its validators"""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified.replace(tzinfo=timezone.utc)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,203 @@
+"""
+Time-ordered, collision-free order number generation.
+
+Order numbers are Snowflake-style 63-bit integers rendered in Crockford
+base32 so they stay short and readable over the phone:
+
+    | 41 bits: ms since EPOCH | 10 bits: worker id | 12 bits: sequence |
+
+Every process must own a distinct worker id for numbers to be unique across
+gunicorn workers and nodes. A worker id is a node's block of 32 ids
+(NODE_ID, 0-31) plus a slot inside it:
+
+- A process owns a slot by holding a lock on its file in ORDER_ID_SLOT_DIR.
+  The lock goes away with the process, and it is the only record of which
+  slots are taken, so gunicorn workers, CLI commands, scripts and a second
+  master during a USR2 upgrade can never share one.
+- gunicorn.conf.py suggests a slot to each worker (the one its predecessor
+  gave back); the worker locks it, or the first free one if another process
+  holds it, and sets ORDER_ID_WORKER_ID from it.
+- Any other process locks the first free slot on first use.
+
+NODE_ID may be left unset only when NODE_COUNT is 1 (the default); with
+more nodes a missing NODE_ID is an error rather than a guess.
+"""
+import os
+import tempfile
+import threading
+import time
+
+# 2025-01-01T00:00:00Z in milliseconds; 41 bits lasts until ~2094
+EPOCH = 1735689600000
+
+WORKER_ID_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_ID_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+SLOTS_PER_NODE = 32
+MAX_NODE_ID = (MAX_WORKER_ID + 1) // SLOTS_PER_NODE - 1
+
+# Crockford base32: no I, L, O or U, so numbers can't be misread
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+# 63 bits always fit in 13 base32 digits; fixed width keeps string order == time order
+ENCODED_LENGTH = 13
+
+
+def node_id():
+    """This node's NODE_ID; required once NODE_COUNT says there is more than one node"""
+    value = os.environ.get('NODE_ID')
+    if value is None:
+        if int(os.environ.get('NODE_COUNT', 1)) > 1:
+            raise RuntimeError('NODE_ID must be set on every node when NODE_COUNT is more than 1')
+        return 0
+    node = int(value)
+    if not 0 <= node <= MAX_NODE_ID:
+        raise ValueError(f'NODE_ID must be between 0 and {MAX_NODE_ID}')
+    return node
+
+
+def worker_id_for(slot):
+    """The worker id of a slot on this node"""
+    if not 0 <= slot < SLOTS_PER_NODE:
+        raise ValueError(f'Worker slot must be between 0 and {SLOTS_PER_NODE - 1}')
+    return node_id() * SLOTS_PER_NODE + slot
+
+
+_slot_lock = None
+
+
+def lock_slot(preferred=None):
+    """Claim ``preferred``, or else the first slot no other process on this host holds
+
+    Returns the slot; the lock lasts as long as the process.
+    """
+    import fcntl
+    global _slot_lock
+
+    directory = os.environ.get('ORDER_ID_SLOT_DIR') or os.path.join(tempfile.gettempdir(), 'flaskmart-order-ids')
+    os.makedirs(directory, exist_ok=True)
+    candidates = list(range(SLOTS_PER_NODE))
+    if preferred is not None:
+        candidates.remove(preferred)
+        candidates.insert(0, preferred)
+    for slot in candidates:
+        handle = open(os.path.join(directory, f'slot-{slot}.lock'), 'w')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            continue
+        _slot_lock = handle
+        return slot
+    raise RuntimeError(f'All {SLOTS_PER_NODE} order id slots on this node are taken')
+
+
+def default_worker_id():
+    """Resolve the worker id from ORDER_ID_WORKER_ID, else claim a free slot on this node"""
+    value = os.environ.get('ORDER_ID_WORKER_ID')
+    if value is not None:
+        worker_id = int(value)
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f'ORDER_ID_WORKER_ID must be between 0 and {MAX_WORKER_ID}')
+        return worker_id
+    return worker_id_for(lock_slot())
+
+
+def encode(value):
+    """Encode a non-negative integer as fixed-width Crockford base32"""
+    chars = []
+    for _ in range(ENCODED_LENGTH):
+        value, remainder = divmod(value, 32)
+        chars.append(ALPHABET[remainder])
+    return ''.join(reversed(chars))
+
+
+def decode(text):
+    """Decode a Crockford base32 string back to an integer"""
+    value = 0
+    for char in text.upper():
+        value = value * 32 + ALPHABET.index(char)
+    return value
+
+
+class OrderIdGenerator:
+    """Thread-safe Snowflake-style id generator for one worker"""
+
+    def __init__(self, worker_id=None, clock=None):
+        if worker_id is None:
+            worker_id = default_worker_id()
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f'worker_id must be between 0 and {MAX_WORKER_ID}')
+
+        self.worker_id = worker_id
+        self._clock = clock or (lambda: int(time.time() * 1000))
+        self._lock = threading.Lock()
+        self._last_timestamp = -1
+        self._sequence = 0
+
+    def _wait_next_millis(self, last_timestamp):
+        timestamp = self._clock()
+        while timestamp <= last_timestamp:
+            time.sleep(0.0001)
+            timestamp = self._clock()
+        return timestamp
+
+    def next_id(self):
+        """Return the next unique integer id"""
+        with self._lock:
+            timestamp = self._clock()
+
+            # Never go backwards: if the wall clock was stepped back (NTP),
+            # keep issuing from the last timestamp we used.
+            if timestamp < self._last_timestamp:
+                timestamp = self._last_timestamp
+
+            if timestamp == self._last_timestamp:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    # 4096 ids issued this millisecond, roll into the next one
+                    timestamp = self._wait_next_millis(self._last_timestamp)
+            else:
+                self._sequence = 0
+
+            self._last_timestamp = timestamp
+
+            return ((timestamp - EPOCH) << (WORKER_ID_BITS + SEQUENCE_BITS)) \
+                | (self.worker_id << SEQUENCE_BITS) \
+                | self._sequence
+
+    def next_code(self, prefix='ORD'):
+        """Return the next id as a human-friendly string, e.g. ORD-01JBX5Q2M40G0"""
+        return f"{prefix}-{encode(self.next_id())}"
+
+
+def parse(code):
+    """Split an encoded order number into (timestamp_ms, worker_id, sequence)"""
+    value = decode(code.rsplit('-', 1)[-1])
+    sequence = value & MAX_SEQUENCE
+    worker_id = (value >> SEQUENCE_BITS) & MAX_WORKER_ID
+    timestamp = (value >> (WORKER_ID_BITS + SEQUENCE_BITS)) + EPOCH
+    return timestamp, worker_id, sequence
+
+
+_generator = None
+_generator_pid = None
+_generator_lock = threading.Lock()
+
+
+def get_generator():
+    """Return the process-wide generator, recreating it after a fork"""
+    global _generator, _generator_pid
+
+    pid = os.getpid()
+    if _generator is None or _generator_pid != pid:
+        with _generator_lock:
+            if _generator is None or _generator_pid != pid:
+                _generator = OrderIdGenerator()
+                _generator_pid = pid
+    return _generator
+
+
+def new_order_number(prefix='ORD'):
+    """Generate a new order number for this process"""
+    return get_generator().next_code(prefix)
@@ -0,0 +1,274 @@
+"""
+Payment gateway webhooks.
+
+Gateways retry a callback that isn't answered quickly, so a slow handler
+gets the same event again and again. The callback therefore does only two
+things. It checks the signature and stores the raw body in
+``payment_events``. Then it answers. Everything else happens in a worker.
+
+Each event has a key: the gateway's event id, or payment id + status when
+there is none. A unique index on (gateway, event_key) makes storing an
+event an INSERT ... ON CONFLICT DO NOTHING, so redeliveries cost one index
+probe and are never processed twice.
+
+One worker thread per process applies stored events, oldest first. It is
+woken by each new event and otherwise polls every PAYMENT_EVENTS_INTERVAL
+seconds. ``flask payments-process`` drains the queue too, e.g. from cron
+or after a crash. Each event is applied in its own transaction. On
+PostgreSQL the worker claims it with FOR UPDATE SKIP LOCKED, so workers in
+several processes share the queue.
+
+Applying a status is idempotent. A status may only replace the ones listed
+in REPLACES, with a conditional UPDATE on the payment and then on its
+order's payment_status. A replay, or an event that arrives after a later
+one, matches no rows and changes nothing.
+
+Failed events are retried with exponential backoff (retry_at). An event
+for a payment that isn't in ``payments`` yet is retried for
+PAYMENT_EVENTS_UNKNOWN_PAYMENT_HOURS; the callback can beat initiate's
+commit. Other failures are retried PAYMENT_EVENTS_MAX_ATTEMPTS times. An
+unknown status can't succeed later, so it is set aside at once.
+Set-aside events keep their payload and error.
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, or_, select, update
+
+from models import db, upsert_insert
+from models.order import Order
+from models.payment import Payment, PaymentEvent
+from monitoring.tracing import TRACER, SpanContext, current_context
+
+logger = logging.getLogger(__name__)
+
+# Gateway statuses -> Payment.status / Order.payment_status
+STATUSES = {
+    'pending': 'pending',
+    'paid': 'paid', 'completed': 'paid', 'success': 'paid', 'succeeded': 'paid',
+    'failed': 'failed', 'cancelled': 'failed', 'expired': 'failed',
+    'refunded': 'refunded',
+}
+
+MAX_RETRY_DELAY = 600  # seconds
+
+# The statuses each status may replace; pending replaces nothing
+REPLACES = {
+    'paid': ('pending', 'failed'),
+    'failed': ('pending',),
+    'refunded': ('paid',),
+}
+
+
+class UnknownPayment(LookupError):
+    """No stored payment matches a gateway event (yet)"""
+
+
+payments = Payment.__table__
+events = PaymentEvent.__table__
+orders = Order.__table__
+
+
+def event_key(data):
+    """The deduplication key of a webhook payload"""
+    key = data.get('event_id') or f"{data.get('payment_id')}:{data.get('status')}"
+    return str(key)[:150]
+
+
+def record_event(gateway, data, raw):
+    """Store a verified webhook delivery and commit; returns False for a redelivery"""
+    payment_id = data.get('payment_id')
+    if not payment_id:
+        raise ValueError('Callback has no payment_id')
+
+    context = current_context()
+    statement = upsert_insert(events).values(
+        gateway=gateway, event_key=event_key(data), payment_id=str(payment_id)[:100],
+        status=str(data.get('status'))[:50] if data.get('status') is not None else None,
+        payload=raw, traceparent=context.traceparent() if context else None,
+        received_at=datetime.utcnow(), attempts=0,
+    )
+    result = db.session.execute(statement.on_conflict_do_nothing(index_elements=['gateway', 'event_key']))
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def apply_status(gateway, payment_id, gateway_status):
+    """Move a payment, and the order it pays for, to a gateway status (not committed)
+
+    Returns the new status, or None if the status is not newer than the
+    current one. Raises ValueError for a status this module doesn't know
+    and UnknownPayment if there is no such payment.
+    """
+    status = STATUSES.get(str(gateway_status).lower())
+    if status is None:
+        raise ValueError(f'Unknown payment status {gateway_status!r}')
+    if status not in REPLACES:
+        return None if _payment_exists(gateway, payment_id) else _unknown(gateway, payment_id)
+
+    now = datetime.utcnow()
+    row = db.session.execute(
+        update(payments)
+        .where(payments.c.gateway == gateway, payments.c.payment_id == payment_id,
+               payments.c.status.in_(REPLACES[status]))
+        .values(status=status, updated_at=now)
+        .returning(payments.c.order_id)
+    ).first()
+    if row is None:
+        return None if _payment_exists(gateway, payment_id) else _unknown(gateway, payment_id)
+    if row.order_id is not None:
+        db.session.execute(
+            update(orders)
+            .where(orders.c.id == row.order_id, orders.c.payment_status.in_(REPLACES[status]))
+            .values(payment_status=status, updated_at=now)
+        )
+    return status
+
+
+def _payment_exists(gateway, payment_id):
+    return db.session.execute(
+        select(payments.c.id).where(payments.c.gateway == gateway, payments.c.payment_id == payment_id)
+    ).first() is not None
+
+
+def _unknown(gateway, payment_id):
+    raise UnknownPayment(f'No {gateway} payment {payment_id}')
+
+
+def _set_aside(error, attempts, received_at, max_attempts, now):
+    """Whether a failed event should stop being retried"""
+    if isinstance(error, UnknownPayment):
+        window = timedelta(hours=current_app.config['PAYMENT_EVENTS_UNKNOWN_PAYMENT_HOURS'])
+        return now - received_at >= window
+    # A status we don't know won't become known by retrying
+    return isinstance(error, ValueError) or attempts >= max_attempts
+
+
+def _process_one(skip, max_attempts):
+    """Claim and apply the oldest due event not in ``skip``; returns its id, or None if none are left"""
+    now = datetime.utcnow()
+    event = db.session.execute(
+        select(events.c.id, events.c.gateway, events.c.payment_id, events.c.status,
+               events.c.traceparent, events.c.attempts, events.c.received_at)
+        .where(events.c.processed_at.is_(None), events.c.id.notin_(skip),
+               or_(events.c.retry_at.is_(None), events.c.retry_at <= now))
+        .order_by(events.c.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).first()
+    if event is None:
+        db.session.rollback()
+        return None
+
+    payment_trace = db.session.execute(
+        select(payments.c.traceparent)
+        .where(payments.c.gateway == event.gateway, payments.c.payment_id == event.payment_id)
+    ).scalar()
+    # Continues the delivery's trace and links the one that started the payment
+    with TRACER.span('payment_event.apply', kind='consumer', parent=SpanContext.from_traceparent(event.traceparent),
+                     links=[SpanContext.from_traceparent(payment_trace)],
+                     attributes={'payment.id': event.payment_id, 'payment.status': event.status}) as span:
+        try:
+            status = apply_status(event.gateway, event.payment_id, event.status)
+            db.session.execute(
+                update(events).where(events.c.id == event.id)
+                .values(processed_at=datetime.utcnow(), attempts=event.attempts + 1))
+            db.session.commit()
+            span.set_attribute('payment.changed', status is not None)
+            if status is not None:
+                logger.info('Payment status updated', extra={'payment_id': event.payment_id, 'status': status})
+        except Exception as e:
+            db.session.rollback()
+            span.record_error(e)
+            attempts = event.attempts + 1
+            set_aside = _set_aside(e, attempts, event.received_at, max_attempts, now)
+            delay = min(current_app.config['PAYMENT_EVENTS_INTERVAL'] * 2 ** attempts, MAX_RETRY_DELAY)
+            # The rollback released the row lock, so another worker may have
+            # applied the event since; never undo that
+            db.session.execute(
+                update(events).where(events.c.id == event.id, events.c.processed_at.is_(None))
+                .values(attempts=attempts, error=f'{type(e).__name__}: {e}',
+                        processed_at=now if set_aside else None,
+                        retry_at=None if set_aside else now + timedelta(seconds=delay)))
+            db.session.commit()
+            skip.add(event.id)
+            if set_aside:
+                logger.error('Payment event %s set aside after %d attempt(s): %s', event.id, attempts, e,
+                             exc_info=not isinstance(e, (ValueError, UnknownPayment)))
+            elif isinstance(e, UnknownPayment):
+                logger.warning('Payment event %s is for an unknown payment %s, retrying in %ds',
+                               event.id, event.payment_id, delay)
+            else:
+                logger.exception('Payment event %s failed (attempt %d of %d)', event.id, attempts, max_attempts)
+    return event.id
+
+
+def process_pending(max_attempts=None):
+    """Apply every pending event, oldest first; returns how many were applied
+
+    Events that fail are left for a later run, after their retry delay.
+    """
+    if max_attempts is None:
+        max_attempts = current_app.config['PAYMENT_EVENTS_MAX_ATTEMPTS']
+    skip = set()
+    processed = 0
+    while _process_one(skip, max_attempts) is not None:
+        processed += 1
+    return processed - len(skip)
+
+
+def pending_count():
+    """Events waiting to be applied (including ones being retried)"""
+    return db.session.execute(
+        select(func.count()).select_from(events).where(events.c.processed_at.is_(None))).scalar()
+
+
+class EventWorker:
+    """Applies stored events from a background thread, one per process"""
+
+    def __init__(self, app, interval=5.0):
+        self.app = app
+        self.interval = interval
+        self.processed = 0
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def notify(self):
+        """Wake the worker for a newly stored event; never blocks the caller"""
+        self._ensure_worker()
+        self._wake.set()
+
+    def _ensure_worker(self):
+        # Threads don't survive fork, so check the pid as well
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name='payment-events', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    self.processed += process_pending()
+            except Exception:
+                logger.exception('Payment event worker failed')
+
+
+def get_event_worker(app=None):
+    return (app or current_app).extensions['payment_events']
+
+
+def init_payment_events(app):
+    """Create the per-process payment event worker; its thread starts with the first event"""
+    app.extensions['payment_events'] = EventWorker(app, interval=app.config['PAYMENT_EVENTS_INTERVAL'])
+    return app.extensions['payment_events']
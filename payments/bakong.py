@@ -5,6 +5,9 @@ import json
 from datetime import datetime
 from flask import current_app
 
+from monitoring.metrics import track_outbound
+from monitoring.tracing import inject_headers
+
 
 
 
@@ -13,7 +16,7 @@ class BakongPayment:
         self.api_url = current_app.config['BAKONG_API_URL']
         self.merchant_id = current_app.config['BAKONG_MERCHANT_ID']
         self.api_key = current_app.config['BAKONG_API_KEY']
-        # self.secret_key = current_app.config['BAKONG_SECRET_KEY']
+        self.secret_key = current_app.config['BAKONG_SECRET_KEY']
 
     def generate_signature(self, data):
         """Generate HMAC signature for Bakong API"""
@@ -48,8 +51,9 @@ class BakongPayment:
         }
 
         try:
-            response = requests.post(endpoint, json=payload, headers=headers)
-            response.raise_for_status()
+            with track_outbound('bakong', 'create_payment'):
+                response = requests.post(endpoint, json=payload, headers=inject_headers(headers))
+                response.raise_for_status()
             return {
                 'success': True,
                 'data': response.json()
@@ -69,8 +73,9 @@ class BakongPayment:
         }
 
         try:
-            response = requests.get(endpoint, headers=headers)
-            response.raise_for_status()
+            with track_outbound('bakong', 'generate_qr_code'):
+                response = requests.get(endpoint, headers=inject_headers(headers))
+                response.raise_for_status()
             return {
                 'success': True,
                 'qr_code': response.json().get('qr_code')
@@ -95,8 +100,9 @@ class BakongPayment:
         }
 
         try:
-            response = requests.get(endpoint, headers=headers)
-            response.raise_for_status()
+            with track_outbound('bakong', 'check_payment_status'):
+                response = requests.get(endpoint, headers=inject_headers(headers))
+                response.raise_for_status()
             return {
                 'success': True,
                 'data': response.json()
@@ -110,5 +116,5 @@ class BakongPayment:
     @staticmethod
     def generate_order_id():
         """Generate unique orders ID"""
-        import uuid
-        return f"BKG-{uuid.uuid4().hex[:12].upper()}"
\ No newline at end of file
+        from order_ids import new_order_number
+        return new_order_number('BKG')
\ No newline at end of file
@@ -0,0 +1,205 @@
+"""
+"Frequently bought together" recommendations.
+
+An offline job turns order_items into a sparse product co-occurrence
+matrix, stored as ``product_pairs`` (each pair once, product_id <=
+related_id, the diagonal holding how many orders contain the product). The
+matrix is computed by the database in one self-join over distinct (order,
+product) baskets, then each product's neighbours are scored:
+
+    cosine  n(a,b) / sqrt(n(a) * n(b))     favours pairs bought together often
+    lift    n(a,b) * N / (n(a) * n(b))     favours pairs more likely than chance
+
+and the best K are written to ``product_recommendations`` keyed by
+(product_id, rank), so serving a product page or a cart is one indexed
+lookup. Pairs seen in fewer than ``min_support`` orders are ignored;
+otherwise lift ranks one-off pairs between rare products first.
+
+``flask recommendations-build`` is incremental: orders after the last run's
+watermark are added into the pair counts and only the products they contain,
+and those products' neighbours, are re-scored (lift scores elsewhere keep
+the previous order total until the next full build). ``--full`` rebuilds everything, which also drops orders that
+were cancelled or rejected after being counted; run it nightly and the
+incremental build every few minutes. Full builds only see orders still in
+the live tables, not archived ones (archive.py).
+"""
+import heapq
+import math
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import and_, delete, func, insert, or_, select
+
+from models import db, upsert_insert
+from models.order import Order, OrderItem
+from models.product import Product
+from models.recommendation import ProductPair, ProductRecommendation, RecommendationRun
+
+METRICS = ('cosine', 'lift')
+EXCLUDED_STATUSES = ('cancelled', 'rejected')
+CHUNK = 500
+
+orders = Order.__table__
+order_items = OrderItem.__table__
+pairs = ProductPair.__table__
+recommendations = ProductRecommendation.__table__
+
+
+def _baskets(after, upto, name):
+    """Distinct (order_id, product_id) for counted orders in (after, upto]"""
+    return (select(order_items.c.order_id, order_items.c.product_id)
+            .select_from(order_items.join(orders, orders.c.id == order_items.c.order_id))
+            .where(order_items.c.order_id > after, order_items.c.order_id <= upto,
+                   order_items.c.product_id.isnot(None), orders.c.status.notin_(EXCLUDED_STATUSES))
+            .distinct()
+            .subquery(name))
+
+
+def _pair_counts(after, upto):
+    """Co-occurrence counts for orders in (after, upto], diagonal included"""
+    a, b = _baskets(after, upto, 'a'), _baskets(after, upto, 'b')
+    return (select(a.c.product_id, b.c.product_id.label('related_id'), func.count().label('orders'))
+            .select_from(a.join(b, and_(a.c.order_id == b.c.order_id, a.c.product_id <= b.c.product_id)))
+            .group_by(a.c.product_id, b.c.product_id))
+
+
+def _order_count(after, upto):
+    baskets = _baskets(after, upto, 'baskets')
+    return db.session.execute(select(func.count(func.distinct(baskets.c.order_id)))).scalar() or 0
+
+
+def _add_pair_counts(rows):
+    statement = upsert_insert(pairs)
+    for start in range(0, len(rows), CHUNK):
+        statement_chunk = statement.values(rows[start:start + CHUNK])
+        db.session.execute(statement_chunk.on_conflict_do_update(
+            index_elements=['product_id', 'related_id'],
+            set_={'orders': pairs.c.orders + statement_chunk.excluded.orders},
+        ))
+
+
+def _score(metric, together, count_a, count_b, total):
+    if metric == 'lift':
+        return together * total / (count_a * count_b)
+    return together / math.sqrt(count_a * count_b)
+
+
+def _rescore(product_ids, total, k, metric, min_support):
+    """Replace the top-K lists of ``product_ids``; returns how many were scored"""
+    product_ids = sorted(product_ids)
+    for start in range(0, len(product_ids), CHUNK):
+        chunk = product_ids[start:start + CHUNK]
+        members = set(chunk)
+
+        counts, neighbours = {}, defaultdict(list)
+        for product_id, related_id, together in db.session.execute(
+            select(pairs.c.product_id, pairs.c.related_id, pairs.c.orders)
+            .where(or_(pairs.c.product_id.in_(chunk), pairs.c.related_id.in_(chunk)))
+        ):
+            if product_id == related_id:
+                counts[product_id] = together
+            elif together >= min_support:
+                if product_id in members:
+                    neighbours[product_id].append((related_id, together))
+                if related_id in members:
+                    neighbours[related_id].append((product_id, together))
+
+        # Order counts of neighbours outside the chunk
+        missing = sorted({related for items in neighbours.values() for related, _ in items} - set(counts))
+        for offset in range(0, len(missing), CHUNK):
+            ids = missing[offset:offset + CHUNK]
+            counts.update(db.session.execute(
+                select(pairs.c.product_id, pairs.c.orders)
+                .where(pairs.c.product_id.in_(ids), pairs.c.product_id == pairs.c.related_id)
+            ).all())
+
+        rows = []
+        for product_id, items in neighbours.items():
+            scored = ((_score(metric, together, counts[product_id], counts[related], total), together, related)
+                      for related, together in items)
+            for rank, (score, together, related) in enumerate(heapq.nlargest(k, scored), start=1):
+                rows.append({'product_id': product_id, 'rank': rank, 'related_id': related,
+                             'score': round(score, 6), 'orders': together})
+
+        db.session.execute(delete(recommendations).where(recommendations.c.product_id.in_(chunk)))
+        if rows:
+            db.session.execute(insert(recommendations), rows)
+    return len(product_ids)
+
+
+def build(full=False, k=10, metric='cosine', min_support=2):
+    """Build or update the recommendations; returns the RecommendationRun
+
+    The first run, a metric change and ``full=True`` rebuild from every
+    order; otherwise only orders placed since the last run are added.
+    """
+    if metric not in METRICS:
+        raise ValueError(f'Unknown metric {metric!r}; use one of {", ".join(METRICS)}')
+
+    last = RecommendationRun.query.filter(RecommendationRun.finished_at.isnot(None)) \
+        .order_by(RecommendationRun.id.desc()).first()
+    if last is None or last.metric != metric:
+        full = True
+    after = 0 if full else last.last_order_id
+    upto = db.session.execute(select(func.max(orders.c.id))).scalar() or 0
+
+    run = RecommendationRun(kind='full' if full else 'incremental', metric=metric, last_order_id=upto)
+    new_orders = _order_count(after, upto) if upto > after else 0
+    run.new_orders = new_orders
+    run.total_orders = new_orders if full else last.total_orders + new_orders
+
+    if full:
+        db.session.execute(delete(pairs))
+        db.session.execute(insert(pairs).from_select(['product_id', 'related_id', 'orders'], _pair_counts(0, upto)))
+        affected = db.session.execute(
+            select(pairs.c.product_id).where(pairs.c.product_id == pairs.c.related_id)).scalars().all()
+        db.session.execute(delete(recommendations))
+    elif new_orders:
+        counts = [dict(row._mapping) for row in db.session.execute(_pair_counts(after, upto))]
+        _add_pair_counts(counts)
+        touched = sorted({row['product_id'] for row in counts})
+        # Their neighbours' scores moved too, since n(product) is in the denominator
+        affected = set(touched)
+        for start in range(0, len(touched), CHUNK):
+            ids = touched[start:start + CHUNK]
+            for product_id, related_id in db.session.execute(
+                select(pairs.c.product_id, pairs.c.related_id)
+                .where(or_(pairs.c.product_id.in_(ids), pairs.c.related_id.in_(ids)))
+            ):
+                affected.update((product_id, related_id))
+    else:
+        affected = []
+
+    run.products_scored = _rescore(affected, run.total_orders, k, metric, min_support)
+    run.finished_at = datetime.utcnow()
+    db.session.add(run)
+    db.session.commit()
+    return run
+
+
+def recommended_products(product_id, limit=4):
+    """Active products most often bought with ``product_id``, best first"""
+    return (Product.query
+            .join(ProductRecommendation, ProductRecommendation.related_id == Product.id)
+            .filter(ProductRecommendation.product_id == product_id, Product.is_active.is_(True))
+            .order_by(ProductRecommendation.rank)
+            .limit(limit)
+            .all())
+
+
+def recommended_for_cart(product_ids, limit=4):
+    """Active products most often bought with anything in the cart, excluding the cart itself"""
+    product_ids = list(product_ids)[:CHUNK]
+    if not product_ids:
+        return []
+    score = func.sum(recommendations.c.score)
+    ranked = db.session.execute(
+        select(recommendations.c.related_id, score)
+        .where(recommendations.c.product_id.in_(product_ids), recommendations.c.related_id.notin_(product_ids))
+        .group_by(recommendations.c.related_id)
+        .order_by(score.desc(), recommendations.c.related_id)
+        .limit(limit * 2)  # head room for inactive products
+    ).scalars().all()
+    by_id = {product.id: product for product in
+             Product.query.filter(Product.id.in_(ranked), Product.is_active.is_(True)).all()}
+    return [by_id[product_id] for product_id in ranked if product_id in by_id][:limit]
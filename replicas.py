@@ -0,0 +1,200 @@
+"""
+Read-replica routing for read-only views.
+
+Views decorated with ``@replica_reads`` send their queries to one of the
+engines in SQLALCHEMY_REPLICA_URIS, picked round-robin among replicas that
+passed their last health check. Everything else, including any flush inside
+a read-only view, goes to the primary.
+
+Read-your-writes: when a request writes to the primary, the time is stored in
+the user's session cookie, and that user's reads stay on the primary for
+REPLICA_READ_YOUR_WRITES_SECONDS afterwards so they never see replica lag on
+their own changes.
+
+Replicas are health-checked with ``SELECT 1`` at most every
+REPLICA_HEALTH_CHECK_INTERVAL seconds, and marked down immediately when a
+query on them hits a disconnect. Replicas that are down are re-checked in
+the background. With no healthy replica, reads fall back to the primary.
+"""
+import itertools
+import logging
+import threading
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event, text
+
+from connection_budget import build_engine_options, init_connection_budget
+
+logger = logging.getLogger(__name__)
+
+WRITE_MARKER = '_db_write_at'
+
+
+class Replica:
+    def __init__(self, url, engine):
+        self.url = url
+        self.engine = engine
+        self.healthy = True
+        self.checked_at = 0.0
+        self.checking = False
+
+    @property
+    def name(self):
+        return self.engine.url.render_as_string(hide_password=True)
+
+
+class ReplicaRouter:
+    """Round-robin over healthy replicas with periodic health checks"""
+
+    def __init__(self, replicas, health_check_interval=10):
+        self.replicas = replicas
+        self.health_check_interval = health_check_interval
+        self._cycle = itertools.cycle(range(len(replicas))) if replicas else None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_app(cls, app):
+        replicas = []
+        for url in app.config.get('SQLALCHEMY_REPLICA_URIS') or []:
+            options = build_engine_options({**app.config, 'SQLALCHEMY_DATABASE_URI': url})
+            engine = create_engine(url, **options)
+            init_connection_budget(app, engine)
+            replica = Replica(url, engine)
+            _watch_disconnects(replica)
+            replicas.append(replica)
+        return cls(replicas, app.config.get('REPLICA_HEALTH_CHECK_INTERVAL', 10))
+
+    def check(self, replica):
+        """Ping a replica and record the result"""
+        try:
+            with replica.engine.connect() as conn:
+                conn.execute(text('SELECT 1'))
+            if not replica.healthy:
+                logger.info('Replica %s is back up', replica.name)
+            replica.healthy = True
+        except Exception as e:
+            if replica.healthy:
+                logger.warning('Replica %s failed health check: %s', replica.name, e)
+            replica.healthy = False
+        replica.checked_at = time.monotonic()
+        return replica.healthy
+
+    def _due(self, replica):
+        return time.monotonic() - replica.checked_at >= self.health_check_interval
+
+    def pick(self):
+        """Next healthy replica's engine, or None to use the primary"""
+        if not self.replicas:
+            return None
+        for _ in range(len(self.replicas)):
+            with self._lock:
+                replica = self.replicas[next(self._cycle)]
+            if self._due(replica):
+                if replica.healthy:
+                    self.check(replica)
+                else:
+                    # Don't make a request wait on a connect timeout to a
+                    # replica that is probably still down
+                    self._check_in_background(replica)
+            if replica.healthy:
+                return replica.engine
+        return None
+
+    def _check_in_background(self, replica):
+        with self._lock:
+            if replica.checking:
+                return
+            replica.checking = True
+
+        def run():
+            try:
+                self.check(replica)
+            finally:
+                replica.checking = False
+
+        threading.Thread(target=run, name='replica-health-check', daemon=True).start()
+
+    def status(self):
+        return [{'url': r.name, 'healthy': r.healthy} for r in self.replicas]
+
+    def dispose(self):
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+
+def _watch_disconnects(replica):
+    @event.listens_for(replica.engine, 'handle_error')
+    def mark_down(context):
+        if context.is_disconnect:
+            replica.healthy = False
+            replica.checked_at = time.monotonic()
+
+
+def recently_wrote():
+    """Did this user write to the primary within the read-your-writes window?"""
+    written_at = session.get(WRITE_MARKER)
+    if not written_at:
+        return False
+    window = current_app.config.get('REPLICA_READ_YOUR_WRITES_SECONDS', 5)
+    return time.time() - written_at < window
+
+
+def _replica_engine():
+    """The replica engine for the current request, chosen once per request"""
+    if not has_request_context() or not g.get('replica_reads'):
+        return None
+    if 'replica_engine' not in g:
+        router = current_app.extensions.get('replica_router')
+        g.replica_engine = None if router is None or recently_wrote() else router.pick()
+    return g.replica_engine
+
+
+class RoutingSession(Session):
+    """Session that sends reads in @replica_reads views to a replica"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing:
+            engine = _replica_engine()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def replica_reads(f):
+    """Decorator marking a view as read-only, so its queries may use a replica"""
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.replica_reads = True
+        return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def init_replicas(app, db):
+    """Create replica engines and track writes for read-your-writes"""
+    router = ReplicaRouter.from_app(app)
+    app.extensions['replica_router'] = router
+
+    @event.listens_for(db.session, 'after_flush')
+    def note_write(db_session, flush_context):
+        if has_request_context():
+            g.db_wrote = True
+
+    # Core INSERT/UPDATE/DELETE through session.execute() never flush
+    @event.listens_for(db.session, 'do_orm_execute')
+    def note_statement_write(orm_execute_state):
+        if (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete) \
+                and has_request_context():
+            g.db_wrote = True
+
+    @app.after_request
+    def remember_write(response):
+        if g.get('db_wrote'):
+            session[WRITE_MARKER] = time.time()
+        return response
+
+    return router
@@ -0,0 +1,117 @@
+"""
+Product reviews.
+
+Product.rating_count, rating_sum and rating_avg aggregate a product's
+reviews. They are maintained here, in the transaction that inserts,
+updates or deletes the review, with one relative UPDATE:
+
+    rating_count = rating_count + dc,
+    rating_sum = rating_sum + ds,
+    rating_avg = (rating_sum + ds) / (rating_count + dc)
+
+Concurrent reviews of the same product add up instead of overwriting each
+other, and the catalog and sort-by-rating read (indexed) columns instead
+of aggregating reviews. ``flask ratings-check`` recomputes the aggregates
+from the reviews table and, with ``--fix``, repairs any drift.
+"""
+from sqlalchemy import case, func, select, update
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import db
+from models.product import Product
+from models.review import Review
+
+products = Product.__table__
+reviews = Review.__table__
+
+
+def _adjust(product, count_delta, sum_delta):
+    """Apply a change in review count and rating total to the product's aggregates"""
+    count = products.c.rating_count + count_delta
+    total = products.c.rating_sum + sum_delta
+    statement = (update(products)
+                 .where(products.c.id == product.id)
+                 .values(rating_count=count, rating_sum=total,
+                         rating_avg=case((count > 0, total * 1.0 / count), else_=None))
+                 .returning(products.c.rating_count, products.c.rating_sum, products.c.rating_avg))
+    row = db.session.execute(statement).one()
+
+    # Updated behind the ORM's back; keep a loaded product in step
+    if object_session(product) is not None:
+        for name, value in zip(('rating_count', 'rating_sum', 'rating_avg'), row):
+            set_committed_value(product, name, value)
+
+
+def parse_rating(value):
+    """A 1-5 integer rating from form or JSON input; raises ValueError otherwise"""
+    try:
+        rating = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('Rating must be a whole number from 1 to 5')
+    if not 1 <= rating <= 5:
+        raise ValueError('Rating must be a whole number from 1 to 5')
+    return rating
+
+
+def submit_review(product, user_id, rating, title=None, body=None):
+    """Create the user's review of a product, or update it; returns (review, created)
+
+    Nothing is committed; the caller's transaction covers the review and
+    the product's aggregates.
+    """
+    rating = parse_rating(rating)
+    review = Review.query.filter_by(product_id=product.id, user_id=user_id).first()
+    if review is None:
+        review = Review(product_id=product.id, user_id=user_id, rating=rating, title=title, body=body)
+        db.session.add(review)
+        _adjust(product, 1, rating)
+        return review, True
+
+    previous = review.rating
+    review.rating, review.title, review.body = rating, title, body
+    if rating != previous:
+        _adjust(product, 0, rating - previous)
+    return review, False
+
+
+def delete_review(review):
+    """Delete a review and take it out of its product's aggregates (not committed)"""
+    _adjust(review.product, -1, -review.rating)
+    db.session.delete(review)
+
+
+def product_reviews(product_id, page=1, per_page=10):
+    """Newest reviews of a product, paginated"""
+    return (Review.query.filter_by(product_id=product_id)
+            .order_by(Review.created_at.desc(), Review.id.desc())
+            .paginate(page=page, per_page=per_page, error_out=False))
+
+
+def check_ratings(fix=False):
+    """Products whose aggregates disagree with their reviews: [(product_id, stored, actual)]
+
+    Counts are compared as (rating_count, rating_sum). With ``fix`` the
+    drifted products are recomputed and committed.
+    """
+    actual = (select(reviews.c.product_id, func.count().label('count'), func.sum(reviews.c.rating).label('total'))
+              .group_by(reviews.c.product_id)
+              .subquery())
+    rows = db.session.execute(
+        select(products.c.id, products.c.rating_count, products.c.rating_sum,
+               func.coalesce(actual.c.count, 0), func.coalesce(actual.c.total, 0))
+        .select_from(products.outerjoin(actual, actual.c.product_id == products.c.id))
+    ).all()
+
+    drift = [(product_id, (count, total), (real_count, real_total))
+             for product_id, count, total, real_count, real_total in rows
+             if (count, total) != (real_count, real_total)]
+    if fix and drift:
+        for product_id, _, (real_count, real_total) in drift:
+            db.session.execute(
+                update(products)
+                .where(products.c.id == product_id)
+                .values(rating_count=real_count, rating_sum=real_total,
+                        rating_avg=real_total * 1.0 / real_count if real_count else None))
+        db.session.commit()
+    return drift
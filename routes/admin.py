@@ -1,15 +1,24 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, current_app, abort, Response, session
 from decorators import admin_required
 from models import db
 from models.product import Product
 from models.category import Category
-from models.order import Order, OrderItem
+from models.order import ArchivedOrder, Order, OrderItem
+from notifications import get_mailer
+from connection_budget import pool_status
+from analytics import daily_series, record_status_change, sales_series, sales_totals
+from archive import archived_months, find_order, month_range
+from categories import check_parent, move_category, subtree_ids
+from facets import admin_counts
+from inventory import InsufficientStock, move_stock, return_stock_for_order, stock_at, stock_history
+from replicas import replica_reads
+from monitoring import slow_queries
 from slugify import slugify
 from sqlalchemy import or_
 import os
 from werkzeug.utils import secure_filename
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -51,8 +60,8 @@ def delete_product_image(image_path):
             )
             if os.path.exists(file_path):
                 os.remove(file_path)
-        except Exception as e:
-            current_app.logger.error(f"Error deleting image: {str(e)}")
+        except Exception:
+            current_app.logger.exception('Error deleting image', extra={'image_path': image_path})
 
 
 # ============================================================================
@@ -62,6 +71,7 @@ def delete_product_image(image_path):
 @admin_bp.route('/')
 @admin_bp.route('/dashboard')
 @admin_required
+@replica_reads
 def dashboard():
     """Admin dashboard with statistics"""
     total_products = Product.query.count()
@@ -81,6 +91,13 @@ def dashboard():
     approved_orders = Order.query.filter_by(status='approved').count()
     shipped_orders = Order.query.filter_by(status='shipped').count()
 
+    # Sales over the last 30 days, read from the rollups (analytics.py)
+    sales_days = daily_series(30)
+    since = sales_days[0][0]
+    top_products = sales_totals('product', start=since, limit=5)
+    names = dict(db.session.query(Product.id, Product.name)
+                 .filter(Product.id.in_([row[0] for row in top_products])).all())
+
     # Recent products
     recent_products = Product.query.order_by(Product.created_at.desc()).limit(5).all()
 
@@ -98,6 +115,13 @@ def dashboard():
         'pending_orders': pending_orders,
         'approved_orders': approved_orders,
         'shipped_orders': shipped_orders,
+        'revenue_today': sales_days[-1][3],
+        'revenue_30d': sum(day[3] for day in sales_days),
+        'orders_30d': sum(day[1] for day in sales_days),
+        'sales_days': sales_days,
+        'sales_max': max(day[3] for day in sales_days) or 1,
+        'top_products': [(names.get(product_id, 'Deleted product'), orders, units, float(revenue))
+                         for product_id, orders, units, revenue in top_products],
         'recent_products': recent_products,
         'recent_orders': recent_orders
     }
@@ -111,6 +135,7 @@ def dashboard():
 
 @admin_bp.route('/categories')
 @admin_required
+@replica_reads
 def categories_list():
     """List all categories"""
     page = request.args.get('page', 1, type=int)
@@ -128,7 +153,8 @@ def categories_list():
             )
         )
 
-    categories = query.order_by(Category.name).paginate(
+    # Tree order: each category is followed by its subtree
+    categories = query.order_by(Category.path).paginate(
         page=page, per_page=per_page, error_out=False
     )
 
@@ -144,12 +170,18 @@ def category_create():
     if request.method == 'POST':
         name = request.form.get('name', '').strip()
         description = request.form.get('description', '').strip()
+        parent_id = request.form.get('parent_id', type=int)
         is_active = request.form.get('is_active') == 'on'
 
         if not name:
             flash('Category name is required.', 'error')
             return redirect(url_for('admin.category_create'))
 
+        parent = db.session.get(Category, parent_id) if parent_id else None
+        if parent_id and parent is None:
+            flash('Parent category not found.', 'error')
+            return redirect(url_for('admin.category_create'))
+
         # Generate slug
         slug = slugify(name)
 
@@ -163,8 +195,10 @@ def category_create():
                 name=name,
                 slug=slug,
                 description=description if description else None,
+                parent_id=parent.id if parent else None,
                 is_active=is_active
             )
+            check_parent(category, parent)
 
             db.session.add(category)
             db.session.commit()
@@ -172,12 +206,18 @@ def category_create():
             flash(f'Category "{name}" created successfully!', 'success')
             return redirect(url_for('admin.categories_list'))
 
+        except ValueError as e:
+            db.session.rollback()
+            flash(str(e), 'error')
+            return redirect(url_for('admin.category_create'))
         except Exception as e:
             db.session.rollback()
             flash(f'Error creating category: {str(e)}', 'error')
             return redirect(url_for('admin.category_create'))
 
-    return render_template('admin/categories/create.html')
+    parents = Category.query.order_by(Category.path).all()
+    return render_template('admin/categories/create.html', parents=parents,
+                           selected_parent=request.args.get('parent_id', type=int))
 
 
 @admin_bp.route('/categories/<int:category_id>/edit', methods=['GET', 'POST'])
@@ -189,12 +229,18 @@ def category_edit(category_id):
     if request.method == 'POST':
         name = request.form.get('name', '').strip()
         description = request.form.get('description', '').strip()
+        parent_id = request.form.get('parent_id', type=int)
         is_active = request.form.get('is_active') == 'on'
 
         if not name:
             flash('Category name is required.', 'error')
             return redirect(url_for('admin.category_edit', category_id=category_id))
 
+        parent = db.session.get(Category, parent_id) if parent_id else None
+        if parent_id and parent is None:
+            flash('Parent category not found.', 'error')
+            return redirect(url_for('admin.category_edit', category_id=category_id))
+
         # Generate new slug if name changed
         new_slug = slugify(name)
         if new_slug != category.slug:
@@ -204,6 +250,8 @@ def category_edit(category_id):
             category.slug = new_slug
 
         try:
+            # Rewrites the paths below it too, in the same transaction
+            move_category(category, parent)
             category.name = name
             category.description = description if description else None
             category.is_active = is_active
@@ -213,12 +261,19 @@ def category_edit(category_id):
             flash(f'Category "{name}" updated successfully!', 'success')
             return redirect(url_for('admin.categories_list'))
 
+        except ValueError as e:
+            db.session.rollback()
+            flash(str(e), 'error')
+            return redirect(url_for('admin.category_edit', category_id=category_id))
         except Exception as e:
             db.session.rollback()
             flash(f'Error updating category: {str(e)}', 'error')
             return redirect(url_for('admin.category_edit', category_id=category_id))
 
-    return render_template('admin/categories/edit.html', category=category)
+    # Anywhere except inside its own subtree
+    parents = Category.query.filter(Category.id.notin_(subtree_ids(category.path))) \
+        .order_by(Category.path).all()
+    return render_template('admin/categories/edit.html', category=category, parents=parents)
 
 
 @admin_bp.route('/categories/<int:category_id>/delete', methods=['POST'])
@@ -227,10 +282,13 @@ def category_delete(category_id):
     """Delete category"""
     category = Category.query.get_or_404(category_id)
 
-    # Check if category has products
+    # Check if category has products or subcategories
     if category.products.count() > 0:
         flash(f'Cannot delete category "{category.name}" because it has {category.products.count()} products.', 'error')
         return redirect(url_for('admin.categories_list'))
+    if category.children.count() > 0:
+        flash(f'Cannot delete category "{category.name}" because it has subcategories.', 'error')
+        return redirect(url_for('admin.categories_list'))
 
     try:
         name = category.name
@@ -251,6 +309,7 @@ def category_delete(category_id):
 
 @admin_bp.route('/products')
 @admin_required
+@replica_reads
 def products_list():
     """List all products"""
     page = request.args.get('page', 1, type=int)
@@ -262,17 +321,20 @@ def products_list():
 
     query = Product.query
 
+    search_clause = None
     if search:
-        query = query.filter(
-            or_(
-                Product.name.ilike(f'%{search}%'),
-                Product.sku.ilike(f'%{search}%'),
-                Product.description.ilike(f'%{search}%')
-            )
+        search_clause = or_(
+            Product.name.ilike(f'%{search}%'),
+            Product.sku.ilike(f'%{search}%'),
+            Product.description.ilike(f'%{search}%')
         )
+        query = query.filter(search_clause)
 
     if category_id:
-        query = query.filter_by(category_id=category_id)
+        # The category and everything below it, one range on the category path index
+        category = db.session.get(Category, category_id)
+        query = query.filter(Product.category_id.in_(subtree_ids(category.path))) if category \
+            else query.filter_by(category_id=category_id)
 
     if status == 'active':
         query = query.filter_by(is_active=True)
@@ -290,11 +352,17 @@ def products_list():
         page=page, per_page=per_page, error_out=False
     )
 
-    categories = Category.query.filter_by(is_active=True).order_by(Category.name).all()
+    categories = Category.query.filter_by(is_active=True).order_by(Category.path).all()
+
+    # Counts for the category and status filters, from one grouped query
+    category_counts, status_counts, category_total = admin_counts(search_clause, category_id, status)
 
     return render_template('admin/products/list.html',
                            products=products,
                            categories=categories,
+                           category_counts=category_counts,
+                           category_total=category_total,
+                           status_counts=status_counts,
                            search=search,
                            selected_category=category_id,
                            selected_status=status)
@@ -311,6 +379,7 @@ def product_create():
         compare_price = request.form.get('compare_price', type=float)
         cost_price = request.form.get('cost_price', type=float)
         sku = request.form.get('sku', '').strip()
+        brand = request.form.get('brand', '').strip()
         stock_quantity = request.form.get('stock_quantity', 0, type=int)
         low_stock_threshold = request.form.get('low_stock_threshold', 10, type=int)
         weight = request.form.get('weight', type=float)
@@ -362,7 +431,8 @@ def product_create():
                 compare_price=compare_price if compare_price else None,
                 cost_price=cost_price if cost_price else None,
                 sku=sku if sku else None,
-                stock_quantity=stock_quantity,
+                brand=brand if brand else None,
+                stock_quantity=0,
                 low_stock_threshold=low_stock_threshold,
                 image_url=image_url,
                 weight=weight if weight else None,
@@ -373,6 +443,9 @@ def product_create():
             )
 
             db.session.add(product)
+            db.session.flush()
+            # Opening stock is the first entry in the product's stock history
+            move_stock(product, stock_quantity, 'restock', user_id=session.get('user_id'), note='Opening stock')
             db.session.commit()
 
             flash(f'Product "{name}" created successfully!', 'success')
@@ -386,7 +459,7 @@ def product_create():
             flash(f'Error creating product: {str(e)}', 'error')
             return redirect(url_for('admin.product_create'))
 
-    categories = Category.query.filter_by(is_active=True).order_by(Category.name).all()
+    categories = Category.query.filter_by(is_active=True).order_by(Category.path).all()
     return render_template('admin/products/create.html', categories=categories)
 
 
@@ -403,7 +476,11 @@ def product_edit(product_id):
         compare_price = request.form.get('compare_price', type=float)
         cost_price = request.form.get('cost_price', type=float)
         sku = request.form.get('sku', '').strip()
+        brand = request.form.get('brand', '').strip()
         stock_quantity = request.form.get('stock_quantity', 0, type=int)
+        # The quantity the form was rendered with; the edit is applied as a delta from it
+        stock_quantity_original = request.form.get('stock_quantity_original', type=int)
+        restock_quantity = request.form.get('restock_quantity', 0, type=int)
         low_stock_threshold = request.form.get('low_stock_threshold', 10, type=int)
         weight = request.form.get('weight', type=float)
         dimensions = request.form.get('dimensions', '').strip()
@@ -464,7 +541,7 @@ def product_edit(product_id):
             product.compare_price = compare_price if compare_price else None
             product.cost_price = cost_price if cost_price else None
             product.sku = sku if sku else None
-            product.stock_quantity = stock_quantity
+            product.brand = brand if brand else None
             product.low_stock_threshold = low_stock_threshold
             product.weight = weight if weight else None
             product.dimensions = dimensions if dimensions else None
@@ -472,18 +549,32 @@ def product_edit(product_id):
             product.is_active = is_active
             product.is_featured = is_featured
 
+            if stock_quantity_original is None:
+                stock_quantity_original = product.stock_quantity
+            move_stock(product, stock_quantity - stock_quantity_original, 'adjustment',
+                       user_id=session.get('user_id'), note='Edited in admin')
+            if restock_quantity > 0:
+                move_stock(product, restock_quantity, 'restock', user_id=session.get('user_id'))
+
             db.session.commit()
 
             flash(f'Product "{name}" updated successfully!', 'success')
             return redirect(url_for('admin.products_list'))
 
+        except InsufficientStock:
+            db.session.rollback()
+            flash('Stock changed while you were editing (orders came in); '
+                  'the adjustment would take it below zero. Please review and save again.', 'error')
+            return redirect(url_for('admin.product_edit', product_id=product_id))
+
         except Exception as e:
             db.session.rollback()
             flash(f'Error updating product: {str(e)}', 'error')
             return redirect(url_for('admin.product_edit', product_id=product_id))
 
-    categories = Category.query.filter_by(is_active=True).order_by(Category.name).all()
-    return render_template('admin/products/edit.html', product=product, categories=categories)
+    categories = Category.query.filter_by(is_active=True).order_by(Category.path).all()
+    movements = stock_history(product_id, limit=20)
+    return render_template('admin/products/edit.html', product=product, categories=categories, movements=movements)
 
 
 @admin_bp.route('/products/<int:product_id>/delete', methods=['POST'])
@@ -517,6 +608,7 @@ def product_delete(product_id):
 
 @admin_bp.route('/orders')
 @admin_required
+@replica_reads
 def orders_list():
     """List all orders"""
     page = request.args.get('page', 1, type=int)
@@ -524,38 +616,55 @@ def orders_list():
 
     status_filter = request.args.get('status', '')
     search = request.args.get('search', '')
-
-    query = Order.query
+    archived = request.args.get('archived') == '1'
+
+    # Old closed orders live in archived_orders (archive.py), browsed a month
+    # at a time so PostgreSQL only reads that month's partition
+    months, month = [], None
+    if archived:
+        months = archived_months()
+        month = request.args.get('month') if request.args.get('month') in months else (months[0] if months else None)
+        model = ArchivedOrder
+        query = ArchivedOrder.query
+        if month:
+            start, end = month_range(month)
+            query = query.filter(ArchivedOrder.created_at >= start, ArchivedOrder.created_at < end)
+    else:
+        model = Order
+        query = Order.query
 
     if search:
-        query = query.filter(
-            or_(
-                Order.order_number.ilike(f'%{search}%'),
-                Order.customer_name.ilike(f'%{search}%'),
-                Order.customer_email.ilike(f'%{search}%'),
-                Order.customer_phone.ilike(f'%{search}%')
-            )
-        )
+        searched = [model.order_number.ilike(f'%{search}%'),
+                    model.customer_name.ilike(f'%{search}%'),
+                    model.customer_email.ilike(f'%{search}%')]
+        if not archived:
+            searched.append(Order.customer_phone.ilike(f'%{search}%'))
+        query = query.filter(or_(*searched))
 
     if status_filter:
         query = query.filter_by(status=status_filter)
 
-    orders = query.order_by(Order.created_at.desc()).paginate(
+    orders = query.order_by(model.created_at.desc()).paginate(
         page=page, per_page=per_page, error_out=False
     )
 
     return render_template('admin/orders/list.html',
                            orders=orders,
                            selected_status=status_filter,
-                           search=search)
+                           search=search,
+                           archived=archived,
+                           months=months,
+                           selected_month=month)
 
 
 @admin_bp.route('/orders/<int:order_id>')
 @admin_required
 def order_detail(order_id):
     """View order details"""
-    order = Order.query.get_or_404(order_id)
-    return render_template('admin/orders/detail.html', order=order)
+    order, archived = find_order(order_id)
+    if order is None:
+        abort(404)
+    return render_template('admin/orders/detail.html', order=order, archived=archived)
 
 
 @admin_bp.route('/orders/<int:order_id>/approve', methods=['POST'])
@@ -569,21 +678,27 @@ def order_approve(order_id):
         return redirect(url_for('admin.order_detail', order_id=order_id))
 
     try:
-        order.status = 'approved'
-        order.approved_at = datetime.utcnow()
+        previous_status = order.status
+        # Only the request that actually moves the order adds it to the sales figures
+        if not order.change_status('approved', approved_at=datetime.utcnow()):
+            flash(f'Order {order.order_number} was already changed by someone else.', 'warning')
+            return redirect(url_for('admin.order_detail', order_id=order_id))
 
         admin_notes = request.form.get('admin_notes', '').strip()
         if admin_notes:
             order.admin_notes = admin_notes
 
+        record_status_change(order, previous_status)
+
         db.session.commit()
 
         flash(f'Order {order.order_number} has been approved!', 'success')
 
-        # TODO: Send email notification to customer
+        get_mailer().send_status_update(order, 'approved')
 
     except Exception as e:
         db.session.rollback()
+        current_app.logger.exception('Error approving order', extra={'order_id': order_id})
         flash(f'Error approving order: {str(e)}', 'error')
 
     return redirect(url_for('admin.order_detail', order_id=order_id))
@@ -599,29 +714,30 @@ def order_reject(order_id):
         flash('This order cannot be rejected.', 'error')
         return redirect(url_for('admin.order_detail', order_id=order_id))
 
-    try:
-        order.status = 'rejected'
+    admin_notes = request.form.get('admin_notes', '').strip()
+    if not admin_notes:
+        flash('Please provide a reason for rejection.', 'warning')
+        return redirect(url_for('admin.order_detail', order_id=order_id))
 
-        admin_notes = request.form.get('admin_notes', '').strip()
-        if admin_notes:
-            order.admin_notes = admin_notes
-        else:
-            flash('Please provide a reason for rejection.', 'warning')
+    try:
+        # Only the request that actually moves the order returns its stock
+        if not order.change_status('rejected'):
+            flash(f'Order {order.order_number} was already changed by someone else.', 'warning')
             return redirect(url_for('admin.order_detail', order_id=order_id))
+        order.admin_notes = admin_notes
 
         # Restore product stock
-        for item in order.items:
-            if item.product:
-                item.product.stock_quantity += item.quantity
+        return_stock_for_order(order, note='Order rejected', user_id=session.get('user_id'))
 
         db.session.commit()
 
         flash(f'Order {order.order_number} has been rejected.', 'success')
 
-        # TODO: Send email notification to customer
+        get_mailer().send_status_update(order, 'rejected', reason=order.admin_notes)
 
     except Exception as e:
         db.session.rollback()
+        current_app.logger.exception('Error rejecting order', extra={'order_id': order_id})
         flash(f'Error rejecting order: {str(e)}', 'error')
 
     return redirect(url_for('admin.order_detail', order_id=order_id))
@@ -638,8 +754,9 @@ def order_ship(order_id):
         return redirect(url_for('admin.order_detail', order_id=order_id))
 
     try:
-        order.status = 'shipped'
-        order.shipped_at = datetime.utcnow()
+        if not order.change_status('shipped', shipped_at=datetime.utcnow()):
+            flash(f'Order {order.order_number} was already changed by someone else.', 'warning')
+            return redirect(url_for('admin.order_detail', order_id=order_id))
 
         tracking_number = request.form.get('tracking_number', '').strip()
         if tracking_number:
@@ -652,10 +769,11 @@ def order_ship(order_id):
 
         flash(f'Order {order.order_number} marked as shipped!', 'success')
 
-        # TODO: Send shipping notification email to customer
+        get_mailer().send_status_update(order, 'shipped', tracking_number=tracking_number or None)
 
     except Exception as e:
         db.session.rollback()
+        current_app.logger.exception('Error updating order status', extra={'order_id': order_id})
         flash(f'Error updating order: {str(e)}', 'error')
 
     return redirect(url_for('admin.order_detail', order_id=order_id))
@@ -672,8 +790,9 @@ def order_deliver(order_id):
         return redirect(url_for('admin.order_detail', order_id=order_id))
 
     try:
-        order.status = 'delivered'
-        order.delivered_at = datetime.utcnow()
+        if not order.change_status('delivered', delivered_at=datetime.utcnow()):
+            flash(f'Order {order.order_number} was already changed by someone else.', 'warning')
+            return redirect(url_for('admin.order_detail', order_id=order_id))
 
         db.session.commit()
 
@@ -681,6 +800,7 @@ def order_deliver(order_id):
 
     except Exception as e:
         db.session.rollback()
+        current_app.logger.exception('Error updating order status', extra={'order_id': order_id})
         flash(f'Error updating order: {str(e)}', 'error')
 
     return redirect(url_for('admin.order_detail', order_id=order_id))
@@ -697,12 +817,17 @@ def order_cancel(order_id):
         return redirect(url_for('admin.order_detail', order_id=order_id))
 
     try:
-        order.status = 'cancelled'
+        previous_status = order.status
+        # Only the request that actually moves the order returns its stock
+        if not order.change_status('cancelled'):
+            flash(f'Order {order.order_number} was already changed by someone else.', 'warning')
+            return redirect(url_for('admin.order_detail', order_id=order_id))
 
         # Restore product stock
-        for item in order.items:
-            if item.product:
-                item.product.stock_quantity += item.quantity
+        return_stock_for_order(order, note='Order cancelled', user_id=session.get('user_id'))
+
+        # Take it back out of the sales figures if it was approved
+        record_status_change(order, previous_status)
 
         db.session.commit()
 
@@ -710,6 +835,7 @@ def order_cancel(order_id):
 
     except Exception as e:
         db.session.rollback()
+        current_app.logger.exception('Error cancelling order', extra={'order_id': order_id})
         flash(f'Error cancelling order: {str(e)}', 'error')
 
     return redirect(url_for('admin.order_detail', order_id=order_id))
@@ -786,6 +912,70 @@ def api_product_toggle_featured(product_id):
         }), 500
 
 
+@admin_bp.route('/api/products/<int:product_id>/stock-history')
+@admin_required
+def api_product_stock_history(product_id):
+    """Stock movements for a product, newest first; ?start=&end= (ISO dates) and ?at= for on-hand then"""
+    Product.query.get_or_404(product_id)
+
+    try:
+        start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else None
+        at = datetime.fromisoformat(request.args['at']) if request.args.get('at') else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Dates must be ISO 8601, e.g. 2025-06-01T00:00:00'}), 400
+
+    limit = min(request.args.get('limit', 200, type=int), 1000)
+    result = {
+        'success': True,
+        'movements': [movement.to_dict() for movement in stock_history(product_id, start, end, limit)]
+    }
+    if at is not None:
+        result['on_hand_at'] = stock_at(product_id, at)
+    return jsonify(result)
+
+
+@admin_bp.route('/api/analytics/sales')
+@admin_required
+@replica_reads
+def api_analytics_sales():
+    """Sales series from the rollups; ?grain=hour|day&dimension=all|category|product&id=&start=&end="""
+    grain = request.args.get('grain', 'day')
+    dimension = request.args.get('dimension', 'all')
+    if grain not in ('hour', 'day') or dimension not in ('all', 'category', 'product'):
+        return jsonify({'success': False, 'message': 'Unknown grain or dimension'}), 400
+
+    try:
+        start = datetime.fromisoformat(request.args['start']) if request.args.get('start') else None
+        end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Dates must be ISO 8601, e.g. 2025-06-01T00:00:00'}), 400
+
+    rows = sales_series(grain, start, end, dimension, request.args.get('id', 0, type=int))
+    return jsonify({'success': True, 'series': [row.to_dict() for row in rows]})
+
+
+@admin_bp.route('/api/analytics/top')
+@admin_required
+@replica_reads
+def api_analytics_top():
+    """Best-selling products or categories; ?dimension=product|category&days=30&limit=10"""
+    dimension = request.args.get('dimension', 'product')
+    if dimension not in ('category', 'product'):
+        return jsonify({'success': False, 'message': 'Unknown dimension'}), 400
+
+    days = min(max(request.args.get('days', 30, type=int), 1), 366)
+    limit = min(request.args.get('limit', 10, type=int), 100)
+    since = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=days - 1)
+    rows = sales_totals(dimension, start=since, limit=limit)
+    return jsonify({
+        'success': True,
+        'since': since.isoformat(),
+        'top': [{'id': key, 'orders': orders, 'units': units, 'revenue': float(revenue)}
+                for key, orders, units, revenue in rows]
+    })
+
+
 @admin_bp.route('/api/categories/<int:category_id>/toggle-active', methods=['POST'])
 @admin_required
 def api_category_toggle_active(category_id):
@@ -806,4 +996,106 @@ def api_category_toggle_active(category_id):
         return jsonify({
             'success': False,
             'message': str(e)
-        }), 500
\ No newline at end of file
+        }), 500
+
+
+@admin_bp.route('/api/db-pool')
+@admin_required
+def api_db_pool():
+    """Connection pool utilisation and checkout-wait histogram for this worker"""
+    return jsonify(pool_status(db.engine))
+
+
+@admin_bp.route('/api/slow-queries')
+@admin_required
+def api_slow_queries():
+    """Slow statements seen by this worker, grouped by fingerprint"""
+    return jsonify(slow_queries.entries())
+
+
+@admin_bp.route('/api/memory')
+@admin_required
+def api_memory():
+    """RSS, per-endpoint memory growth and tracemalloc state for this worker"""
+    return jsonify(current_app.extensions['memory_tracker'].status())
+
+
+@admin_bp.route('/api/memory/tracemalloc', methods=['POST'])
+@admin_required
+def api_memory_tracemalloc():
+    """Start or stop tracemalloc in this worker"""
+    tracker = current_app.extensions['memory_tracker']
+    action = request.form.get('action') or (request.get_json(silent=True) or {}).get('action')
+    if action == 'start':
+        tracker.start_tracing()
+    elif action == 'stop':
+        tracker.stop_tracing()
+    else:
+        return jsonify({'success': False, 'message': 'action must be start or stop'}), 400
+    return jsonify({'success': True, 'tracemalloc': tracker.tracing})
+
+
+@admin_bp.route('/api/memory/snapshots', methods=['POST'])
+@admin_required
+def api_memory_snapshot():
+    """Take a tracemalloc snapshot and diff it against the previous one"""
+    tracker = current_app.extensions['memory_tracker']
+    try:
+        index = tracker.take_snapshot()
+    except RuntimeError as e:
+        return jsonify({'success': False, 'message': str(e)}), 409
+    result = {'success': True, 'index': index, 'top': tracker.top_allocations()}
+    if index > 0:
+        result['diff'] = tracker.diff(index - 1, index)
+    return jsonify(result)
+
+
+@admin_bp.route('/api/memory/diff')
+@admin_required
+def api_memory_diff():
+    """Diff two kept snapshots (?old=0&new=-1&group=lineno|traceback)"""
+    tracker = current_app.extensions['memory_tracker']
+    group = request.args.get('group', 'lineno')
+    if group not in ('lineno', 'filename', 'traceback'):
+        return jsonify({'success': False, 'message': 'group must be lineno, filename or traceback'}), 400
+    try:
+        diff = tracker.diff(request.args.get('old', 0, type=int), request.args.get('new', -1, type=int),
+                            limit=request.args.get('limit', 20, type=int), key_type=group)
+    except IndexError:
+        return jsonify({'success': False, 'message': 'take at least two snapshots first'}), 404
+    return jsonify({'success': True, **diff})
+
+# ============================================================================
+# PROFILING
+# ============================================================================
+
+@admin_bp.route('/profiles')
+@admin_required
+def profiles_list():
+    """Recently captured request profiles from all workers"""
+    profiles = current_app.extensions['profile_store'].recent()
+    for profile in profiles:
+        profile['created'] = datetime.fromtimestamp(profile['created_at'])
+    return render_template('admin/profiles/list.html', profiles=profiles)
+
+
+@admin_bp.route('/profiles/<profile_id>')
+@admin_required
+def profile_detail(profile_id):
+    """Hot functions and SQL timeline of one profile"""
+    profile = current_app.extensions['profile_store'].get(profile_id)
+    if profile is None:
+        abort(404)
+    return render_template('admin/profiles/detail.html', profile=profile)
+
+
+@admin_bp.route('/profiles/<profile_id>/folded')
+@admin_required
+def profile_folded(profile_id):
+    """Folded stacks for flamegraph.pl or speedscope"""
+    profile = current_app.extensions['profile_store'].get(profile_id)
+    if profile is None:
+        abort(404)
+    return Response(profile['folded'] + '\n', mimetype='text/plain', headers={
+        'Content-Disposition': f'attachment; filename={profile_id}.folded'
+    })
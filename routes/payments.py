@@ -0,0 +1,215 @@
+from flask import Blueprint, render_template, jsonify, request, current_app
+from idempotency import idempotent
+from models import db
+from models.order import Order
+from models.payment import Payment
+from monitoring import track_outbound
+from monitoring.tracing import current_context, current_span, inject_headers
+from payment_events import UnknownPayment, apply_status, get_event_worker, record_event
+from payments import BakongPayment
+import json
+import requests
+import uuid
+
+payments_bp = Blueprint('payments', __name__)
+
+
+@payments_bp.route('/create-order', methods=['POST'])
+@idempotent
+def create_order():
+    """Create orders using PayPal Orders API"""
+    client_id = current_app.config['PAYPAL_CLIENT_ID']
+    secret = current_app.config['PAYPAL_CLIENT_SECRET']
+    api_url = current_app.config['PAYPAL_API_URL']
+
+    # Get access token
+    with track_outbound('paypal', 'oauth_token'):
+        auth_response = requests.post(
+            f'{api_url}/v1/oauth2/token',
+            headers=inject_headers({'Accept': 'application/json'}),
+            auth=(client_id, secret),
+            data={'grant_type': 'client_credentials'}
+        )
+
+    access_token = auth_response.json()['access_token']
+
+    # Create orders
+    with track_outbound('paypal', 'create_order'):
+        order_response = requests.post(
+            f'{api_url}/v2/checkout/orders',
+            headers=inject_headers({
+                'Content-Type': 'application/json',
+                'Authorization': f'Bearer {access_token}'
+            }),
+            json={
+                'intent': 'CAPTURE',
+                'purchase_units': [{
+                    'amount': {
+                        'currency_code': 'USD',
+                        'value': '10.00'
+                    }
+                }]
+            }
+        )
+
+    return jsonify(order_response.json())
+
+
+@payments_bp.route('/bakong/form')
+def getform_bakong():
+    return render_template('bakong-testing.html', idempotency_key=uuid.uuid4().hex)
+
+
+@payments_bp.route('/payment/bakong/initiate', methods=['POST'])
+@idempotent
+def initiate_bakong_payment():
+    """Initiate Bakong payment"""
+    try:
+        # Get form data
+        try:
+            amount = float(request.form.get('amount'))
+        except (TypeError, ValueError):
+            return render_template('error.html', error='Invalid amount'), 400
+        description = request.form.get('description', 'Payment')
+        customer_name = request.form.get('customer_name', '')
+        customer_email = request.form.get('customer_email', '')
+
+        # Paying for an order: Bakong gets its number, callbacks update its payment_status
+        order = None
+        order_number = request.form.get('order_number', '').strip().upper()
+        if order_number:
+            order = Order.query.filter_by(order_number=order_number).first()
+            if order is None:
+                return render_template('error.html', error='Order not found'), 404
+
+        # Create Bakong payment
+        bakong = BakongPayment()
+        result = bakong.create_payment(
+            amount=amount,
+            currency='USD',
+            description=description,
+            order_id=order.order_number if order else None
+        )
+
+        if result['success']:
+            payment_id = result['data'].get('payment_id')
+
+            # Store payment info
+            db.session.add(Payment(
+                gateway='bakong',
+                payment_id=payment_id,
+                order_id=order.id if order else None,
+                amount=amount,
+                description=description,
+                customer_name=customer_name,
+                customer_email=customer_email,
+                # Lets the callbacks link back to this request's trace
+                traceparent=current_context().traceparent() if current_context() else None
+            ))
+            db.session.commit()
+
+            # Generate QR code
+            qr_result = bakong.generate_qr_code(payment_id)
+
+            if qr_result['success']:
+                return render_template('bakong_qr.html',
+                                       payment_id=payment_id,
+                                       qr_code=qr_result.get('qr_code'),
+                                       amount=amount,
+                                       description=description)
+            else:
+                # 5xx releases the idempotency key, so the form can be resubmitted
+                return render_template('error.html',
+                                       error='Failed to generate QR code'), 502
+        else:
+            return render_template('error.html',
+                                   error=result.get('error', 'Payment failed')), 502
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception('Bakong payment initiation failed')
+        return render_template('error.html', error=str(e)), 500
+
+
+@payments_bp.route('/payment/bakong/status/<payment_id>')
+def check_bakong_status(payment_id):
+    """Check Bakong payment status (AJAX endpoint)"""
+    bakong = BakongPayment()
+    result = bakong.check_payment_status(payment_id)
+
+    if result['success']:
+        status = result['data'].get('status')
+
+        # Same idempotent transition as a callback, so the two can't disagree
+        try:
+            apply_status('bakong', payment_id, status)
+            db.session.commit()
+        except UnknownPayment:
+            pass  # not started here, nothing to keep in step
+        except ValueError:
+            current_app.logger.warning('Unknown Bakong payment status', extra={'payment_id': payment_id, 'status': status})
+
+        return jsonify({
+            'success': True,
+            'status': status,
+            'data': result['data']
+        })
+    else:
+        return jsonify({
+            'success': False,
+            'error': result.get('error')
+        })
+
+
+@payments_bp.route('/payment/callback/bakong', methods=['POST'])
+def bakong_callback():
+    """Handle Bakong webhook callback
+
+    Only verifies and stores the event; payment_events.py applies it. A
+    redelivery gets the same answer and is not stored again.
+    """
+    if not current_app.config.get('BAKONG_SECRET_KEY'):
+        # Can't verify anything; 503 makes Bakong redeliver once it is configured
+        current_app.logger.error('BAKONG_SECRET_KEY is not set; rejecting Bakong callback')
+        return jsonify({'error': 'Callbacks are not configured'}), 503
+
+    raw = request.get_data(as_text=True)
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        data = None
+    signature = request.headers.get('X-Signature')
+
+    # Verify signature
+    if not isinstance(data, dict) or not signature or not BakongPayment().verify_callback(data, signature):
+        current_app.logger.error('Invalid Bakong callback signature')
+        return jsonify({'error': 'Invalid signature'}), 400
+
+    current_span().set_attribute('payment.id', data.get('payment_id'))
+    try:
+        stored = record_event('bakong', data, raw)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    current_span().set_attribute('payment.duplicate', not stored)
+    if stored:
+        get_event_worker().notify()
+
+    return jsonify({'message': 'Callback received'}), 200
+
+
+@payments_bp.route('/payment/success/<payment_id>')
+def payment_success(payment_id):
+    """Payment success page"""
+    payment = Payment.query.filter_by(payment_id=payment_id).first()
+
+    if payment:
+        return render_template('success.html', payment=payment)
+    else:
+        return render_template('error.html', error='Payment not found')
+
+
+@payments_bp.route('/payment/failed')
+def payment_failed():
+    """Payment failed page"""
+    return render_template('error.html', error='Payment failed or cancelled')
@@ -0,0 +1,573 @@
+from urllib.parse import urlencode
+
+from flask import (Blueprint, render_template, jsonify, request, redirect, url_for, session, flash, current_app, abort,
+                   make_response)
+from archive import restore
+from categories import breadcrumbs
+from decorators import is_admin, login_required
+from facets import facet_groups, filter_clauses, get_facet_cache, parse_filters
+from idempotency import idempotent
+from inventory import InsufficientStock, take_stock_for_order
+from models import db
+from models.user import User
+from models.category import Category
+from models.product import Product
+from models.order import ArchivedOrder, Order, OrderItem
+from models.review import Review
+from notifications import get_telegram_notifier, get_mailer
+from order_history import (can_view, decode_cursor, etag_for, find_tracked_order, history_page, load_page,
+                           not_modified, order_version, remember_tracked, with_validators)
+from order_ids import new_order_number
+from recommendations import recommended_for_cart, recommended_products
+from reviews import delete_review, product_reviews, submit_review
+from replicas import replica_reads
+
+shop_bp = Blueprint('shop', __name__)
+
+
+@shop_bp.route('/')
+def index():
+    if 'user_id' in session:
+        return redirect(url_for('shop.catalog'))
+    return redirect(url_for('shop.login'))
+
+
+@shop_bp.route('/login')
+def login():
+    if 'user_id' in session:
+        return redirect(url_for('shop.catalog'))
+    return render_template('auth/login.html')
+
+
+@shop_bp.post('/login')
+def login_user():
+    email = request.form.get('email', '').strip()
+    password = request.form.get('password', '')
+
+    # Validate input
+    if not email or not password:
+        flash('Email and password are required.', 'error')
+        return redirect(url_for('shop.login'))
+
+    # Query user from database
+    user = User.query.filter_by(email=email).first()
+
+    if user and user.check_password(password):
+        session['user_id'] = user.id
+        session['username'] = user.username
+        session.permanent = True
+        flash(f'Welcome back, {user.username}!', 'success')
+
+        # Redirect to next page if specified, otherwise catalog
+        next_page = request.args.get('next')
+        return redirect(next_page if next_page else url_for('shop.catalog'))
+    else:
+        flash('Invalid email or password.', 'error')
+        return redirect(url_for('shop.login'))
+
+
+@shop_bp.route('/register')
+def register():
+    if 'user_id' in session:
+        return redirect(url_for('shop.catalog'))
+    return render_template('auth/register.html')
+
+
+@shop_bp.post('/register')
+def register_user():
+    username = request.form.get('username', '').strip()
+    email = request.form.get('email', '').strip().lower()
+    password = request.form.get('password', '')
+    password_confirm = request.form.get('password_confirm', '')
+
+    # Validate input
+    if not all([username, email, password, password_confirm]):
+        flash('All fields are required.', 'error')
+        return redirect(url_for('shop.register'))
+
+    if password != password_confirm:
+        flash('Passwords do not match.', 'error')
+        return redirect(url_for('shop.register'))
+
+    if len(password) < 8:
+        flash('Password must be at least 8 characters long.', 'error')
+        return redirect(url_for('shop.register'))
+
+    if len(username) < 3:
+        flash('Username must be at least 3 characters long.', 'error')
+        return redirect(url_for('shop.register'))
+
+    # Check if user already exists
+    if User.query.filter_by(email=email).first():
+        flash('Email already registered.', 'error')
+        return redirect(url_for('shop.register'))
+
+    if User.query.filter_by(username=username).first():
+        flash('Username already taken.', 'error')
+        return redirect(url_for('shop.register'))
+
+    # Create new user
+    try:
+        new_user = User(
+            username=username,
+            email=email
+        )
+        new_user.set_password(password)
+
+        db.session.add(new_user)
+        db.session.commit()
+
+        flash('Registration successful! Please log in.', 'success')
+        return redirect(url_for('shop.login'))
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception('Registration error')
+        flash('An error occurred during registration. Please try again.', 'error')
+        return redirect(url_for('shop.register'))
+
+
+@shop_bp.route('/logout')
+@login_required
+def logout():
+    username = session.get('username', 'User')
+    session.clear()
+    flash(f'Goodbye, {username}!', 'info')
+    return redirect(url_for('shop.login'))
+
+
+@shop_bp.route('/catalog')
+@login_required
+@replica_reads
+def catalog():
+    # Get active products from database
+    sort = request.args.get('sort', '')
+    filters = parse_filters(request.args)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = 48
+
+    # Counts for every facet and the total come from the bitmap index, so the
+    # listing itself needs no COUNT(*)
+    total, facet_counts = get_facet_cache().counts(filters)
+
+    query = Product.query.filter_by(is_active=True).filter(*filter_clauses(filters))
+    if sort == 'rating':
+        # Denormalized aggregates (reviews.py): an index scan, no GROUP BY over reviews
+        query = query.order_by(Product.rating_avg.desc().nullslast(), Product.rating_count.desc())
+    elif sort == 'price_asc':
+        query = query.order_by(Product.price.asc())
+    elif sort == 'price_desc':
+        query = query.order_by(Product.price.desc())
+    elif sort == 'newest':
+        query = query.order_by(Product.created_at.desc())
+    products = query.order_by(Product.id).offset((page - 1) * per_page).limit(per_page).all()
+
+    # Convert to dict format for template compatibility
+    products_list = [{
+        'id': p.id,
+        'name': p.name,
+        'sku': p.sku,
+        'price': float(p.price),
+        'compare_price': float(p.compare_price) if p.compare_price else None,
+        'image': p.image_url,  # Map image_url to 'image' for template
+        'description': p.description,
+        'category': p.category.name if p.category else 'Uncategorized',
+        'rating': float(p.rating_avg) if p.rating_avg is not None else None,
+        'rating_count': p.rating_count,
+        'in_stock': p.in_stock,
+        'stock_quantity': p.stock_quantity,
+        'weight': float(p.weight) if p.weight else 0,
+        'brand': p.brand,
+    } for p in products]
+
+    category_tree = db.session.query(Category.id, Category.name, Category.parent_id, Category.depth) \
+        .order_by(Category.path).all()
+    facets = facet_groups(facet_counts, filters, category_tree)
+
+    # Breadcrumbs when browsing a single category: its path, in one query
+    trail = []
+    if len(filters.get('category', ())) == 1:
+        trail = breadcrumbs(db.session.get(Category, filters['category'][0]))
+
+    base_args = [(key, value) for key, value in request.args.items(multi=True) if key != 'page']
+    return render_template('catalog.html', products=products_list, selected_sort=sort,
+                           facets=facets, breadcrumbs=trail, total=total, page=page,
+                           pages=max((total + per_page - 1) // per_page, 1),
+                           base_query=urlencode(base_args))
+
+
+@shop_bp.route('/product/<int:product_id>')
+@replica_reads
+def product_detail(product_id):
+    # Get product from database
+    product = Product.query.get_or_404(product_id)
+
+    product_dict = {
+        'id': product.id,
+        'name': product.name,
+        'sku': product.sku,
+        'price': float(product.price),
+        'compare_price': float(product.compare_price) if product.compare_price else None,
+        'image': product.image_url,
+        'description': product.description,
+        'category': product.category.name if product.category else 'Uncategorized',
+        'rating': float(product.rating_avg) if product.rating_avg is not None else None,
+        'rating_count': product.rating_count,
+        'in_stock': product.in_stock,
+        'stock_quantity': product.stock_quantity,
+        'weight': float(product.weight) if product.weight else 0,
+        'brand': product.brand,
+    }
+
+    # Precomputed by `flask recommendations-build`; one lookup on product_recommendations
+    recommendations = [{
+        'id': p.id,
+        'name': p.name,
+        'price': float(p.price),
+        'image': p.image_url,
+    } for p in recommended_products(product.id)]
+
+    reviews = product_reviews(product.id, page=request.args.get('page', 1, type=int))
+    my_review = None
+    if 'user_id' in session:
+        my_review = Review.query.filter_by(product_id=product.id, user_id=session['user_id']).first()
+
+    return render_template('product_detail.html', product=product_dict, recommendations=recommendations,
+                           reviews=reviews, my_review=my_review, breadcrumbs=breadcrumbs(product.category))
+
+
+@shop_bp.post('/product/<int:product_id>/reviews')
+@login_required
+def review_submit(product_id):
+    """Create or update the logged-in user's review of a product"""
+    product = Product.query.get_or_404(product_id)
+    title = request.form.get('title', '').strip()
+    body = request.form.get('body', '').strip()
+
+    try:
+        review, created = submit_review(product, session['user_id'], request.form.get('rating'),
+                                        title=title or None, body=body or None)
+        db.session.commit()
+        flash('Thanks for your review!' if created else 'Your review has been updated.', 'success')
+    except ValueError as e:
+        db.session.rollback()
+        flash(str(e), 'error')
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception('Error saving review', extra={'product_id': product_id})
+        flash('Could not save your review. Please try again.', 'error')
+
+    return redirect(url_for('shop.product_detail', product_id=product_id))
+
+
+@shop_bp.post('/reviews/<int:review_id>/delete')
+@login_required
+def review_delete(review_id):
+    """Delete a review (its author or an admin)"""
+    review = Review.query.get_or_404(review_id)
+    product_id = review.product_id
+    if review.user_id != session['user_id'] and not is_admin():
+        flash('You can only delete your own reviews.', 'error')
+        return redirect(url_for('shop.product_detail', product_id=product_id))
+
+    try:
+        delete_review(review)
+        db.session.commit()
+        flash('Review deleted.', 'success')
+    except Exception:
+        db.session.rollback()
+        current_app.logger.exception('Error deleting review', extra={'review_id': review_id})
+        flash('Could not delete the review. Please try again.', 'error')
+
+    return redirect(url_for('shop.product_detail', product_id=product_id))
+
+
+@shop_bp.route('/api/product/<int:product_id>')
+@replica_reads
+def api_product(product_id):
+    # Get product from database
+    product = Product.query.get(product_id)
+    if not product:
+        return jsonify({'error': 'Product not found'}), 404
+
+    return jsonify({
+        'id': product.id,
+        'name': product.name,
+        'sku': product.sku,
+        'price': float(product.price),
+        'compare_price': float(product.compare_price) if product.compare_price else None,
+        'image': product.image_url,  # Frontend expects 'image'
+        'description': product.description,
+        'category': product.category.name if product.category else 'Uncategorized',
+        'rating': float(product.rating_avg) if product.rating_avg is not None else None,
+        'rating_count': product.rating_count,
+        'in_stock': product.in_stock,
+        'stock_quantity': product.stock_quantity,
+        'weight': float(product.weight) if product.weight else 0,
+        'brand': product.brand,
+    })
+
+
+@shop_bp.route('/api/product/<int:product_id>/reviews')
+@replica_reads
+def api_product_reviews(product_id):
+    """Newest reviews of a product; ?page=&per_page="""
+    product = Product.query.get(product_id)
+    if not product:
+        return jsonify({'error': 'Product not found'}), 404
+
+    per_page = min(request.args.get('per_page', 10, type=int), 50)
+    reviews = product_reviews(product_id, page=request.args.get('page', 1, type=int), per_page=per_page)
+    return jsonify({
+        'rating': float(product.rating_avg) if product.rating_avg is not None else None,
+        'rating_count': product.rating_count,
+        'page': reviews.page,
+        'pages': reviews.pages,
+        'reviews': [review.to_dict() for review in reviews.items]
+    })
+
+
+@shop_bp.route('/api/recommendations')
+@replica_reads
+def api_recommendations():
+    """Frequently bought together with the products in ?ids=1,2,3 (the cart)"""
+    ids = [int(value) for value in request.args.get('ids', '').split(',') if value.strip().isdigit()]
+    limit = min(request.args.get('limit', 4, type=int), 20)
+
+    return jsonify({
+        'products': [{
+            'id': p.id,
+            'name': p.name,
+            'price': float(p.price),
+            'image': p.image_url,
+        } for p in recommended_for_cart(ids, limit)]
+    })
+
+
+@shop_bp.route('/cart')
+def cart():
+    return render_template('cart.html')
+
+
+@shop_bp.get('/checkout')
+def checkout():
+    return render_template('checkout.html', client_id=current_app.config['PAYPAL_CLIENT_ID'])
+
+
+@shop_bp.post('/api/place-order')
+@idempotent
+def place_order():
+    order_data = request.get_json()
+
+    items = order_data.get('items', [])
+    totals = order_data.get('totals', {})
+    bill_info = order_data.get('billing', {})
+
+    if not items or not bill_info:
+        return jsonify({'success': False, 'message': 'Invalid order data'}), 400
+
+    name = bill_info.get('fullName', '')
+    email = bill_info.get('email', '')
+    phone = bill_info.get('phone', '')
+    address = bill_info.get('address', '')
+    city = bill_info.get('city', '')
+    state = bill_info.get('state', '')
+    zip_code = bill_info.get('zipCode', '')
+    country = bill_info.get('country', '')
+    notes = bill_info.get('notes', '')
+
+    order_number = None
+    try:
+        order_number = new_order_number()
+
+        order = Order(
+            order_number=order_number,
+            user_id=session.get('user_id'),
+            customer_name=name,
+            customer_email=email,
+            customer_phone=phone,
+            shipping_address=address,
+            shipping_city=city,
+            shipping_state=state,
+            shipping_zip=zip_code,
+            shipping_country=country,
+            subtotal=totals.get('subtotal', 0),
+            shipping_cost=totals.get('shipping', 0),
+            tax=totals.get('tax', 0),
+            total=totals.get('total', 0),
+            status='pending',
+            payment_status='pending',
+            customer_notes=notes
+        )
+
+        db.session.add(order)
+        db.session.flush()
+
+        stock_lines = []
+        for item in items:
+            product = Product.query.get(item.get('id'))
+
+            if not product:
+                raise Exception(f"Product ID {item.get('id')} not found")
+
+            if not product.is_active:
+                raise Exception(f"Product '{product.name}' is no longer available")
+
+            order_item = OrderItem(
+                order_id=order.id,
+                product_id=product.id,
+                product_name=product.name,
+                product_sku=product.sku,
+                product_image=product.image_url or item.get('image'),
+                price=float(item.get('price')),
+                quantity=item.get('quantity'),
+                subtotal=float(item.get('price')) * item.get('quantity')
+            )
+            db.session.add(order_item)
+            stock_lines.append((product, item.get('quantity')))
+
+        # Conditional decrements: raises InsufficientStock instead of overselling
+        take_stock_for_order(order, stock_lines)
+
+        db.session.commit()
+        current_app.logger.info('Order created', extra={
+            'order_number': order_number, 'order_id': order.id, 'items': len(items), 'total': totals.get('total', 0)})
+
+        # Queue Telegram alert; the notifier batches and rate-limits delivery
+        get_telegram_notifier().notify_order({
+            'order_number': order_number,
+            'name': name,
+            'email': email,
+            'phone': phone,
+            'address': f"{address}, {city}, {state} {zip_code}, {country}",
+            'items': items,
+            'totals': totals
+        })
+
+        # Queue confirmation email; pooled SMTP workers deliver it
+        get_mailer().send_order_confirmation(
+            order_number=order_number,
+            name=name,
+            email=email,
+            phone=phone,
+            address=f"{address}, {city}, {state} {zip_code}, {country}".strip(', '),
+            billing=bill_info,
+            items=items,
+            totals=totals,
+            notes=notes
+        )
+
+        return jsonify({
+            'success': True,
+            'message': 'Order placed successfully',
+            'order_number': order_number,
+            'order_id': order.id
+        }), 201
+
+    except InsufficientStock as e:
+        db.session.rollback()
+        current_app.logger.info('Order rejected for stock', extra={
+            'order_number': order_number, 'product_id': e.product.id, 'requested': e.requested})
+        return jsonify({'success': False, 'message': str(e)}), 409
+
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.exception('Error placing order', extra={'order_number': order_number})
+        return jsonify({
+            'success': False,
+            'message': f'Error placing order: {str(e)}'
+        }), 500
+
+
+# ORDER HISTORY AND TRACKING
+
+@shop_bp.route('/orders')
+@login_required
+@replica_reads
+def my_orders():
+    """The logged-in customer's orders, newest first; ?before=<cursor> for older ones"""
+    cursor = request.args.get('before')
+    page, next_cursor = history_page(session['user_id'], before=decode_cursor(cursor))
+
+    # Validators straight from the index; a refresh with nothing new is a 304
+    etag = etag_for('orders', session['user_id'], cursor, [(row[1], row[2], row[3]) for row in page])
+    last_modified = max((row[2] for row in page), default=None)
+    if not_modified(etag, last_modified):
+        return with_validators(make_response('', 304), etag, last_modified)
+
+    response = make_response(render_template('orders.html', orders=load_page(page), next_cursor=next_cursor,
+                                             first_page=cursor is None))
+    return with_validators(response, etag, last_modified)
+
+
+@shop_bp.route('/orders/<order_number>')
+@replica_reads
+def order_status(order_number):
+    """One order, for its customer or a session that tracked it"""
+    version = order_version(order_number)
+    if version is None or not can_view(version[1], order_number):
+        abort(404)
+    order_id, _, _, changed_at, archived = version
+
+    etag = etag_for('order', order_id, changed_at, archived)
+    if not_modified(etag, changed_at):
+        return with_validators(make_response('', 304), etag, changed_at)
+
+    if archived:
+        order = restore(ArchivedOrder.query.filter_by(id=order_id).first_or_404())
+    else:
+        order = Order.query.get_or_404(order_id)
+    response = make_response(render_template('order_status.html', order=order, items=list(order.items),
+                                             archived=archived))
+    return with_validators(response, etag, changed_at)
+
+
+@shop_bp.route('/api/orders/<order_number>')
+@replica_reads
+def api_order_status(order_number):
+    """Status of one order for polling; send If-None-Match to get a 304 while it hasn't changed"""
+    version = order_version(order_number)
+    if version is None or not can_view(version[1], order_number):
+        return jsonify({'error': 'Order not found'}), 404
+    order_id, _, _, changed_at, archived = version
+
+    etag = etag_for('order', order_id, changed_at, archived)
+    if not_modified(etag, changed_at):
+        return with_validators(make_response('', 304), etag, changed_at)
+
+    if archived:
+        archived_order = ArchivedOrder.query.filter_by(id=order_id).first_or_404()
+        status, payment_status = archived_order.status, restore(archived_order).payment_status
+    else:
+        order = Order.query.get_or_404(order_id)
+        status, payment_status = order.status, order.payment_status
+    response = jsonify({
+        'order_number': order_number,
+        'status': status,
+        'payment_status': payment_status,
+        'updated_at': changed_at.isoformat(),
+    })
+    return with_validators(response, etag, changed_at)
+
+
+@shop_bp.route('/track')
+def track_order():
+    return render_template('track_order.html')
+
+
+@shop_bp.post('/track')
+def track_order_lookup():
+    """Find an order by its number and email; the session may then view it"""
+    order_number = request.form.get('order_number', '').strip().upper()
+    email = request.form.get('email', '').strip()
+
+    if not order_number or not email:
+        flash('Order number and email are required.', 'error')
+        return redirect(url_for('shop.track_order'))
+
+    if not find_tracked_order(order_number, email):
+        # Same message either way, so the form can't be used to probe order numbers
+        flash('No order matches that order number and email.', 'error')
+        return redirect(url_for('shop.track_order'))
+
+    remember_tracked(order_number)
+    return redirect(url_for('shop.order_status', order_number=order_number))
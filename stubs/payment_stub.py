@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Bakong and PayPal APIs
+
+Bakong:  POST /v1/payments/create, GET /v1/payments/qr/<id>,
+         GET /v1/payments/status/<id>
+PayPal:  POST /v1/oauth2/token, POST /v2/checkout/orders
+
+Every call can be slowed down by a fixed latency to mimic the real gateways.
+
+Usage:
+  python stubs/payment_stub.py [port] [latency_ms]
+
+Then run the app with BAKONG_API_URL and PAYPAL_API_URL set to
+http://127.0.0.1:<port>
+"""
+import json
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class PaymentStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.0):
+        super().__init__(address, PaymentStubHandler)
+        self.latency = latency
+        self.payments = {}
+        self.orders = {}
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self):
+        with self._lock:
+            self.calls += 1
+
+
+class PaymentStubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        raw = self.rfile.read(length) if length else b''
+        try:
+            return json.loads(raw or b'{}')
+        except ValueError:
+            return {}
+
+    def _handle(self):
+        self.server.count()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def do_POST(self):
+        self._handle()
+        body = self._body()
+
+        if self.path == '/v1/payments/create':
+            payment_id = f"BKG-{uuid.uuid4().hex[:12]}"
+            self.server.payments[payment_id] = {'payment_id': payment_id, 'status': 'pending',
+                                                'amount': body.get('amount'), 'order_id': body.get('order_id')}
+            return self._reply(200, self.server.payments[payment_id])
+
+        if self.path == '/v1/oauth2/token':
+            return self._reply(200, {'access_token': uuid.uuid4().hex, 'token_type': 'Bearer', 'expires_in': 32400})
+
+        if self.path == '/v2/checkout/orders':
+            order_id = uuid.uuid4().hex[:17].upper()
+            self.server.orders[order_id] = body
+            return self._reply(201, {'id': order_id, 'status': 'CREATED', 'links': []})
+
+        self._reply(404, {'error': 'Not Found'})
+
+    def do_GET(self):
+        self._handle()
+
+        if self.path.startswith('/v1/payments/qr/'):
+            payment_id = self.path.rsplit('/', 1)[1]
+            return self._reply(200, {'payment_id': payment_id, 'qr_code': f'BAKONG-QR:{payment_id}'})
+
+        if self.path.startswith('/v1/payments/status/'):
+            payment = self.server.payments.get(self.path.rsplit('/', 1)[1])
+            if payment is None:
+                return self._reply(404, {'error': 'Payment not found'})
+            return self._reply(200, payment)
+
+        self._reply(404, {'error': 'Not Found'})
+
+
+def start(port=0, latency=0.0):
+    """Start the stub in a background thread and return the server"""
+    server = PaymentStub(('127.0.0.1', port), latency=latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8082
+    latency_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 0
+    server = PaymentStub(('127.0.0.1', port), latency=latency_ms / 1000)
+    print(f"Payment stub listening on {server.url} ({latency_ms:.0f} ms latency)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nHandled {server.calls} calls, {len(server.payments)} Bakong payments, "
+              f"{len(server.orders)} PayPal orders")
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Local SMTP sink for mail throughput tests
+
+Speaks just enough SMTP (EHLO/HELO, MAIL, RCPT, DATA, RSET, NOOP, QUIT) to
+accept messages from smtplib, counts them and throws them away. No TLS or
+AUTH, so run the app with MAIL_USE_TLS=false and an empty MAIL_PASSWORD.
+
+Usage:
+  python stubs/smtp_sink.py [port]
+"""
+import socketserver
+import sys
+import threading
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, keep_messages=False):
+        super().__init__(address, SMTPSinkHandler)
+        self.keep_messages = keep_messages
+        self.messages = []
+        self.message_count = 0
+        self.connection_count = 0
+        self._lock = threading.Lock()
+
+    def record(self, sender, recipients, data):
+        with self._lock:
+            self.message_count += 1
+            if self.keep_messages:
+                self.messages.append({'from': sender, 'to': recipients, 'data': data})
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line):
+        self.wfile.write(f'{line}\r\n'.encode())
+
+    def handle(self):
+        with self.server._lock:
+            self.server.connection_count += 1
+        self.reply('220 localhost SMTP sink ready')
+
+        sender, recipients = None, []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode(errors='replace').strip()
+            verb = command[:4].upper()
+
+            if verb == 'EHLO':
+                self.reply('250-localhost')
+                self.reply('250 8BITMIME')
+            elif verb == 'HELO':
+                self.reply('250 localhost')
+            elif verb == 'MAIL':
+                sender, recipients = command[10:].strip(), []
+                self.reply('250 OK')
+            elif verb == 'RCPT':
+                recipients.append(command[8:].strip())
+                self.reply('250 OK')
+            elif verb == 'DATA':
+                self.reply('354 End data with <CR><LF>.<CR><LF>')
+                data = []
+                while True:
+                    chunk = self.rfile.readline()
+                    if not chunk or chunk in (b'.\r\n', b'.\n'):
+                        break
+                    data.append(chunk)
+                self.server.record(sender, recipients, b''.join(data))
+                sender, recipients = None, []
+                self.reply('250 OK: queued')
+            elif verb == 'RSET':
+                sender, recipients = None, []
+                self.reply('250 OK')
+            elif verb == 'NOOP':
+                self.reply('250 OK')
+            elif verb == 'QUIT':
+                self.reply('221 Bye')
+                return
+            else:
+                self.reply('502 Command not implemented')
+
+
+def start(port=0, keep_messages=False):
+    """Start the sink in a background thread and return the server"""
+    server = SMTPSink(('127.0.0.1', port), keep_messages=keep_messages)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8025
+    server = SMTPSink(('127.0.0.1', port))
+    print(f"SMTP sink listening on 127.0.0.1:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nReceived {server.message_count} messages over {server.connection_count} connections")
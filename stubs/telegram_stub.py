@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Telegram Bot API
+
+Accepts POST /bot<token>/sendMessage, records every message and enforces a
+per-chat rate limit, answering 429 with ``retry_after`` like the real API.
+
+Usage:
+  python stubs/telegram_stub.py [port] [messages_per_second_per_chat]
+
+Then run the app with TELEGRAM_API_URL=http://127.0.0.1:<port>
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class TelegramStub(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, chat_rate=1.0):
+        super().__init__(address, TelegramStubHandler)
+        self.chat_rate = chat_rate
+        self.messages = []
+        self.rejected = 0
+        self._last_sent = {}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def accept(self, chat_id, text):
+        """Record a message, or return seconds to wait if the chat is over its limit"""
+        with self._lock:
+            now = time.monotonic()
+            last = self._last_sent.get(chat_id)
+            interval = 1.0 / self.chat_rate
+            if last is not None and now - last < interval:
+                self.rejected += 1
+                return interval - (now - last)
+            self._last_sent[chat_id] = now
+            self.messages.append({'chat_id': chat_id, 'text': text, 'at': time.time()})
+            return 0
+
+
+class TelegramStubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if not self.path.endswith('/sendMessage'):
+            return self._reply(404, {'ok': False, 'error_code': 404, 'description': 'Not Found'})
+
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        chat_id = str(payload.get('chat_id', ''))
+        text = payload.get('text', '')
+
+        if not chat_id or not text:
+            return self._reply(400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: message text is empty'})
+
+        wait = self.server.accept(chat_id, text)
+        if wait:
+            retry_after = max(1, int(wait + 0.999))
+            return self._reply(429, {
+                'ok': False,
+                'error_code': 429,
+                'description': f'Too Many Requests: retry after {retry_after}',
+                'parameters': {'retry_after': retry_after}
+            })
+
+        self._reply(200, {'ok': True, 'result': {'message_id': len(self.server.messages), 'text': text}})
+
+
+def start(port=0, chat_rate=1.0):
+    """Start the stub in a background thread and return the server"""
+    server = TelegramStub(('127.0.0.1', port), chat_rate=chat_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8081
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+    server = TelegramStub(('127.0.0.1', port), chat_rate=rate)
+    print(f"Telegram stub listening on {server.url} ({rate} msg/s per chat)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nReceived {len(server.messages)} messages, rejected {server.rejected} with 429")
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for a trace collector
+
+Accepts POST /v1/spans with {"spans": [...]} as sent by the app's
+HTTPExporter (monitoring/tracing.py), keeps every span in memory and, if
+given an output file, appends them as JSON lines that
+``python -m monitoring.tracing`` can summarize. GET /v1/traces/<id> returns
+the spans of one trace.
+
+Usage:
+  python stubs/trace_collector.py [port] [output.jsonl]
+
+Then run the app with TRACING=true TRACE_COLLECTOR_URL=http://127.0.0.1:<port>/v1/spans
+"""
+import json
+import sys
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class TraceCollector(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, output=None):
+        super().__init__(address, TraceCollectorHandler)
+        self.output = output
+        self.traces = defaultdict(list)
+        self.span_count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def accept(self, spans):
+        with self._lock:
+            for span in spans:
+                self.traces[span['trace_id']].append(span)
+            self.span_count += len(spans)
+            if self.output:
+                with open(self.output, 'a', encoding='utf-8') as handle:
+                    handle.write(''.join(json.dumps(span) + '\n' for span in spans))
+
+
+class TraceCollectorHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path != '/v1/spans':
+            return self._reply(404, {'error': 'Not Found'})
+        length = int(self.headers.get('Content-Length', 0))
+        try:
+            spans = json.loads(self.rfile.read(length) or b'{}').get('spans', [])
+        except ValueError:
+            return self._reply(400, {'error': 'Invalid JSON'})
+        self.server.accept(spans)
+        self._reply(202, {'accepted': len(spans)})
+
+    def do_GET(self):
+        if not self.path.startswith('/v1/traces/'):
+            return self._reply(404, {'error': 'Not Found'})
+        trace_id = self.path.rsplit('/', 1)[-1]
+        with self.server._lock:
+            spans = list(self.server.traces.get(trace_id, []))
+        self._reply(200 if spans else 404, {'trace_id': trace_id, 'spans': spans})
+
+
+def start(port=0, output=None):
+    """Start the collector in a background thread and return the server"""
+    server = TraceCollector(('127.0.0.1', port), output=output)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 4318
+    output = sys.argv[2] if len(sys.argv) > 2 else None
+    server = TraceCollector(('127.0.0.1', port), output=output)
+    print(f"Trace collector listening on {server.url}/v1/spans" + (f", writing {output}" if output else ''))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\nReceived {server.span_count} spans in {len(server.traces)} traces")
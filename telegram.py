@@ -1,13 +1,55 @@
-from http.client import responses
+import os
 
 import requests
-import time
-token =  '7808540343:AAEq_c473X_U3BSM-ofTyFKLmgwS6G3GOvs'
-def sendMessage(chat_id: str, message: str ):
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
+
+from monitoring.metrics import track_outbound
+from monitoring.tracing import inject_headers
+
+token = os.environ.get('TELEGRAM_BOT_TOKEN')
+# Point at a local stub bot API for testing, e.g. http://127.0.0.1:8081
+api_url = os.environ.get('TELEGRAM_API_URL', 'https://api.telegram.org')
+
+# Telegram rejects messages longer than this
+MAX_MESSAGE_LENGTH = 4096
+
+
+class TelegramError(Exception):
+    """Raised when the Bot API rejects a request"""
+
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+def sendMessage(chat_id: str, message: str, http=None, timeout=10, bot_token=None):
+    """Send an HTML message, raising TelegramError on failure"""
+    bot_token = bot_token or token
+    if not bot_token:
+        raise TelegramError('TELEGRAM_BOT_TOKEN is not set')
+    url = f"{api_url}/bot{bot_token}/sendMessage"
     payload = {
         "chat_id": chat_id,
         "text": message,
         "parse_mode": "HTML",
     }
-    response = requests.post(url, json=payload)
+    with track_outbound('telegram', 'sendMessage'):
+        response = (http or requests).post(url, json=payload, headers=inject_headers(), timeout=timeout)
+
+        try:
+            body = response.json()
+        except ValueError:
+            body = {}
+
+        if response.status_code == 429:
+            retry_after = body.get('parameters', {}).get('retry_after')
+            if retry_after is None:
+                retry_after = response.headers.get('Retry-After', 1)
+            raise TelegramError(body.get('description', 'Too Many Requests'),
+                                status_code=429, retry_after=float(retry_after))
+
+        if not response.ok or not body.get('ok', False):
+            raise TelegramError(body.get('description', f'HTTP {response.status_code}'),
+                                status_code=response.status_code)
+
+    return body
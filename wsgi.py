@@ -0,0 +1,8 @@
+"""
+WSGI entry point: ``gunicorn wsgi:app``
+
+Importing app.py only defines the factory; the app is built here, once.
+"""
+from app import create_app
+
+app = create_app()